@@ -0,0 +1,36 @@
+-- ====================================================================
+-- ENMS DEMO - Admin user listing indexes
+-- Purpose: Keyset pagination and substring search for /api/admin/users
+-- Safe to re-run against an existing database (all statements are idempotent)
+-- ====================================================================
+
+-- pg_trgm lets GIN indexes answer ILIKE '%term%' predicates, which the
+-- B-tree indexes in 04_auth_schema.sql cannot.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- ====================================================================
+-- 1. TRIGRAM SEARCH INDEXES
+-- ====================================================================
+-- One index per searched column; the planner combines them with a
+-- BitmapOr for the OR'ed ILIKE predicates in admin_get_users().
+CREATE INDEX IF NOT EXISTS idx_demo_users_email_trgm
+    ON public.demo_users USING GIN (email gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_demo_users_full_name_trgm
+    ON public.demo_users USING GIN (full_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_demo_users_organization_trgm
+    ON public.demo_users USING GIN (organization gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_demo_users_country_trgm
+    ON public.demo_users USING GIN (country gin_trgm_ops);
+
+-- ====================================================================
+-- 2. KEYSET PAGINATION INDEX
+-- ====================================================================
+-- Matches ORDER BY created_at DESC, id DESC and the (created_at, id) < (...)
+-- cursor predicate, so every page is a bounded index range scan.
+CREATE INDEX IF NOT EXISTS idx_demo_users_created_at_id
+    ON public.demo_users (created_at DESC, id DESC);
+
+DO $$
+BEGIN
+    RAISE NOTICE '✓ Admin user search indexes created (pg_trgm + keyset)';
+END $$;
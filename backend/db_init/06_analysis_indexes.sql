@@ -0,0 +1,21 @@
+-- ====================================================================
+-- ENMS DEMO - Analysis series indexes
+-- Purpose: Per-device ordered scans for /api/analysis/series
+-- Safe to re-run against an existing database (all statements are idempotent)
+-- ====================================================================
+
+-- The (timestamp, device_id) primary keys serve time-range scans across all
+-- devices. The analysis service reads one device's rows in timestamp order,
+-- which these indexes answer as a single bounded range scan per chunk.
+-- TimescaleDB creates them on every existing and future hypertable chunk.
+CREATE INDEX IF NOT EXISTS idx_energy_data_device_time
+    ON public.energy_data (device_id, "timestamp" DESC);
+CREATE INDEX IF NOT EXISTS idx_printer_status_device_time
+    ON public.printer_status (device_id, "timestamp" DESC);
+CREATE INDEX IF NOT EXISTS idx_environment_data_device_time
+    ON public.environment_data (device_id, "timestamp" DESC);
+
+DO $$
+BEGIN
+    RAISE NOTICE '✓ Analysis series indexes created (device_id, timestamp)';
+END $$;
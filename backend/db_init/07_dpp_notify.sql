@@ -0,0 +1,44 @@
+-- ====================================================================
+-- ENMS DEMO - DPP change notifications
+-- Purpose: Feed the /api/dpp/events stream with LISTEN/NOTIFY
+-- Safe to re-run against an existing database (all statements are idempotent)
+-- ====================================================================
+
+-- Every write to the tables behind the DPP cards notifies the 'dpp_changes'
+-- channel with the table and device it touched. The python-api listens on
+-- one connection, rebuilds the fleet once per burst of notifications and
+-- pushes the cards that changed to all connected viewers.
+-- Identical payloads raised in one transaction are delivered once, so a
+-- multi-row insert for one device costs a single notification.
+CREATE OR REPLACE FUNCTION public.notify_dpp_change() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM pg_notify('dpp_changes', json_build_object(
+        'table', TG_TABLE_NAME,
+        'device_id', NEW.device_id
+    )::text);
+    RETURN NULL;
+END;
+$$;
+
+-- Row triggers are supported on hypertables; TimescaleDB propagates them to
+-- every chunk.
+DROP TRIGGER IF EXISTS trg_printer_status_dpp_notify ON public.printer_status;
+CREATE TRIGGER trg_printer_status_dpp_notify
+    AFTER INSERT ON public.printer_status
+    FOR EACH ROW EXECUTE FUNCTION public.notify_dpp_change();
+
+DROP TRIGGER IF EXISTS trg_energy_data_dpp_notify ON public.energy_data;
+CREATE TRIGGER trg_energy_data_dpp_notify
+    AFTER INSERT ON public.energy_data
+    FOR EACH ROW EXECUTE FUNCTION public.notify_dpp_change();
+
+DROP TRIGGER IF EXISTS trg_print_jobs_dpp_notify ON public.print_jobs;
+CREATE TRIGGER trg_print_jobs_dpp_notify
+    AFTER INSERT OR UPDATE ON public.print_jobs
+    FOR EACH ROW EXECUTE FUNCTION public.notify_dpp_change();
+
+DO $$
+BEGIN
+    RAISE NOTICE '✓ DPP change notifications installed (channel dpp_changes)';
+END $$;
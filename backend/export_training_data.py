@@ -1,9 +1,14 @@
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import psycopg2
 import sys
 import os
+import json
+import uuid
+import shutil
 
-# --- Database Connection Details 
+# --- Database Connection Details
 DB_NAME = os.environ.get("POSTGRES_DB")
 DB_USER = os.environ.get("POSTGRES_USER")
 DB_PASS = os.environ.get("POSTGRES_PASSWORD")
@@ -11,8 +16,108 @@ DB_HOST = os.environ.get("POSTGRES_HOST")
 DB_PORT = os.environ.get("POSTGRES_PORT")
 
 
-# --- Output File ---
-OUTPUT_CSV_FILE = 'printer_energy_data_raw.csv'
+# --- Output Dataset ---
+# Parquet dataset partitioned as device_id=<id>/month=<YYYY-MM>/part-*.parquet
+OUTPUT_DATASET_DIR = 'printer_energy_data'
+# Last exported energy_data timestamp per device, used by incremental mode.
+# The leading underscore keeps Parquet readers from treating it as data.
+WATERMARK_FILE = os.path.join(OUTPUT_DATASET_DIR, '_watermarks.json')
+# Rows fetched per round trip from the server-side cursors
+CHUNK_ROWS = int(os.environ.get("EXPORT_CHUNK_ROWS", 200000))
+
+# --- Export Mode ---
+# Incremental mode adds only rows newer than each device's watermark to the
+# existing dataset. Full mode (the default) rebuilds the dataset and resets the watermarks.
+# Enable with --incremental or EXPORT_INCREMENTAL=true; --full forces a rebuild.
+INCREMENTAL = os.environ.get("EXPORT_INCREMENTAL", "false").lower() in ("1", "true", "yes")
+if '--incremental' in sys.argv[1:]:
+    INCREMENTAL = True
+if '--full' in sys.argv[1:]:
+    INCREMENTAL = False
+
+STATUS_COLUMNS = [
+    'state_text', 'is_operational', 'is_printing', 'is_paused', 'is_error',
+    'is_busy', 'is_sd_ready', 'nozzle_temp_actual', 'nozzle_temp_target',
+    'bed_temp_actual', 'bed_temp_target', 'z_height_mm', 'speed_multiplier_percent',
+    'material', 'ambient_temp_c'
+]
+ENERGY_COLUMNS = [
+    'timestamp', 'device_id', 'power_watts', 'energy_total_wh',
+    'voltage', 'current_amps', 'plug_temp_c'
+]
+OUTPUT_COLUMNS = ENERGY_COLUMNS + STATUS_COLUMNS
+
+# Column types mirror the energy_data / printer_status tables, so readers get
+# typed columns without any parsing. device_id and month are partition keys.
+OUTPUT_SCHEMA = pa.schema([
+    ('timestamp', pa.timestamp('us', tz='UTC')),
+    ('device_id', pa.string()),
+    ('power_watts', pa.float64()),
+    ('energy_total_wh', pa.float64()),
+    ('voltage', pa.float64()),
+    ('current_amps', pa.float64()),
+    ('plug_temp_c', pa.float64()),
+    ('state_text', pa.string()),
+    ('is_operational', pa.bool_()),
+    ('is_printing', pa.bool_()),
+    ('is_paused', pa.bool_()),
+    ('is_error', pa.bool_()),
+    ('is_busy', pa.bool_()),
+    ('is_sd_ready', pa.bool_()),
+    ('nozzle_temp_actual', pa.float64()),
+    ('nozzle_temp_target', pa.float64()),
+    ('bed_temp_actual', pa.float64()),
+    ('bed_temp_target', pa.float64()),
+    ('z_height_mm', pa.float64()),
+    ('speed_multiplier_percent', pa.float64()),
+    ('material', pa.string()),
+    ('ambient_temp_c', pa.float32()),
+    ('month', pa.string()),
+])
+
+
+def load_watermarks():
+    """Returns {device_id: pd.Timestamp} from the watermark file, or {} if absent."""
+    if not os.path.exists(WATERMARK_FILE):
+        return {}
+    try:
+        with open(WATERMARK_FILE) as f:
+            raw = json.load(f)
+        return {device_id: pd.Timestamp(ts) for device_id, ts in raw.items()}
+    except Exception as e:
+        print(f"Warning: could not read {WATERMARK_FILE} ({e}); falling back to a full export.")
+        return {}
+
+
+def save_watermarks(watermarks, path):
+    """Writes the watermark file atomically so a crash never leaves it half-written."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({device_id: ts.isoformat() for device_id, ts in sorted(watermarks.items())}, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def fetch_frame(cursor, columns):
+    """Fetches the next chunk from a server-side cursor as a DataFrame (empty when exhausted)."""
+    rows = cursor.fetchmany(CHUNK_ROWS)
+    df = pd.DataFrame.from_records(rows, columns=columns)
+    df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+    return df
+
+
+def write_chunk(df, dataset_dir, run_id, chunk_index):
+    """Appends one joined chunk to the partitioned dataset."""
+    df = df.copy()
+    df['month'] = df['timestamp'].dt.strftime('%Y-%m')
+    table = pa.Table.from_pandas(df, schema=OUTPUT_SCHEMA, preserve_index=False)
+    pq.write_to_dataset(
+        table,
+        root_path=dataset_dir,
+        partition_cols=['device_id', 'month'],
+        # Unique per run and chunk, so incremental runs never overwrite earlier parts
+        basename_template=f"part-{run_id}-{chunk_index:05d}-{{i}}.parquet",
+        compression='zstd'
+    )
 
 print("Connecting to database...")
 try:
@@ -28,57 +133,125 @@ except Exception as e:
     print(f"Error connecting to database: {e}")
     sys.exit(1)
 
-# --- SQL Query to Join Energy and Status Data (MODIFIED) ---
-# Fetches all energy data points and finds the latest status
-# at or before each energy timestamp for the SAME device.
-# MODIFIED: Added ps.material and ps.ambient_temp_c
-sql_query = """
-SELECT
-    ed.timestamp,
-    ed.device_id,
-    ed.power_watts,
-    ed.energy_total_wh,
-    ed.voltage,
-    ed.current_amps,
-    ed.plug_temp_c,
-    ps.state_text,
-    ps.is_operational,
-    ps.is_printing,
-    ps.is_paused,
-    ps.is_error,
-    ps.is_busy,
-    ps.is_sd_ready,
-    ps.nozzle_temp_actual,
-    ps.nozzle_temp_target,
-    ps.bed_temp_actual,
-    ps.bed_temp_target,
-    ps.z_height_mm,
-    ps.speed_multiplier_percent,
-    ps.material,              -- <<< ADDED
-    ps.ambient_temp_c          -- <<< ADDED
-FROM energy_data ed
-LEFT JOIN LATERAL (
+watermarks = load_watermarks() if INCREMENTAL else {}
+if INCREMENTAL and not watermarks:
+    print("No previous export found, running a full export.")
+    INCREMENTAL = False
+print(f"Export mode: {'incremental' if INCREMENTAL else 'full'}"
+      + (f" ({len(watermarks)} device watermarks)" if INCREMENTAL else ""))
+
+# --- SQL Queries ---
+# Energy rows and status rows are streamed separately, each with one ordered
+# scan, and joined as-of in pandas below, chunk by chunk.
+# The watermark CTE holds the last exported timestamp per device; devices
+# missing from it (new devices, or a full export) are exported in full.
+WATERMARK_CTE = """
+WITH wm AS (
     SELECT
-        state_text, is_operational, is_printing, is_paused, is_error,
-        is_busy, is_sd_ready, nozzle_temp_actual, nozzle_temp_target,
-        bed_temp_actual, bed_temp_target, z_height_mm, speed_multiplier_percent,
-        material, ambient_temp_c -- Match columns here
-    FROM printer_status
-    WHERE
-        device_id = ed.device_id AND timestamp <= ed.timestamp
-    ORDER BY timestamp DESC
-    LIMIT 1
-) ps ON true
-ORDER BY ed.device_id, ed.timestamp;
+        w.device_id,
+        w.since,
+        -- Latest status at or before the watermark, so the first new energy
+        -- row still finds the status that was in effect for it
+        (SELECT max(p2.timestamp) FROM printer_status p2
+         WHERE p2.device_id = w.device_id AND p2.timestamp <= w.since) AS anchor
+    FROM unnest(%s::text[], %s::timestamptz[]) AS w(device_id, since)
+)
 """
 
-print("Executing SQL query to fetch and join data...")
+energy_sql = WATERMARK_CTE + f"""
+SELECT {', '.join('ed.' + col for col in ENERGY_COLUMNS)}
+FROM energy_data ed
+LEFT JOIN wm ON wm.device_id = ed.device_id
+WHERE wm.since IS NULL OR ed.timestamp > wm.since
+ORDER BY ed.timestamp;
+"""
+
+status_sql = WATERMARK_CTE + f"""
+SELECT ps.timestamp, ps.device_id, {', '.join('ps.' + col for col in STATUS_COLUMNS)}
+FROM printer_status ps
+LEFT JOIN wm ON wm.device_id = ps.device_id
+WHERE wm.since IS NULL OR ps.timestamp >= COALESCE(wm.anchor, '-infinity'::timestamptz)
+ORDER BY ps.timestamp;
+"""
+
+watermark_params = (list(watermarks.keys()), [ts.to_pydatetime() for ts in watermarks.values()])
+
+# A full export is built next to the live dataset and swapped in at the end,
+# so a failed run never leaves train_model.py with half a dataset.
+target_dir = OUTPUT_DATASET_DIR if INCREMENTAL else OUTPUT_DATASET_DIR + '.building'
+if not INCREMENTAL:
+    shutil.rmtree(target_dir, ignore_errors=True)
+os.makedirs(target_dir, exist_ok=True)
+target_watermark_file = os.path.join(target_dir, '_watermarks.json')
+
+run_id = uuid.uuid4().hex[:8]
+total_rows = 0
+
+print("Streaming energy and status data...")
 try:
-    # Use pandas to read directly into a DataFrame
-    df = pd.read_sql_query(sql_query, conn)
-    print(f"Query successful. Fetched {len(df)} rows.")
+    # Named cursors are server-side: rows arrive CHUNK_ROWS at a time instead
+    # of materializing the whole history in memory.
+    energy_cur = conn.cursor(name='export_energy')
+    status_cur = conn.cursor(name='export_status')
+    energy_cur.itersize = status_cur.itersize = CHUNK_ROWS
+    energy_cur.execute(energy_sql, watermark_params)
+    status_cur.execute(status_sql, watermark_params)
+
+    status_columns = ['timestamp', 'device_id'] + STATUS_COLUMNS
+    # Latest status row per device seen so far, carried into the next chunk
+    last_status = pd.DataFrame(columns=status_columns)
+    # Status rows already fetched but newer than the current energy chunk
+    pending_status = fetch_frame(status_cur, status_columns)
+    status_exhausted = pending_status.empty
+
+    chunk_index = 0
+    while True:
+        energy_df = fetch_frame(energy_cur, ENERGY_COLUMNS)
+        if energy_df.empty:
+            break
+        chunk_end = energy_df['timestamp'].iloc[-1]
+
+        # Pull status rows up to the end of this energy chunk
+        status_parts = [last_status]
+        while True:
+            due = pending_status['timestamp'] <= chunk_end
+            status_parts.append(pending_status[due])
+            pending_status = pending_status[~due]
+            if not pending_status.empty or status_exhausted:
+                break
+            pending_status = fetch_frame(status_cur, status_columns)
+            status_exhausted = pending_status.empty
+        status_df = pd.concat([p for p in status_parts if not p.empty] or [last_status], ignore_index=True)
+        status_df['timestamp'] = pd.to_datetime(status_df['timestamp'], utc=True)
+
+        # --- As-of Join ---
+        # For each energy row, take the latest status at or before its timestamp
+        # for the SAME device (same semantics as the former LATERAL ... LIMIT 1).
+        df = pd.merge_asof(
+            energy_df,
+            status_df,
+            on='timestamp',
+            by='device_id',
+            direction='backward',
+            allow_exact_matches=True
+        )[OUTPUT_COLUMNS]
+        last_status = status_df.drop_duplicates('device_id', keep='last')
+
+        write_chunk(df, target_dir, run_id, chunk_index)
+        total_rows += len(df)
+        chunk_index += 1
+
+        # Energy rows arrive in timestamp order, so everything up to here is on
+        # disk; advancing the watermarks per chunk makes a crashed run resumable.
+        for device_id, last_ts in df.groupby('device_id')['timestamp'].max().items():
+            watermarks[device_id] = last_ts
+        save_watermarks(watermarks, target_watermark_file)
+        print(f"Chunk {chunk_index}: wrote {len(df)} rows ({total_rows} total).")
+
+    energy_cur.close()
+    status_cur.close()
 except Exception as e:
-    print(f"Error executing query: {e}")
+    print(f"Error exporting data: {e}")
     conn.close()
     sys.exit(1)
 finally:
@@ -87,15 +260,17 @@ finally:
         conn.close()
         print("Database connection closed.")
 
-# --- Save to CSV ---
-if not df.empty:
-    print(f"Saving data to {OUTPUT_CSV_FILE}...")
-    try:
-        df.to_csv(OUTPUT_CSV_FILE, index=False)
-        print("Data saved successfully.")
-    except Exception as e:
-        print(f"Error saving data to CSV: {e}")
+if not INCREMENTAL:
+    if total_rows:
+        shutil.rmtree(OUTPUT_DATASET_DIR, ignore_errors=True)
+        os.replace(target_dir, OUTPUT_DATASET_DIR)
+        print(f"Dataset rebuilt at {OUTPUT_DATASET_DIR}/ ({total_rows} rows).")
+    else:
+        shutil.rmtree(target_dir, ignore_errors=True)
+        print("No data fetched, dataset not created.")
+elif total_rows:
+    print(f"Added {total_rows} rows to {OUTPUT_DATASET_DIR}/. Watermarks updated for {len(watermarks)} devices.")
 else:
-    print("No data fetched, CSV file not created.")
+    print("No new data since the last export, dataset left unchanged.")
 
 print("Script finished.")
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# model_bundle.py - Compact, memory-mappable model artifact + pure-NumPy predictor
+#
+# A bundle is a directory of .npy arrays plus a manifest.json:
+#
+#   <MODEL_DIR>/model_bundle/<version>/manifest.json
+#   <MODEL_DIR>/model_bundle/<version>/*.npy
+#   <MODEL_DIR>/model_bundle/CURRENT          (name of the active version)
+#
+# Tree ensembles (RandomForest, LightGBM, XGBoost) are flattened into one set
+# of node arrays shared by all trees, so loading is a handful of np.load calls
+# with mmap_mode='r' instead of unpickling thousands of Python objects.
+# Linear models store their coefficients. The scaler and the feature order are
+# stored alongside, so the predictor needs neither sklearn nor pandas.
+#
+# export_bundle() runs at training time; everything else only needs NumPy.
+
+import os
+import json
+import math
+import shutil
+
+import numpy as np
+
+BUNDLE_FORMAT_VERSION = 1
+BUNDLE_DIRNAME = "model_bundle"
+CURRENT_FILE = "CURRENT"
+KEEP_VERSIONS = 3
+
+# LightGBM treats |x| <= this as zero for missing_type == 'Zero'
+LGBM_ZERO_THRESHOLD = 1e-35
+
+MISSING_NONE, MISSING_ZERO, MISSING_NAN = 0, 1, 2
+
+
+# --------------------
+# Export (training side)
+# --------------------
+class _TreeBuilder:
+    """Accumulates trees into flat node arrays with global child indices."""
+
+    def __init__(self):
+        self.feature, self.threshold, self.left, self.right = [], [], [], []
+        self.value, self.default_left, self.missing_type = [], [], []
+        self.roots, self.max_depth, self.node_count = [], 0, 0
+
+    def add_tree(self, feature, threshold, left, right, value, default_left, missing_type):
+        """Child indices are local to the tree; -1 marks a leaf."""
+        offset = self.node_count
+        n = len(feature)
+        self.node_count += n
+        is_leaf = np.asarray(left) < 0
+        local = np.arange(n)
+        self.roots.append(offset)
+        self.feature.append(np.where(is_leaf, -1, feature))
+        self.threshold.append(np.where(is_leaf, 0.0, threshold))
+        # Leaves point at themselves so traversal can run a fixed number of steps
+        self.left.append(np.where(is_leaf, local, left) + offset)
+        self.right.append(np.where(is_leaf, local, right) + offset)
+        self.value.append(value)
+        self.default_left.append(default_left)
+        self.missing_type.append(missing_type)
+        self.max_depth = max(self.max_depth, _tree_depth(np.asarray(left), np.asarray(right)))
+
+    def arrays(self):
+        cat = lambda parts, dtype: np.concatenate([np.asarray(p, dtype=dtype) for p in parts])  # noqa: E731
+        return {
+            "feature": cat(self.feature, np.int32),
+            "threshold": cat(self.threshold, np.float64),
+            "left": cat(self.left, np.int32),
+            "right": cat(self.right, np.int32),
+            "value": cat(self.value, np.float64),
+            "default_left": cat(self.default_left, np.bool_),
+            "missing_type": cat(self.missing_type, np.int8),
+            "roots": np.asarray(self.roots, dtype=np.int32),
+        }
+
+
+def _tree_depth(left, right):
+    depth, frontier = 0, [0]
+    while frontier:
+        frontier = [c for n in frontier if left[n] >= 0 for c in (left[n], right[n])]
+        depth += 1 if frontier else 0
+    return depth
+
+
+def _flatten_sklearn_forest(model):
+    builder = _TreeBuilder()
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        default_left = getattr(tree, "missing_go_to_left", np.zeros(tree.node_count, dtype=np.uint8))
+        builder.add_tree(
+            tree.feature, tree.threshold, tree.children_left, tree.children_right,
+            tree.value[:, 0, 0], default_left.astype(bool),
+            np.full(tree.node_count, MISSING_NAN, dtype=np.int8)
+        )
+    # sklearn trees compare float32 inputs with `<=` and average their outputs
+    return builder, {"base_score": 0.0, "scale": 1.0 / len(model.estimators_),
+                     "input_float32": True, "strict_less": False}
+
+
+def _flatten_lightgbm(model):
+    dump = model.booster_.dump_model()
+    builder = _TreeBuilder()
+    missing_codes = {"None": MISSING_NONE, "Zero": MISSING_ZERO, "NaN": MISSING_NAN}
+    for info in dump["tree_info"]:
+        nodes = []
+
+        def visit(node):
+            index = len(nodes)
+            nodes.append(None)
+            if "leaf_value" in node:
+                nodes[index] = (-1, 0.0, -1, -1, node["leaf_value"], False, MISSING_NONE)
+            else:
+                if node.get("decision_type", "<=") != "<=":
+                    raise ValueError("Categorical LightGBM splits are not supported in model bundles")
+                left = visit(node["left_child"])
+                right = visit(node["right_child"])
+                nodes[index] = (node["split_feature"], node["threshold"], left, right, 0.0,
+                                bool(node["default_left"]), missing_codes.get(node["missing_type"], MISSING_NONE))
+            return index
+
+        visit(info["tree_structure"])
+        columns = list(zip(*nodes))
+        builder.add_tree(*[np.asarray(col) for col in columns])
+    scale = 1.0 / len(dump["tree_info"]) if dump.get("average_output") else 1.0
+    return builder, {"base_score": 0.0, "scale": scale, "input_float32": False, "strict_less": False}
+
+
+def _flatten_xgboost(model):
+    booster = model.get_booster()
+    raw = json.loads(booster.save_raw("json"))
+    learner = raw["learner"]
+    gbm = learner["gradient_booster"]
+    if gbm.get("name") != "gbtree":
+        raise ValueError(f"XGBoost booster '{gbm.get('name')}' is not supported in model bundles")
+    builder = _TreeBuilder()
+    for tree in gbm["model"]["trees"]:
+        left = np.asarray(tree["left_children"])
+        conditions = np.asarray(tree["split_conditions"], dtype=np.float32)
+        is_leaf = left < 0
+        builder.add_tree(
+            np.asarray(tree["split_indices"]), conditions.astype(np.float64), left,
+            np.asarray(tree["right_children"]),
+            # Leaf weights are stored in split_conditions for leaf nodes
+            np.where(is_leaf, conditions.astype(np.float64), 0.0),
+            np.asarray(tree["default_left"], dtype=bool),
+            np.full(len(left), MISSING_NAN, dtype=np.int8)
+        )
+    base_score = str(learner["learner_model_param"]["base_score"]).strip("[]")
+    # XGBoost compares float32 inputs with `<`
+    return builder, {"base_score": float(base_score), "scale": 1.0,
+                     "input_float32": True, "strict_less": True}
+
+
+def _flatten_model(model, model_type):
+    """Returns (arrays, params) describing the model."""
+    if model_type == "LinearRegression" or hasattr(model, "coef_"):
+        return ({"coef": np.asarray(model.coef_, dtype=np.float64).ravel()},
+                {"kind": "linear", "intercept": float(np.ravel(model.intercept_)[0])})
+    if model_type == "LightGBM" or hasattr(model, "booster_"):
+        builder, params = _flatten_lightgbm(model)
+    elif model_type == "XGBoost" or hasattr(model, "get_booster"):
+        builder, params = _flatten_xgboost(model)
+    elif hasattr(model, "estimators_"):
+        builder, params = _flatten_sklearn_forest(model)
+    else:
+        raise ValueError(f"Model type {model_type} cannot be exported as a bundle")
+    params.update(kind="trees", max_depth=builder.max_depth, n_trees=len(builder.roots))
+    return builder.arrays(), params
+
+
+def export_bundle(model_dir, model, scaler, features, model_type, version, validate_X=None):
+    """
+    Writes a new bundle version under <model_dir>/model_bundle and makes it current.
+    If validate_X (already scaled) is given, the bundle's predictions are checked
+    against model.predict first and the bundle is not activated on a mismatch.
+    Returns the bundle directory.
+    """
+    arrays, params = _flatten_model(model, model_type)
+    arrays["scaler_mean"] = np.asarray(scaler.mean_, dtype=np.float64)
+    arrays["scaler_scale"] = np.asarray(scaler.scale_, dtype=np.float64)
+
+    if validate_X is not None and len(validate_X):
+        expected = np.asarray(model.predict(validate_X), dtype=np.float64)
+        actual = _predict_raw(arrays, params, np.asarray(validate_X, dtype=np.float64))
+        max_error = float(np.max(np.abs(expected - actual)))
+        # XGBoost sums its trees in float32, so allow rounding that grows with the tree count
+        tolerance = 1e-6 * max(1.0, float(np.max(np.abs(expected))))
+        if params.get("strict_less"):
+            tolerance *= max(1, params["n_trees"])
+        if max_error > tolerance:
+            raise ValueError(f"Bundle predictions differ from the model (max abs error {max_error:.3g})")
+
+    root = os.path.join(model_dir, BUNDLE_DIRNAME)
+    final_dir = os.path.join(root, version)
+    tmp_dir = final_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), array)
+    manifest = {
+        "format_version": BUNDLE_FORMAT_VERSION,
+        "model_version": version,
+        "model_type": model_type,
+        "features": list(features),
+        "arrays": sorted(arrays),
+        **params,
+    }
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    shutil.rmtree(final_dir, ignore_errors=True)
+    os.replace(tmp_dir, final_dir)
+
+    # Flip the pointer atomically; readers see either the old or the new version
+    pointer_tmp = os.path.join(root, CURRENT_FILE + ".tmp")
+    with open(pointer_tmp, "w") as f:
+        f.write(version)
+    os.replace(pointer_tmp, os.path.join(root, CURRENT_FILE))
+
+    versions = sorted(d for d in os.listdir(root)
+                      if os.path.isdir(os.path.join(root, d)) and not d.endswith(".tmp"))
+    for stale in versions[:-KEEP_VERSIONS]:
+        if stale != version:
+            shutil.rmtree(os.path.join(root, stale), ignore_errors=True)
+    return final_dir
+
+
+# --------------------
+# Prediction (worker side, NumPy only)
+# --------------------
+def _predict_raw(arrays, params, X_scaled):
+    """Raw model output for an already scaled (n, n_features) matrix."""
+    if params["kind"] == "linear":
+        return X_scaled @ arrays["coef"] + params["intercept"]
+
+    X = X_scaled.astype(np.float32).astype(np.float64) if params["input_float32"] else X_scaled
+    feature, threshold = arrays["feature"], arrays["threshold"]
+    left, right = arrays["left"], arrays["right"]
+    default_left, missing_type = arrays["default_left"], arrays["missing_type"]
+    n = X.shape[0]
+    rows = np.arange(n)[:, None]
+    # One cursor per (sample, tree); every step moves all cursors one level down
+    nodes = np.broadcast_to(arrays["roots"], (n, len(arrays["roots"]))).copy()
+    for _ in range(params["max_depth"]):
+        x = X[rows, feature[nodes]]
+        mtype = missing_type[nodes]
+        is_nan = np.isnan(x)
+        # LightGBM without NaN handling compares missing values as zero
+        x = np.where(is_nan & (mtype != MISSING_NAN), 0.0, x)
+        if params["strict_less"]:
+            go_left = x < threshold[nodes]
+        else:
+            go_left = x <= threshold[nodes]
+        use_default = (is_nan & (mtype == MISSING_NAN)) | ((mtype == MISSING_ZERO) & (np.abs(x) <= LGBM_ZERO_THRESHOLD))
+        go_left = np.where(use_default, default_left[nodes], go_left)
+        nodes = np.where(go_left, left[nodes], right[nodes])
+    return arrays["value"][nodes].sum(axis=1) * params["scale"] + params["base_score"]
+
+
+class BundlePredictor:
+    """Evaluates a model bundle. Arrays are memory-mapped, so processes share pages."""
+
+    def __init__(self, bundle_dir):
+        with open(os.path.join(bundle_dir, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format_version") != BUNDLE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported bundle format {self.manifest.get('format_version')}")
+        self.bundle_dir = bundle_dir
+        self.model_version = self.manifest["model_version"]
+        self.model_type = self.manifest["model_type"]
+        self.features = self.manifest["features"]
+        self.feature_index = {name: i for i, name in enumerate(self.features)}
+        self.arrays = {name: np.load(os.path.join(bundle_dir, f"{name}.npy"), mmap_mode="r")
+                       for name in self.manifest["arrays"]}
+        # Plain ndarray views of the same mapped pages (no copy), which avoids
+        # np.memmap subclass overhead in the fancy indexing during traversal
+        self.arrays = {name: np.asarray(array) for name, array in self.arrays.items()}
+        self._mean = np.asarray(self.arrays["scaler_mean"])
+        self._scale = np.asarray(self.arrays["scaler_scale"])
+
+    def predict(self, X):
+        """Raw predictions for an unscaled (n, n_features) matrix in self.features order."""
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        return _predict_raw(self.arrays, self.manifest, (X - self._mean) / self._scale)
+
+
+def current_bundle_dir(model_dir):
+    """Directory of the active bundle version, or None if no bundle was exported."""
+    root = os.path.join(model_dir, BUNDLE_DIRNAME)
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return None
+    bundle_dir = os.path.join(root, version)
+    return bundle_dir if os.path.isdir(bundle_dir) else None
+
+
+def deactivate_bundle(model_dir):
+    """Removes the CURRENT pointer so readers fall back to the joblib artifacts."""
+    try:
+        os.remove(os.path.join(model_dir, BUNDLE_DIRNAME, CURRENT_FILE))
+    except FileNotFoundError:
+        pass
+
+
+def load_current_bundle(model_dir):
+    """BundlePredictor for the active version, or None if there is none."""
+    bundle_dir = current_bundle_dir(model_dir)
+    return BundlePredictor(bundle_dir) if bundle_dir else None
+
+
+def to_float(value):
+    """float(value), or NaN when the value is not numeric (like pd.to_numeric(errors='coerce'))."""
+    if isinstance(value, bool):
+        return float(value)
+    try:
+        result = float(value)
+    except (TypeError, ValueError):
+        return math.nan
+    return result
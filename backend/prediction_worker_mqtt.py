@@ -1,18 +1,24 @@
 #!/usr/bin/env python3
 # prediction_worker_mqtt.py - Listens to MQTT for prediction requests
 
+import io
 import os
 import sys
+import csv
 import json
+import queue
 import signal
+import time
+import threading
 import traceback
 import warnings
+from datetime import datetime, timezone
 
 import numpy as np
-import pandas as pd
-import joblib
 import paho.mqtt.client as mqtt
 
+from model_bundle import load_current_bundle, current_bundle_dir, to_float
+
 # --------------------
 # General Config
 # --------------------
@@ -20,6 +26,22 @@ MODEL_DIR = os.environ.get("MODEL_DIR")
 IMPUTE = float(os.environ.get("IMPUTE", "0.0"))
 IDLE_NOZZLE_C = float(os.environ.get("IDLE_NOZZLE_C", "30.0"))
 IDLE_BED_C    = float(os.environ.get("IDLE_BED_C", "30.0"))
+# How often MODEL_DIR is checked for new artifacts (a models/updated message triggers an immediate check)
+MODEL_WATCH_INTERVAL_S = float(os.environ.get("MODEL_WATCH_INTERVAL_S", "10"))
+# Artifacts must be unchanged for this long before loading, so half-written joblib files are skipped
+MODEL_SETTLE_S = float(os.environ.get("MODEL_SETTLE_S", "2"))
+LEGACY_MODEL_FILES = ("best_model.joblib", "scaler.joblib", "model_features.joblib")
+# Per-device prediction cache: numeric inputs are quantized to this step before
+# comparing with the device's previous request (0 disables the cache)
+FEATURE_CACHE_QUANTUM = float(os.environ.get("FEATURE_CACHE_QUANTUM", "0.1"))
+# Seconds between cache hit-rate reports (log + retained predictions/metrics message)
+FEATURE_CACHE_REPORT_S = float(os.environ.get("FEATURE_CACHE_REPORT_S", "60"))
+# Optional direct persistence to ml_predictions with batched COPY
+PREDICTION_DB_WRITE = os.environ.get("PREDICTION_DB_WRITE", "false").lower() in ("1", "true", "yes")
+PREDICTION_BATCH_SIZE = int(os.environ.get("PREDICTION_BATCH_SIZE", "500"))
+PREDICTION_FLUSH_S = float(os.environ.get("PREDICTION_FLUSH_S", "5"))
+# Rows held in memory while the database is unreachable; the oldest are dropped beyond this
+PREDICTION_BUFFER_MAX = int(os.environ.get("PREDICTION_BUFFER_MAX", "100000"))
 
 NUMERIC_COLS = [
     "plug_temp_c",
@@ -38,7 +60,43 @@ NUMERIC_COLS = [
 def log_err(msg: str) -> None:
     print(msg, file=sys.stderr, flush=True)
 
+def build_feature_vector(feat: dict, features, feature_index) -> np.ndarray:
+    """Same preprocessing as predict_from_features, on a plain NumPy vector."""
+    x = np.zeros(len(features))
+    for k, v in (feat or {}).items():
+        i = feature_index.get(k)
+        if i is not None and v is not None:
+            x[i] = to_float(v)
+    x[np.isnan(x)] = IMPUTE
+    if "z_height_mm" in feature_index and x[feature_index["z_height_mm"]] < 0:
+        x[feature_index["z_height_mm"]] = 0.0
+    if "is_printing" in feature_index:
+        x[feature_index["is_printing"]] = 1.0 if x[feature_index["is_printing"]] == 1.0 else 0.0
+    for delta, target, actual in (("nozzle_temp_delta", "nozzle_temp_target", "nozzle_temp_actual"),
+                                  ("bed_temp_delta", "bed_temp_target", "bed_temp_actual")):
+        if delta in feature_index and target in feature_index and actual in feature_index:
+            x[feature_index[delta]] = x[feature_index[target]] - x[feature_index[actual]]
+    mat = (feat or {}).get("material") or "Unknown"
+    onehot = f"material_{mat}"
+    if onehot in feature_index:
+        x[feature_index[onehot]] = 1.0
+    elif "material_Unknown" in feature_index:
+        x[feature_index["material_Unknown"]] = 1.0
+    x[np.isnan(x)] = IMPUTE
+    x[np.isinf(x)] = 0.0
+    return x
+
+def predict_from_bundle(feat: dict, bundle) -> float:
+    x = build_feature_vector(feat, bundle.features, bundle.feature_index)
+    raw_prediction = float(bundle.predict(x)[0])
+    value = lambda name: x[bundle.feature_index[name]] if name in bundle.feature_index else 0.0  # noqa: E731
+    if value("is_printing") == 0 and value("nozzle_temp_actual") < IDLE_NOZZLE_C and value("bed_temp_actual") < IDLE_BED_C:
+        return 0.0
+    return max(0.0, raw_prediction)
+
 def predict_from_features(feat: dict, model, scaler, features) -> float:
+    # Fallback path for models without a bundle; pandas is only needed here
+    import pandas as pd
     df = pd.DataFrame(0.0, index=[0], columns=features)
     for k, v in (feat or {}).items():
         if k in df.columns and v is not None:
@@ -75,6 +133,269 @@ def predict_from_features(feat: dict, model, scaler, features) -> float:
         return 0.0
     return max(0.0, raw_prediction)
 
+# --------------------
+# Model Assets & Hot Reload
+# --------------------
+def artifact_signature(model_dir):
+    """Changes whenever a new model is published to model_dir."""
+    bundle_dir = current_bundle_dir(model_dir)
+    if bundle_dir is not None:
+        return ("bundle", bundle_dir)
+    stamps = []
+    for name in LEGACY_MODEL_FILES:
+        try:
+            st = os.stat(os.path.join(model_dir, name))
+            stamps.append((name, st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            stamps.append((name, None, None))
+    return ("joblib", tuple(stamps))
+
+def load_assets(model_dir) -> dict:
+    """
+    Loads everything on_message needs into one dict. The dict is never mutated
+    after it is built, so swapping userdata['assets'] is a single atomic step.
+    """
+    signature = artifact_signature(model_dir)
+    bundle = load_current_bundle(model_dir)
+    if bundle is not None:
+        # Memory-mapped NumPy arrays; no unpickling, sklearn or pandas needed
+        return {"bundle": bundle, "model_version": bundle.model_version, "signature": signature}
+    import joblib
+    model = joblib.load(os.path.join(model_dir, "best_model.joblib"))
+    scaler = joblib.load(os.path.join(model_dir, "scaler.joblib"))
+    features = joblib.load(os.path.join(model_dir, "model_features.joblib"))
+    try:
+        model_type = joblib.load(os.path.join(model_dir, "model_evaluation_metrics.joblib")).get("model_type")
+    except Exception:
+        model_type = None
+    trained_at = datetime.fromtimestamp(os.path.getmtime(os.path.join(model_dir, "best_model.joblib")), timezone.utc)
+    return {
+        "bundle": None, "model": model, "scaler": scaler, "features": features,
+        "model_version": f"{trained_at:%Y%m%dT%H%M%SZ}-{model_type or type(model).__name__}",
+        "signature": signature
+    }
+
+class ModelReloader(threading.Thread):
+    """
+    Watches MODEL_DIR (and listens for reload requests) and swaps in new assets.
+    Loading happens on this thread; the MQTT loop keeps serving the old model
+    until the new one is fully loaded.
+    """
+
+    def __init__(self, userdata, model_dir):
+        super().__init__(name="model-reloader", daemon=True)
+        self.userdata = userdata
+        self.model_dir = model_dir
+        self.wakeup = threading.Event()
+
+    def request_reload(self):
+        self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(MODEL_WATCH_INTERVAL_S)
+            self.wakeup.clear()
+            try:
+                self.check()
+            except Exception as e:
+                log_err(f"Model reload failed, keeping version {self.userdata['assets']['model_version']}: {e}")
+
+    def check(self):
+        signature = artifact_signature(self.model_dir)
+        if signature == self.userdata["assets"]["signature"]:
+            return
+        time.sleep(MODEL_SETTLE_S)
+        if artifact_signature(self.model_dir) != signature:
+            return  # Still being written; look again on the next pass
+        started = time.perf_counter()
+        assets = load_assets(self.model_dir)
+        previous = self.userdata["assets"]["model_version"]
+        self.userdata["assets"] = assets
+        log_err(f"--- Model reloaded: {previous} -> {assets['model_version']} "
+                f"in {time.perf_counter() - started:.2f}s ---")
+
+# --------------------
+# Prediction Cache
+# --------------------
+class PredictionCache:
+    """
+    Remembers each device's last quantized feature payload and its prediction.
+    Idle printers publish the same status every cycle; those requests are
+    answered from here without building features or calling the model.
+    Entries are tied to the model version, so a reload invalidates them.
+    """
+
+    def __init__(self, quantum):
+        self.quantum = quantum
+        self.entries = {}  # device_id -> (model_version, key, prediction)
+        self.hits = 0
+        self.misses = 0
+        self.window_hits = 0
+        self.window_misses = 0
+
+    @property
+    def enabled(self):
+        return self.quantum > 0
+
+    def _quantize(self, value):
+        if isinstance(value, bool) or value is None or isinstance(value, str):
+            return value
+        if isinstance(value, (int, float)):
+            if value != value or value in (float("inf"), float("-inf")):
+                return repr(value)
+            return int(round(value / self.quantum))
+        return repr(value)
+
+    def key(self, payload):
+        return tuple(sorted((k, self._quantize(v)) for k, v in (payload or {}).items()))
+
+    def get(self, device_id, key, model_version):
+        entry = self.entries.get(device_id)
+        if entry is not None and entry[0] == model_version and entry[1] == key:
+            self.hits += 1
+            self.window_hits += 1
+            return entry[2]
+        self.misses += 1
+        self.window_misses += 1
+        return None
+
+    def put(self, device_id, key, model_version, prediction):
+        self.entries[device_id] = (model_version, key, prediction)
+
+    def stats(self, reset_window=False):
+        total = self.hits + self.misses
+        window_total = self.window_hits + self.window_misses
+        stats = {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+            "window_requests": window_total,
+            "window_hit_rate": round(self.window_hits / window_total, 4) if window_total else None,
+            "devices": len(self.entries)
+        }
+        if reset_window:
+            self.window_hits = self.window_misses = 0
+        return stats
+
+def report_cache_stats(client, cache, model_version):
+    stats = dict(cache.stats(reset_window=True), model_version=model_version,
+                 timestamp=datetime.now(timezone.utc).isoformat())
+    log_err(f"Prediction cache: {stats['window_requests']} requests, "
+            f"window hit rate {stats['window_hit_rate']}, overall {stats['hit_rate']} "
+            f"({stats['devices']} devices)")
+    client.publish(MQTT_TOPIC_METRICS, json.dumps(stats), retain=True)
+
+# --------------------
+# Batched Persistence
+# --------------------
+class PredictionWriter(threading.Thread):
+    """
+    Writes predictions to ml_predictions with COPY, PREDICTION_BATCH_SIZE rows
+    at a time or every PREDICTION_FLUSH_S seconds, whichever comes first.
+    A single writer consumes a FIFO queue and retries a failed batch before
+    taking new rows, so rows of a device are written in the order predicted.
+    """
+
+    COPY_SQL = ("COPY ml_predictions (timestamp, device_id, predicted_power_watts, model_version) "
+                "FROM STDIN WITH (FORMAT csv)")
+
+    def __init__(self):
+        super().__init__(name="prediction-writer", daemon=True)
+        self.rows = queue.Queue(maxsize=PREDICTION_BUFFER_MAX)
+        self.conn = None
+        self.written = 0
+        self.dropped = 0
+        self.stopping = threading.Event()
+
+    def submit(self, timestamp, device_id, prediction, model_version):
+        row = (timestamp, device_id, prediction, model_version)
+        try:
+            self.rows.put_nowait(row)
+        except queue.Full:
+            # Database has been down for a while: drop the oldest row to make room
+            try:
+                self.rows.get_nowait()
+            except queue.Empty:
+                pass
+            self.rows.put_nowait(row)
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                log_err(f"Prediction buffer full, dropped {self.dropped} oldest rows so far.")
+
+    def connect(self):
+        import psycopg2
+        self.conn = psycopg2.connect(
+            dbname=os.environ.get("POSTGRES_DB"),
+            user=os.environ.get("POSTGRES_USER"),
+            password=os.environ.get("POSTGRES_PASSWORD"),
+            host=os.environ.get("POSTGRES_HOST"),
+            port=os.environ.get("POSTGRES_PORT")
+        )
+
+    def flush(self, batch):
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for timestamp, device_id, prediction, model_version in batch:
+            writer.writerow((timestamp.isoformat(), device_id, repr(float(prediction)), model_version))
+        buf.seek(0)
+        if self.conn is None or self.conn.closed:
+            self.connect()
+        try:
+            with self.conn.cursor() as cur:
+                cur.copy_expert(self.COPY_SQL, buf)
+            self.conn.commit()
+        except Exception:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
+            raise
+        self.written += len(batch)
+
+    def run(self):
+        batch, deadline, backoff = [], None, 1.0
+        while True:
+            timeout = PREDICTION_FLUSH_S if not batch else max(0.0, deadline - time.monotonic())
+            try:
+                while len(batch) < PREDICTION_BATCH_SIZE:
+                    batch.append(self.rows.get(timeout=timeout))
+                    if deadline is None:
+                        deadline = time.monotonic() + PREDICTION_FLUSH_S
+                    timeout = max(0.0, deadline - time.monotonic())
+            except queue.Empty:
+                pass
+            if self.stopping.is_set():
+                # Drain whatever is left so shutdown loses nothing
+                while True:
+                    try:
+                        batch.append(self.rows.get_nowait())
+                    except queue.Empty:
+                        break
+            if not batch:
+                if self.stopping.is_set():
+                    return
+                continue
+            try:
+                self.flush(batch)
+                batch, deadline, backoff = [], None, 1.0
+                if self.stopping.is_set() and self.rows.empty():
+                    return
+            except Exception as e:
+                log_err(f"Prediction COPY of {len(batch)} rows failed, retrying in {backoff:.0f}s: {e}")
+                if self.stopping.is_set():
+                    return
+                self.stopping.wait(backoff)
+                backoff = min(backoff * 2, 60.0)
+                deadline = time.monotonic()
+
+    def close(self, timeout=10.0):
+        """Flushes buffered rows and stops the thread."""
+        self.stopping.set()
+        self.join(timeout)
+        log_err(f"Prediction writer stopped: {self.written} rows written, {self.rows.qsize()} unflushed, "
+                f"{self.dropped} dropped.")
+
 # --------------------
 # MQTT Configuration
 # --------------------
@@ -84,6 +405,8 @@ MQTT_USERNAME = os.environ.get("MQTT_USERNAME")
 MQTT_PASSWORD = os.environ.get("MQTT_PASSWORD")
 MQTT_TOPIC_REQUEST = "predictions/request"
 MQTT_TOPIC_RESULT = "predictions/result"
+MQTT_TOPIC_MODELS_UPDATED = "models/updated"
+MQTT_TOPIC_METRICS = "predictions/metrics"
 
 # --------------------
 # MQTT Callback Functions
@@ -92,22 +415,50 @@ MQTT_TOPIC_RESULT = "predictions/result"
 # The function now accepts the 5th argument 'properties' which the V2 API provides.
 def on_connect(client, userdata, flags, rc, properties=None):
     if rc == 0:
-        log_err(f"Successfully connected to MQTT Broker. Subscribing to topic '{MQTT_TOPIC_REQUEST}'")
-        client.subscribe(MQTT_TOPIC_REQUEST)
+        log_err(f"Successfully connected to MQTT Broker. Subscribing to topics '{MQTT_TOPIC_REQUEST}', '{MQTT_TOPIC_MODELS_UPDATED}'")
+        client.subscribe([(MQTT_TOPIC_REQUEST, 0), (MQTT_TOPIC_MODELS_UPDATED, 0)])
     else:
         log_err(f"Failed to connect to MQTT, return code {rc}")
 
 def on_message(client, userdata, msg):
+    if msg.topic == MQTT_TOPIC_MODELS_UPDATED:
+        log_err("Received models/updated, checking for new model artifacts.")
+        userdata['reloader'].request_reload()
+        return
     device_id = "unknown_device"
     try:
         data = json.loads(msg.payload.decode("utf-8"))
         features_payload = data.get("payload", {})
         device_id = data.get("device_id", "unknown_device")
-        prediction = predict_from_features(
-            features_payload, userdata['model'], userdata['scaler'], userdata['features']
-        )
-        result = {"payload": {"predicted_power_watts": prediction}, "device_id": device_id}
+        # One read of the current assets: a concurrent reload can't mix two models
+        assets = userdata['assets']
+        cache = userdata['cache']
+        prediction = None
+        if cache.enabled:
+            cache_key = cache.key(features_payload)
+            prediction = cache.get(device_id, cache_key, assets['model_version'])
+        if prediction is None:
+            if assets['bundle'] is not None:
+                prediction = predict_from_bundle(features_payload, assets['bundle'])
+            else:
+                prediction = predict_from_features(
+                    features_payload, assets['model'], assets['scaler'], assets['features']
+                )
+            if cache.enabled:
+                cache.put(device_id, cache_key, assets['model_version'], prediction)
+        result = {
+            "payload": {"predicted_power_watts": prediction, "model_version": assets['model_version']},
+            "device_id": device_id
+        }
+        writer = userdata.get('writer')
+        if writer is not None:
+            writer.submit(datetime.now(timezone.utc), device_id, prediction, assets['model_version'])
+            # Tells Node-RED the row is already stored, so it skips its own insert
+            result["payload"]["persisted"] = True
         client.publish(MQTT_TOPIC_RESULT, json.dumps(result))
+        if cache.enabled and time.monotonic() >= userdata['next_cache_report']:
+            userdata['next_cache_report'] = time.monotonic() + FEATURE_CACHE_REPORT_S
+            report_cache_stats(client, cache, assets['model_version'])
     except Exception as e:
         log_err(f"Error processing message for device '{device_id}': {e}\n{traceback.format_exc()}")
 
@@ -120,15 +471,27 @@ if __name__ == "__main__":
 
     try:
         log_err("--- Loading ML assets into memory... ---")
-        MODEL = joblib.load(os.path.join(MODEL_DIR, "best_model.joblib"))
-        SCALER = joblib.load(os.path.join(MODEL_DIR, "scaler.joblib"))
-        FEATURES = joblib.load(os.path.join(MODEL_DIR, "model_features.joblib"))
-        log_err("--- ML assets loaded. Initializing MQTT client. ---")
+        assets = load_assets(MODEL_DIR)
+        log_err(f"--- ML assets loaded (version {assets['model_version']}, "
+                f"{'bundle' if assets['bundle'] is not None else 'joblib'}). Initializing MQTT client. ---")
     except Exception as e:
         log_err(f"FATAL: Could not load ML assets from '{MODEL_DIR}': {e}")
         sys.exit(1)
 
-    client_userdata = {"model": MODEL, "scaler": SCALER, "features": FEATURES}
+    client_userdata = {
+        "assets": assets,
+        "cache": PredictionCache(FEATURE_CACHE_QUANTUM),
+        "next_cache_report": time.monotonic() + FEATURE_CACHE_REPORT_S
+    }
+    reloader = ModelReloader(client_userdata, MODEL_DIR)
+    client_userdata["reloader"] = reloader
+    reloader.start()
+    if PREDICTION_DB_WRITE:
+        writer = PredictionWriter()
+        client_userdata["writer"] = writer
+        writer.start()
+        log_err(f"--- Writing predictions to ml_predictions (batches of {PREDICTION_BATCH_SIZE}, "
+                f"every {PREDICTION_FLUSH_S}s). ---")
     
     # We are using the modern V2 API, which is good practice.
     client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, userdata=client_userdata)
@@ -144,4 +507,13 @@ if __name__ == "__main__":
         log_err(f"FATAL: Could not connect to MQTT broker: {e}")
         sys.exit(1)
 
+    def shutdown(signum, frame):
+        log_err(f"Received signal {signum}, shutting down.")
+        client.disconnect()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
     client.loop_forever()
+    if client_userdata.get("writer") is not None:
+        client_userdata["writer"].close()
@@ -3,8 +3,12 @@ import numpy as np
 from sklearn.linear_model import LinearRegression
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
-from sklearn.model_selection import train_test_split, cross_val_score, KFold
+from sklearn.model_selection import train_test_split, KFold
 from sklearn.preprocessing import StandardScaler
+from sklearn.metrics import get_scorer
+from sklearn.base import clone
+from joblib import Parallel, delayed
+from threadpoolctl import threadpool_limits
 try:
     import lightgbm as lgb
     LGBM_AVAILABLE = True
@@ -17,13 +21,23 @@ try:
 except ImportError:
     XGB_AVAILABLE = False
     print("Warning: xgboost not found. Install with 'pip install xgboost' to test.")
+import pyarrow.dataset as ds
 import joblib
+from model_bundle import export_bundle, deactivate_bundle
 import os
 import sys
 import traceback
 import warnings
+import time
+import json
+import hashlib
+import uuid
+from datetime import datetime, timezone, timedelta
 
 # --- Configuration ---
+# Partitioned Parquet dataset written by export_training_data.py
+INPUT_DATASET_DIR = 'printer_energy_data'
+# Legacy CSV export, used only when the dataset is not there yet
 INPUT_CSV_FILE = 'printer_energy_data_raw.csv'
 MODEL_DIR = os.environ.get("MODEL_DIR")
 TARGET_COLUMN = 'power_watts'
@@ -43,6 +57,63 @@ BASE_MODEL_FEATURES = [
 ]
 IMPUTE_VALUE_WHEN_API_MISSING = 0
 
+# --- Retraining Mode ---
+# 'auto' continues boosting the previous LightGBM/XGBoost model on rows newer
+# than the last training run, and only re-runs the full model bake-off when
+# the schedule says so or the previous model has drifted on the new data.
+# 'full' always runs the bake-off; 'incremental' skips the schedule/drift checks.
+# --full / --incremental on the command line override TRAIN_MODE.
+TRAIN_MODE = os.environ.get("TRAIN_MODE", "auto").lower()
+if '--full' in sys.argv[1:]:
+    TRAIN_MODE = 'full'
+if '--incremental' in sys.argv[1:]:
+    TRAIN_MODE = 'incremental'
+FULL_RETRAIN_INTERVAL_DAYS = float(os.environ.get("FULL_RETRAIN_INTERVAL_DAYS", 7))
+# Previous model MAE on new data / its MAE at the last full training
+DRIFT_MAE_RATIO = float(os.environ.get("DRIFT_MAE_RATIO", 1.25))
+INCREMENTAL_MIN_ROWS = int(os.environ.get("INCREMENTAL_MIN_ROWS", 500))
+INCREMENTAL_BOOST_ROUNDS = int(os.environ.get("INCREMENTAL_BOOST_ROUNDS", 100))
+WARM_START_MODEL_TYPES = ('LightGBM', 'XGBoost')
+
+# --- Model Selection ---
+# Total cores shared by all concurrently cross-validated candidates. Every
+# (candidate, fold) fit runs single-threaded, so the budget is never oversubscribed.
+TRAIN_CPU_BUDGET = int(os.environ.get("TRAIN_CPU_BUDGET", os.cpu_count() or 1))
+# Fold scores (and the last final model) keyed by data fingerprint + hyperparameters
+CV_CACHE_DIR = os.path.join(MODEL_DIR, 'cv_cache')
+CV_CACHE_KEEP = 5
+# Per-stage timings of every run, one JSON object per line
+BENCHMARK_REPORT_FILE = os.path.join(MODEL_DIR, 'training_benchmark.jsonl')
+
+stage_timings = {}
+_stage_clock = [time.perf_counter()]
+
+
+def end_stage(name):
+    """Records the time spent since the previous stage ended."""
+    now = time.perf_counter()
+    stage_timings[name] = round(now - _stage_clock[0], 3)
+    _stage_clock[0] = now
+
+
+def write_benchmark_report(mode, extra=None):
+    report = {
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+        "mode": mode,
+        "cpu_budget": TRAIN_CPU_BUDGET,
+        "stages": stage_timings,
+        "total_seconds": round(sum(stage_timings.values()), 3)
+    }
+    report.update(extra or {})
+    try:
+        with open(BENCHMARK_REPORT_FILE, 'a') as f:
+            f.write(json.dumps(report, default=str) + "\n")
+    except Exception as e:
+        print(f"Warning: could not write benchmark report: {e}")
+    print("\n--- Stage Timings (s) ---")
+    for stage, seconds in stage_timings.items():
+        print(f"{stage:<20} {seconds:>9.2f}")
+
 # Ensure model directory exists
 os.makedirs(MODEL_DIR, exist_ok=True)
 
@@ -53,9 +124,23 @@ warnings.filterwarnings("ignore", category=UserWarning, message="X does not have
 print(f"--- Starting Model Training (Base Features: {BASE_MODEL_FEATURES}) ---")
 
 # === Load Data ===
-print(f"\n=== Loading Data ({INPUT_CSV_FILE}) ===")
+# Only the timestamp, target and base feature columns are read; the Parquet
+# dataset is columnar, so the other exported columns are never decoded.
+cols_to_load = list(dict.fromkeys([TARGET_COLUMN] + BASE_MODEL_FEATURES))
 try:
-    df = pd.read_csv(INPUT_CSV_FILE, parse_dates=['timestamp'], index_col='timestamp')
+    if os.path.isdir(INPUT_DATASET_DIR):
+        print(f"\n=== Loading Data ({INPUT_DATASET_DIR}/) ===")
+        dataset = ds.dataset(INPUT_DATASET_DIR, format='parquet', partitioning='hive')
+        available_cols = set(dataset.schema.names)
+        actual_cols = [col for col in cols_to_load if col in available_cols]
+        df = dataset.to_table(columns=['timestamp'] + actual_cols).to_pandas()
+        df.set_index('timestamp', inplace=True)
+    else:
+        print(f"\n=== Loading Data ({INPUT_CSV_FILE}) ===")
+        df = pd.read_csv(INPUT_CSV_FILE, parse_dates=['timestamp'], index_col='timestamp',
+                         usecols=lambda col: col == 'timestamp' or col in cols_to_load)
+        actual_cols = [col for col in cols_to_load if col in df.columns]
+
     initial_rows = len(df)
     duplicates = df.index.duplicated(keep='first')
     if duplicates.sum() > 0:
@@ -66,16 +151,15 @@ try:
     if TARGET_COLUMN not in df.columns:
         raise ValueError(f"Target column '{TARGET_COLUMN}' not found.")
 
-    # Load all base features plus the target column
-    cols_to_load = list(set([TARGET_COLUMN] + BASE_MODEL_FEATURES))
-    actual_cols = [col for col in cols_to_load if col in df.columns]
-    missing_req_cols = [col for col in cols_to_load if col not in df.columns]
+    missing_req_cols = [col for col in cols_to_load if col not in actual_cols]
     if missing_req_cols:
-         print(f"Warning: Columns missing from CSV needed for processing: {missing_req_cols}")
+         print(f"Warning: Columns missing from input needed for processing: {missing_req_cols}")
     df = df[actual_cols].copy()
 
+    end_stage('load')
+
 except FileNotFoundError:
-    print(f"Error: Input file not found at {INPUT_CSV_FILE}", file=sys.stderr)
+    print(f"Error: No training data found at {INPUT_DATASET_DIR}/ or {INPUT_CSV_FILE}", file=sys.stderr)
     sys.exit(1)
 except Exception as e:
     print(f"Error loading or filtering data: {e}", file=sys.stderr)
@@ -162,6 +246,7 @@ try:
     print(f"\nPreprocessing complete. Final features count: {len(FINAL_MODEL_FEATURES)}")
     print(f"Shape of final feature matrix X: {X.shape}")
     print(f"Shape of final target vector y: {y.shape}")
+    end_stage('preprocess')
 
 except Exception as e:
      print(f"FATAL: Error during preprocessing: {e}", file=sys.stderr)
@@ -169,6 +254,195 @@ except Exception as e:
      sys.exit(1)
 
 
+# === Incremental Retraining ===
+state_filename = os.path.join(MODEL_DIR, 'training_state.joblib')
+
+
+def save_training_state(state):
+    joblib.dump(state, state_filename)
+    print(f"Training state saved to {state_filename}")
+
+
+def publish_joblib_assets(assets):
+    """
+    Writes {file name: object} into MODEL_DIR as one set. Every file is dumped
+    under a private name first and the renames happen back to back, with
+    best_model.joblib last, so the worker's settle check never sees a new
+    scaler or feature list next to the previous model.
+    """
+    suffix = f".{uuid.uuid4().hex[:8]}.tmp"
+    staged = []
+    try:
+        for name, obj in assets.items():
+            path = os.path.join(MODEL_DIR, name)
+            joblib.dump(obj, path + suffix)
+            staged.append(path)
+        for path in sorted(staged, key=lambda p: os.path.basename(p) == 'best_model.joblib'):
+            os.replace(path + suffix, path)
+    finally:
+        for path in staged:
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+def save_model_bundle(model, scaler, features, model_type, validate_X):
+    """
+    Exports the compact bundle the prediction worker loads. On failure the
+    previous bundle is deactivated so the worker uses the joblib files instead.
+    """
+    version = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}-{model_type}"
+    try:
+        bundle_dir = export_bundle(MODEL_DIR, model, scaler, features, model_type, version,
+                                   validate_X=validate_X[:2000])
+        print(f"Model bundle {version} saved to {bundle_dir}")
+    except Exception as e:
+        deactivate_bundle(MODEL_DIR)
+        print(f"Warning: could not export model bundle ({e}); the worker will load the joblib files.")
+    notify_model_updated(version)
+
+
+def notify_model_updated(version):
+    """Tells the prediction worker to reload now instead of on its next MODEL_DIR poll."""
+    if not os.environ.get("MQTT_BROKER_HOST"):
+        return
+    try:
+        import paho.mqtt.publish as publish
+        auth = None
+        if os.environ.get("MQTT_USERNAME"):
+            auth = {"username": os.environ["MQTT_USERNAME"], "password": os.environ.get("MQTT_PASSWORD")}
+        publish.single("models/updated", json.dumps({"model_version": version}),
+                       hostname=os.environ["MQTT_BROKER_HOST"], port=int(os.environ.get("MQTT_PORT", 1883)),
+                       auth=auth)
+        print("Published models/updated.")
+    except Exception as e:
+        print(f"Warning: could not publish models/updated ({e}); the worker will pick up the model on its next poll.")
+
+
+def load_previous_assets():
+    """Returns (model, scaler, features, state) from the last run, or None if any is missing."""
+    try:
+        return (
+            joblib.load(os.path.join(MODEL_DIR, 'best_model.joblib')),
+            joblib.load(os.path.join(MODEL_DIR, 'scaler.joblib')),
+            joblib.load(os.path.join(MODEL_DIR, 'model_features.joblib')),
+            joblib.load(state_filename)
+        )
+    except Exception as e:
+        print(f"No usable previous model/state for incremental retraining ({e}).")
+        return None
+
+
+def warm_start_model(previous_model, model_type, X_fit, y_fit):
+    """Adds INCREMENTAL_BOOST_ROUNDS trees on top of the previous booster."""
+    params = dict(previous_model.get_params(), n_estimators=INCREMENTAL_BOOST_ROUNDS)
+    if model_type == 'LightGBM':
+        model = lgb.LGBMRegressor(**params)
+        model.fit(X_fit, y_fit, init_model=previous_model.booster_)
+    else:
+        model = xgb.XGBRegressor(**params)
+        model.fit(X_fit, y_fit, xgb_model=previous_model.get_booster())
+    return model
+
+
+def try_incremental_retrain(X, y):
+    """
+    Continues training the previous boosted model on rows newer than the last run.
+    Returns True when the run is complete (model updated or nothing to do), or
+    False when the full bake-off should run instead.
+    """
+    print(f"\n=== Incremental Retraining (mode: {TRAIN_MODE}) ===")
+    previous = load_previous_assets()
+    if previous is None:
+        return False
+    previous_model, previous_scaler, previous_features, state = previous
+    model_type = state.get('model_type')
+
+    if model_type not in WARM_START_MODEL_TYPES:
+        print(f"Previous model type {model_type} cannot be warm-started. Running full training.")
+        return False
+    if (model_type == 'LightGBM' and not LGBM_AVAILABLE) or (model_type == 'XGBoost' and not XGB_AVAILABLE):
+        print(f"{model_type} is not installed. Running full training.")
+        return False
+    unknown_features = [col for col in X.columns if col not in previous_features]
+    if unknown_features:
+        # e.g. a new material appeared; the previous model has no input for it
+        print(f"New features {unknown_features} not known to the previous model. Running full training.")
+        return False
+
+    if TRAIN_MODE == 'auto':
+        last_full = state.get('last_full_train')
+        if last_full is None or datetime.now(timezone.utc) - last_full >= timedelta(days=FULL_RETRAIN_INTERVAL_DAYS):
+            print(f"Last full training {last_full} is older than {FULL_RETRAIN_INTERVAL_DAYS} days. Running full training.")
+            return False
+
+    trained_until = state.get('trained_until')
+    new_mask = X.index > trained_until if trained_until is not None else np.ones(len(X), dtype=bool)
+    X_new = X.loc[new_mask].reindex(columns=previous_features, fill_value=0)
+    y_new = y.loc[new_mask]
+    print(f"{len(X_new)} new rows since {trained_until}.")
+    if len(X_new) < INCREMENTAL_MIN_ROWS:
+        print(f"Fewer than {INCREMENTAL_MIN_ROWS} new rows; keeping the current model.")
+        return True
+
+    # The previous trees split on scaled values, so the previous scaler is reused as-is.
+    X_new_scaled = previous_scaler.transform(X_new)
+
+    # Drift check: how does the current model do on data it has never seen?
+    previous_mae = mean_absolute_error(y_new, np.maximum(0.0, previous_model.predict(X_new_scaled)))
+    baseline_mae = state.get('baseline_mae')
+    print(f"Previous model MAE on new data: {previous_mae:.2f} W (baseline "
+          + (f"{baseline_mae:.2f} W)" if baseline_mae else "unknown)"))
+    if TRAIN_MODE == 'auto' and baseline_mae and previous_mae > baseline_mae * DRIFT_MAE_RATIO:
+        print(f"Drift detected (ratio {previous_mae / baseline_mae:.2f} > {DRIFT_MAE_RATIO}). Running full training.")
+        return False
+
+    X_fit, X_hold, y_fit, y_hold = train_test_split(X_new_scaled, y_new, test_size=0.2, random_state=42)
+    model = warm_start_model(previous_model, model_type, X_fit, y_fit)
+    y_pred = np.maximum(0.0, model.predict(X_hold))
+    mae_new = mean_absolute_error(y_hold, y_pred)
+    mae_old = mean_absolute_error(y_hold, np.maximum(0.0, previous_model.predict(X_hold)))
+    print(f"Hold-out MAE: warm-started {mae_new:.2f} W vs previous {mae_old:.2f} W")
+
+    state['trained_until'] = X_new.index.max()
+    # best_model.joblib no longer matches the last full fit once it is warm-started
+    state.pop('fit_key', None)
+    if mae_new > mae_old:
+        print("Warm-started model is not better; keeping the current model.")
+        save_training_state(state)
+        return True
+
+    publish_joblib_assets({
+        'model_evaluation_metrics.joblib': {
+            "model_type": model_type,
+            "mae": mae_new,
+            "rmse": np.sqrt(mean_squared_error(y_hold, y_pred)),
+            "r_squared": r2_score(y_hold, y_pred),
+            "n_test_samples": len(y_hold),
+            "features_used": list(previous_features),
+            "training_mode": "incremental",
+            "n_new_samples": len(X_new)
+        },
+        'best_model.joblib': model,
+    })
+    print(f"Warm-started {model_type} model saved ({INCREMENTAL_BOOST_ROUNDS} additional rounds).")
+    save_model_bundle(model, previous_scaler, previous_features, model_type, X_hold)
+    save_training_state(state)
+    return True
+
+
+if TRAIN_MODE != 'full' and not X.empty:
+    try:
+        done = try_incremental_retrain(X, y)
+        end_stage('incremental')
+        if done:
+            write_benchmark_report('incremental')
+            print("\n--- Model Training Script Finished (incremental) ---")
+            sys.exit(0)
+    except Exception as e:
+        print(f"Warning: incremental retraining failed ({e}). Running full training.", file=sys.stderr)
+        traceback.print_exc()
+
+
 # === Train/Test Split ===
 print("\n=== Splitting Data (for final hold-out evaluation) ===")
 if X.empty or y.empty:
@@ -187,10 +461,10 @@ X_train_val_scaled = scaler.fit_transform(X_train_val)
 X_test_scaled = scaler.transform(X_test)
 print("Features scaled (scaler fit on train+validation set).")
 
-# Save the scaler and the EXACT column order it was fitted on
-joblib.dump(scaler, os.path.join(MODEL_DIR, 'scaler.joblib'))
-joblib.dump(X_train_val.columns.tolist(), os.path.join(MODEL_DIR, 'scaler_columns.joblib'))
-print(f"Scaler and scaler columns saved. Columns: {X_train_val.columns.tolist()}")
+# The scaler and the EXACT column order it was fitted on are saved with the
+# final model below; the worker must never load them next to the old model
+print(f"Scaler columns: {X_train_val.columns.tolist()}")
+end_stage('split_and_scale')
 
 
 # === Model Comparison using Cross-Validation ===
@@ -208,16 +482,92 @@ cv_strategy = KFold(n_splits=5, shuffle=True, random_state=42)
 results_cv = {}
 scoring_metric = 'neg_mean_absolute_error'
 
-for name, model in models.items():
-    print(f"--- Cross-validating {name} ---")
+
+def with_threads(model, n_jobs):
+    """Returns an unfitted copy of model using n_jobs threads, if it takes n_jobs."""
+    model = clone(model)
+    if 'n_jobs' in model.get_params():
+        model.set_params(n_jobs=n_jobs)
+    return model
+
+
+def params_key(name, model):
+    """Stable key for a candidate's hyperparameters (thread settings excluded)."""
+    params = {k: v for k, v in model.get_params().items() if k not in ('n_jobs', 'verbosity')}
+    return hashlib.sha256(f"{name}:{sorted(params.items())!r}".encode()).hexdigest()[:16]
+
+
+def fit_and_score_fold(name, model, fold, X_all, y_all, train_idx, test_idx):
+    """One (candidate, fold) fit, pinned to a single thread. Failures score NaN."""
+    start = time.perf_counter()
     try:
-        cv_scores = cross_val_score(model, X_train_val_scaled, y_train_val,
-                                    scoring=scoring_metric, cv=cv_strategy, n_jobs=-1)
-        results_cv[name] = cv_scores
-        print(f"CV Mean {scoring_metric}: {cv_scores.mean():.3f} +/- {cv_scores.std():.3f}")
+        with threadpool_limits(limits=1):
+            model.fit(X_all[train_idx], y_all[train_idx])
+            score = float(get_scorer(scoring_metric)(model, X_all[test_idx], y_all[test_idx]))
     except Exception as e:
-        print(f"Error cross-validating {name}: {e}")
+        print(f"Error cross-validating {name} (fold {fold}): {e}")
+        score = np.nan
+    return name, fold, score, time.perf_counter() - start
+
+
+# Identifies the exact training matrix, target and fold layout
+data_fingerprint = hashlib.sha256(
+    np.ascontiguousarray(X_train_val_scaled).tobytes()
+    + np.ascontiguousarray(y_train_val.to_numpy(dtype=float)).tobytes()
+    + repr((X_train_val.columns.tolist(), cv_strategy.n_splits, cv_strategy.random_state)).encode()
+).hexdigest()[:16]
+os.makedirs(CV_CACHE_DIR, exist_ok=True)
+cv_cache_file = os.path.join(CV_CACHE_DIR, f"scores-{data_fingerprint}.json")
+try:
+    with open(cv_cache_file) as f:
+        cv_cache = json.load(f)
+except (FileNotFoundError, ValueError):
+    cv_cache = {}
+
+folds = list(cv_strategy.split(X_train_val_scaled))
+pending = []
+for name, model in models.items():
+    cached = cv_cache.get(params_key(name, model), {})
+    for fold, (train_idx, test_idx) in enumerate(folds):
+        if str(fold) not in cached:
+            pending.append((name, fold, train_idx, test_idx))
+print(f"Data fingerprint {data_fingerprint}: {len(models) * len(folds) - len(pending)} fold scores cached, "
+      f"{len(pending)} to fit on {TRAIN_CPU_BUDGET} cores.")
+
+fold_seconds = {name: 0.0 for name in models}
+if pending:
+    # All candidates' folds share one worker pool sized to the CPU budget.
+    # Large arrays are memory-mapped into the workers by joblib, not copied per task.
+    y_train_val_array = y_train_val.to_numpy(dtype=float)
+    fold_results = Parallel(n_jobs=min(TRAIN_CPU_BUDGET, len(pending)), return_as='generator_unordered')(
+        delayed(fit_and_score_fold)(name, with_threads(models[name], 1), fold,
+                                    X_train_val_scaled, y_train_val_array, train_idx, test_idx)
+        for name, fold, train_idx, test_idx in pending
+    )
+    for name, fold, score, seconds in fold_results:
+        fold_seconds[name] += seconds
+        if not np.isnan(score):
+            cv_cache.setdefault(params_key(name, models[name]), {})[str(fold)] = score
+    with open(cv_cache_file, 'w') as f:
+        json.dump(cv_cache, f, indent=2)
+    # Keep only the most recent fingerprints
+    cached_files = sorted((os.path.join(CV_CACHE_DIR, fn) for fn in os.listdir(CV_CACHE_DIR) if fn.startswith('scores-')),
+                          key=os.path.getmtime, reverse=True)
+    for stale in cached_files[CV_CACHE_KEEP:]:
+        os.remove(stale)
+
+for name, model in models.items():
+    print(f"--- Cross-validating {name} ---")
+    scores = cv_cache.get(params_key(name, model), {})
+    cv_scores = np.array([scores.get(str(fold), np.nan) for fold in range(len(folds))])
+    if np.isnan(cv_scores).any():
+        print(f"Error cross-validating {name}: {int(np.isnan(cv_scores).sum())} folds failed")
         results_cv[name] = [np.nan]
+        continue
+    results_cv[name] = cv_scores
+    print(f"CV Mean {scoring_metric}: {cv_scores.mean():.3f} +/- {cv_scores.std():.3f}"
+          + (f" ({fold_seconds[name]:.1f}s total fold fit time)" if fold_seconds[name] else " (cached)"))
+end_stage('cross_validation')
 
 # === Select Best Model Type Based on CV ===
 best_model_name = None
@@ -238,21 +588,25 @@ print(f"\nSelected best model type based on CV: {best_model_name} (Mean MAE: {-b
 
 # === Train Final Model & Evaluate on Hold-Out Test Set ===
 print(f"\n=== Training Final {best_model_name} Model on Full Train+Validation Set ===")
-if best_model_name == 'LinearRegression':
-     final_model = LinearRegression()
-elif best_model_name == 'RandomForest':
-     final_model = RandomForestRegressor(n_estimators=100, random_state=42, n_jobs=-1)
-elif best_model_name == 'LightGBM' and LGBM_AVAILABLE:
-     final_model = lgb.LGBMRegressor(random_state=42, n_jobs=-1, verbosity=-1)
-elif best_model_name == 'XGBoost' and XGB_AVAILABLE:
-     final_model = xgb.XGBRegressor(random_state=42, n_jobs=-1, objective='reg:squarederror')
-else:
-     print(f"Error: Best model '{best_model_name}' not recognized. Defaulting to RandomForest.")
-     final_model = RandomForestRegressor(n_estimators=100, random_state=42, n_jobs=-1)
+# The final fit gets the whole CPU budget. If the saved best model was fitted
+# on the same data fingerprint with the same hyperparameters, it is reused.
+final_model = with_threads(models[best_model_name], TRAIN_CPU_BUDGET)
+final_fit_key = f"{data_fingerprint}-{params_key(best_model_name, final_model)}"
+final_model_reused = False
+try:
+    if joblib.load(state_filename).get('fit_key') == final_fit_key:
+        final_model = joblib.load(os.path.join(MODEL_DIR, 'best_model.joblib'))
+        final_model_reused = True
+except Exception:
+    pass
 
 try:
-    final_model.fit(X_train_val_scaled, y_train_val)
-    print("Final model training complete.")
+    if final_model_reused:
+        print("Reusing the final model fitted on identical data and hyperparameters.")
+    else:
+        final_model.fit(X_train_val_scaled, y_train_val)
+        print("Final model training complete.")
+    end_stage('final_fit')
 
     print(f"\n--- Evaluating Final {best_model_name} on Hold-Out Test Set ---")
     y_pred_final = final_model.predict(X_test_scaled)
@@ -269,7 +623,8 @@ try:
         "model_type": best_model_name,
         "mae": mae_final, "rmse": rmse_final, "r_squared": r2_final,
         "n_test_samples": len(y_test),
-        "features_used": X_train_val.columns.tolist()
+        "features_used": X_train_val.columns.tolist(),
+        "training_mode": "full"
     }
 
     # Get Feature Importances
@@ -294,22 +649,27 @@ except Exception as e:
 # === Save Final Model Assets ===
 print("\n--- Saving Final Model Assets ---")
 try:
-    # Use generic names for consistency in loading
-    final_model_filename = os.path.join(MODEL_DIR, 'best_model.joblib')
-    metrics_filename = os.path.join(MODEL_DIR, 'model_evaluation_metrics.joblib')
-    features_filename = os.path.join(MODEL_DIR, 'model_features.joblib') # Will contain ALL final features
-
-    # Save the final list of features the model expects (including one-hot encoded ones)
-    joblib.dump(X_train_val.columns.tolist(), features_filename)
-    print(f"Model features list saved to {features_filename}")
-    
-    # Save Final Model
-    joblib.dump(final_model, final_model_filename)
-    print(f"Final model saved to {final_model_filename} (Type: {best_model_name})")
-    
-    # Save Metrics
-    joblib.dump(final_model_metrics, metrics_filename)
-    print(f"Final model metrics saved to {metrics_filename}")
+    # Use generic names for consistency in loading. The scaler, the final list
+    # of features the model expects (including one-hot encoded ones), the
+    # metrics and the model are published together.
+    publish_joblib_assets({
+        'scaler.joblib': scaler,
+        'scaler_columns.joblib': X_train_val.columns.tolist(),
+        'model_features.joblib': X_train_val.columns.tolist(),
+        'model_evaluation_metrics.joblib': final_model_metrics,
+        'best_model.joblib': final_model,
+    })
+    print(f"Final model, scaler, features and metrics saved to {MODEL_DIR} (Type: {best_model_name})")
+    save_model_bundle(final_model, scaler, X_train_val.columns.tolist(), best_model_name, X_test_scaled)
+
+    # Save the state incremental runs start from
+    save_training_state({
+        "model_type": best_model_name,
+        "last_full_train": datetime.now(timezone.utc),
+        "trained_until": X.index.max(),
+        "baseline_mae": mae_final,
+        "fit_key": final_fit_key
+    })
 
 except Exception as e:
     print(f"FATAL: Error saving final model assets: {e}", file=sys.stderr)
@@ -317,4 +677,13 @@ except Exception as e:
     sys.exit(1)
 
 
+end_stage('evaluate_and_save')
+write_benchmark_report('full', {
+    "data_fingerprint": data_fingerprint,
+    "rows": len(X),
+    "best_model": best_model_name,
+    "final_model_reused": final_model_reused,
+    "candidate_fold_seconds": {name: round(sec, 3) for name, sec in fold_seconds.items()}
+})
+
 print("\n--- Model Training Script Finished ---")
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# benchmarks/admin_users_pagination.py
+#
+# Compares OFFSET and keyset pagination for the /api/admin/users query on a
+# synthetic demo_users-shaped table (1M rows by default).
+#
+# Usage (inside the python_api container, or anywhere with DB access):
+#   python benchmarks/admin_users_pagination.py --rows 1000000
+#
+# The table is created as bench_demo_users and dropped afterwards unless --keep.
+
+import os
+import sys
+import time
+import argparse
+import statistics
+import psycopg2
+
+BENCH_TABLE = "bench_demo_users"
+PAGE_SIZE = 20
+DEPTHS = [0, 1_000, 10_000, 100_000, 500_000, 990_000]
+SEARCH_TERMS = ["org-42", "user9999", "Germany"]
+
+SELECT_COLUMNS = """
+    id, email, organization, full_name, position, mobile, country,
+    email_verified, role, created_at, last_login, is_active,
+    ip_address_signup
+"""
+
+
+def get_connection():
+    return psycopg2.connect(
+        dbname=os.environ.get('POSTGRES_DB'),
+        user=os.environ.get('POSTGRES_USER'),
+        password=os.environ.get('POSTGRES_PASSWORD'),
+        host=os.environ.get('POSTGRES_HOST'),
+        port=os.environ.get('POSTGRES_PORT')
+    )
+
+
+def build_table(cur, rows):
+    print(f"Creating {BENCH_TABLE} with {rows:,} synthetic users...")
+    cur.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+    cur.execute(f"CREATE UNLOGGED TABLE {BENCH_TABLE} (LIKE demo_users INCLUDING DEFAULTS)")
+    cur.execute(f"""
+        INSERT INTO {BENCH_TABLE}
+            (id, email, password_hash, organization, full_name, position, mobile,
+             country, email_verified, role, created_at, is_active)
+        SELECT
+            g, 'user' || g || '@example.com', 'x', 'org-' || (g % 5000), 'User ' || g,
+            'Engineer', NULL,
+            (ARRAY['Germany','Turkey','France','Italy','Spain','United States'])[1 + g % 6],
+            (g % 3 = 0), 'user',
+            NOW() - (g || ' seconds')::interval, TRUE
+        FROM generate_series(1, %s) g
+    """, (rows,))
+    # Mirror backend/db_init/05_admin_user_search.sql
+    cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for col in ("email", "full_name", "organization", "country"):
+        cur.execute(f"CREATE INDEX ON {BENCH_TABLE} USING GIN ({col} gin_trgm_ops)")
+    cur.execute(f"CREATE INDEX ON {BENCH_TABLE} (created_at DESC, id DESC)")
+    cur.execute(f"ANALYZE {BENCH_TABLE}")
+
+
+def timed(cur, sql, params, repeats):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        cur.execute(sql, params)
+        cur.fetchall()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return statistics.median(samples)
+
+
+def run(cur, rows, repeats):
+    offset_sql = f"""
+        SELECT {SELECT_COLUMNS} FROM {BENCH_TABLE}
+        ORDER BY created_at DESC, id DESC LIMIT %s OFFSET %s
+    """
+    keyset_sql = f"""
+        SELECT {SELECT_COLUMNS} FROM {BENCH_TABLE}
+        WHERE (created_at, id) < (%s, %s)
+        ORDER BY created_at DESC, id DESC LIMIT %s
+    """
+
+    print(f"\n{'depth':>10} | {'offset ms':>10} | {'keyset ms':>10}")
+    print("-" * 37)
+    for depth in [d for d in DEPTHS if d < rows]:
+        # Resolve the cursor for this depth once, outside the timed section.
+        cur.execute(f"SELECT created_at, id FROM {BENCH_TABLE} ORDER BY created_at DESC, id DESC "
+                    f"LIMIT 1 OFFSET %s", (max(depth - 1, 0),))
+        anchor = cur.fetchone()
+        offset_ms = timed(cur, offset_sql, (PAGE_SIZE, depth), repeats)
+        keyset_ms = timed(cur, keyset_sql, (anchor[0], anchor[1], PAGE_SIZE), repeats)
+        print(f"{depth:>10,} | {offset_ms:>10.2f} | {keyset_ms:>10.2f}")
+
+    search_sql = f"""
+        SELECT {SELECT_COLUMNS} FROM {BENCH_TABLE}
+        WHERE (email ILIKE %s OR full_name ILIKE %s OR organization ILIKE %s OR country ILIKE %s)
+        ORDER BY created_at DESC, id DESC LIMIT %s
+    """
+    print(f"\n{'search':>10} | {'first page ms':>13}")
+    print("-" * 27)
+    for term in SEARCH_TERMS:
+        pattern = f"%{term}%"
+        ms = timed(cur, search_sql, (pattern, pattern, pattern, pattern, PAGE_SIZE), repeats)
+        print(f"{term:>10} | {ms:>13.2f}")
+
+
+def main():
+    pa = argparse.ArgumentParser()
+    pa.add_argument('--rows', type=int, default=1_000_000)
+    pa.add_argument('--repeats', type=int, default=5)
+    pa.add_argument('--keep', action='store_true', help="Keep the benchmark table afterwards")
+    args = pa.parse_args()
+
+    conn = get_connection()
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        build_table(cur, args.rows)
+        run(cur, args.rows, args.repeats)
+    finally:
+        if not args.keep:
+            cur.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+        cur.close()
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
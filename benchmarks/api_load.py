@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# benchmarks/api_load.py
+#
+# HTTP load test of the read-heavy API endpoints against the Flask app
+# (gunicorn, port 5000) and the asyncio tier (uvicorn, port 5001). Every
+# client keeps one HTTP/1.1 connection open and sends its next request as
+# soon as the previous response has been read; requests/sec and latency
+# percentiles are reported per target and path.
+#
+# Usage (from a host that reaches both services, e.g. the docker host):
+#   python benchmarks/api_load.py --clients 500 --duration 30
+#   python benchmarks/api_load.py --path "/api/analysis/series?deviceId=PrusaMK4-1&timeRange=24h"
+#
+# Plain asyncio sockets, no client library needed. Raise the open-file
+# limit first (ulimit -n 4096) when running with several hundred clients.
+
+import sys
+import time
+import asyncio
+import argparse
+from urllib.parse import urlsplit
+
+DEFAULT_TARGETS = [
+    ("flask", "http://localhost:5000"),
+    ("async", "http://localhost:5001"),
+]
+DEFAULT_PATHS = ["/api/dpp_summary", "/api/devices/"]
+
+
+async def read_response(reader):
+    """Reads one response; returns the status code. Handles Content-Length and chunked bodies."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    status = int(status_line.split()[1])
+    length = None
+    chunked = False
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        name = name.strip().lower()
+        if name == "content-length":
+            length = int(value)
+        elif name == "transfer-encoding" and "chunked" in value.lower():
+            chunked = True
+    if chunked:
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif length:
+        await reader.readexactly(length)
+    return status
+
+
+async def client(host, port, path, deadline, latencies, errors):
+    request = (f"GET {path} HTTP/1.1\r\nHost: {host}\r\n"
+               f"Accept: application/json\r\nConnection: keep-alive\r\n\r\n").encode()
+    writer = None
+    while time.perf_counter() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            start = time.perf_counter()
+            writer.write(request)
+            status = await read_response(reader)
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors.append(status)
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            errors.append(type(e).__name__)
+            if writer is not None:
+                writer.close()
+            writer = None
+            await asyncio.sleep(0.1)
+    if writer is not None:
+        writer.close()
+
+
+async def run_load(base_url, path, clients, duration):
+    url = urlsplit(base_url)
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    await asyncio.gather(*(client(url.hostname, url.port or 80, path, deadline, latencies, errors)
+                           for _ in range(clients)))
+    return latencies, errors, time.perf_counter() - started
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def main():
+    pa = argparse.ArgumentParser()
+    pa.add_argument('--clients', type=int, default=500)
+    pa.add_argument('--duration', type=float, default=30.0, help="Seconds per target and path")
+    pa.add_argument('--path', action='append', help="Path to request (repeatable)")
+    pa.add_argument('--target', action='append', metavar='NAME=URL',
+                    help="Base URL to test (repeatable), default flask and async on localhost")
+    args = pa.parse_args()
+
+    targets = [tuple(t.split('=', 1)) for t in args.target] if args.target else DEFAULT_TARGETS
+    paths = args.path or DEFAULT_PATHS
+
+    print(f"{args.clients} concurrent clients, {args.duration:.0f}s per run\n")
+    print(f"{'target':>8} | {'path':<28} | {'req/s':>8} | {'p50 ms':>8} | {'p99 ms':>8} | {'errors':>6}")
+    print("-" * 82)
+    for path in paths:
+        for name, base_url in targets:
+            latencies, errors, elapsed = asyncio.run(run_load(base_url, path, args.clients, args.duration))
+            latencies.sort()
+            print(f"{name:>8} | {path[:28]:<28} | {len(latencies) / elapsed:>8.1f} | "
+                  f"{percentile(latencies, 0.50) * 1000:>8.1f} | {percentile(latencies, 0.99) * 1000:>8.1f} | "
+                  f"{len(errors):>6}")
+            if errors:
+                kinds = {}
+                for e in errors:
+                    kinds[e] = kinds.get(e, 0) + 1
+                print(f"{'':>8}   errors: {', '.join(f'{k}: {v}' for k, v in sorted(kinds.items(), key=str))}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
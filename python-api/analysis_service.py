@@ -0,0 +1,510 @@
+# analysis_service.py
+# Time-series data for the analysis page: energy readings joined with the
+# printer status and environment readings in effect at each point.
+#
+# Replaces the per-row LATERAL lookups of the Node-RED "Get Data for Analysis"
+# query. Energy, status and environment rows are each read with one ordered
+# scan and joined as-of in pandas, chunk by chunk, while the response streams
+# out as columnar JSON lines or an Arrow IPC stream.
+import os
+import io
+import json
+import math
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from downsampling import downsample, METHODS as DOWNSAMPLE_METHODS
+
+# --- Configuration ---
+# Ranges up to this span are served raw; longer ranges are time-bucketed.
+RAW_MAX_SPAN_HOURS = float(os.environ.get('ANALYSIS_RAW_MAX_SPAN_HOURS', 6))
+# Bucketed ranges aim for roughly this many points per series.
+TARGET_POINTS = int(os.environ.get('ANALYSIS_TARGET_POINTS', 1000))
+# Rows fetched per round trip and emitted per response chunk
+CHUNK_ROWS = int(os.environ.get('ANALYSIS_CHUNK_ROWS', 20000))
+# Downsampled requests (points=N) read raw rows up to this span, so spikes
+# survive; beyond it they start from time buckets OVERSAMPLE times finer than N.
+DOWNSAMPLE_RAW_MAX_SPAN_HOURS = float(os.environ.get('ANALYSIS_DOWNSAMPLE_RAW_MAX_SPAN_HOURS', 7 * 24))
+DOWNSAMPLE_OVERSAMPLE = int(os.environ.get('ANALYSIS_DOWNSAMPLE_OVERSAMPLE', 8))
+MAX_POINTS = int(os.environ.get('ANALYSIS_MAX_POINTS', 10000))
+# Environment readings further than this from an energy point are not joined
+ENVIRONMENT_TOLERANCE = pd.Timedelta(minutes=15)
+
+# Bucket widths in seconds; the chosen width is the first one that keeps a
+# range under TARGET_POINTS (24h -> 2 minutes, 7d -> 15 minutes by default).
+BUCKET_STEPS_SECONDS = [
+    60, 120, 300, 600, 900, 1800, 3600, 2 * 3600, 6 * 3600, 12 * 3600, 86400
+]
+
+TIME_RANGES = {'1h': timedelta(hours=1), '6h': timedelta(hours=6),
+               '24h': timedelta(hours=24), '7d': timedelta(days=7), 'all': None}
+RESOLUTIONS = ('auto', 'raw', 'bucketed')
+ARROW_MIME_TYPE = 'application/vnd.apache.arrow.stream'
+NDJSON_MIME_TYPE = 'application/x-ndjson'
+
+ENERGY_COLUMNS = ['power_watts', 'voltage', 'current_amps', 'plug_temp_c']
+STATUS_COLUMNS = [
+    'nozzle_temp_actual', 'bed_temp_actual', 'nozzle_temp_target', 'bed_temp_target',
+    'material', 'is_printing', 'z_height_mm', 'speed_multiplier_percent'
+]
+ENVIRONMENT_COLUMNS = ['temperature_c', 'humidity_percent']
+SERIES_COLUMNS = ['timestamp'] + ENERGY_COLUMNS + STATUS_COLUMNS + ENVIRONMENT_COLUMNS
+# Everything but the timestamp and the material label can be downsampled
+NUMERIC_SERIES = [col for col in SERIES_COLUMNS[1:] if col != 'material']
+
+# is_printing is 0/1 in both modes (the bucketed path reports "printed at
+# any time in the bucket"), so clients see one column type either way.
+SERIES_SCHEMA = pa.schema([
+    ('timestamp', pa.timestamp('us', tz='UTC')),
+    ('power_watts', pa.float64()),
+    ('voltage', pa.float64()),
+    ('current_amps', pa.float64()),
+    ('plug_temp_c', pa.float64()),
+    ('nozzle_temp_actual', pa.float64()),
+    ('bed_temp_actual', pa.float64()),
+    ('nozzle_temp_target', pa.float64()),
+    ('bed_temp_target', pa.float64()),
+    ('material', pa.string()),
+    ('is_printing', pa.int8()),
+    ('z_height_mm', pa.float64()),
+    ('speed_multiplier_percent', pa.float64()),
+    ('temperature_c', pa.float64()),
+    ('humidity_percent', pa.float64()),
+])
+
+# Downsampled series have a different length each, so Arrow carries them in
+# long form: one row per (series, point).
+DOWNSAMPLED_SCHEMA = pa.schema([
+    ('series', pa.dictionary(pa.int8(), pa.string())),
+    ('timestamp', pa.timestamp('ms', tz='UTC')),
+    ('value', pa.float64()),
+])
+
+# --- SQL Queries ---
+RAW_ENERGY_SQL = """
+SELECT timestamp, power_watts, voltage, current_amps, plug_temp_c
+FROM energy_data
+WHERE device_id = %(device_id)s AND timestamp >= %(start)s AND timestamp < %(end)s
+ORDER BY timestamp;
+"""
+
+# Starts at the latest status at or before the range start, so the first
+# energy point still finds the status that was in effect for it.
+RAW_STATUS_SQL = """
+SELECT timestamp, nozzle_temp_actual, bed_temp_actual, nozzle_temp_target, bed_temp_target,
+       material, is_printing, z_height_mm, speed_multiplier_percent
+FROM printer_status
+WHERE device_id = %(device_id)s
+  AND timestamp >= COALESCE(
+      (SELECT max(timestamp) FROM printer_status
+       WHERE device_id = %(device_id)s AND timestamp <= %(start)s),
+      %(start)s)
+  AND timestamp < %(end)s
+ORDER BY timestamp;
+"""
+
+RAW_ENVIRONMENT_SQL = """
+SELECT timestamp, temperature_c, humidity_pct AS humidity_percent
+FROM environment_data
+WHERE device_id = 'environment'
+  AND timestamp >= %(env_start)s AND timestamp <= %(env_end)s
+ORDER BY timestamp;
+"""
+
+# Aggregate first, join later: each table is bucketed on its own and the
+# small per-bucket results are joined on the bucket.
+BUCKETED_SQL = """
+WITH AggEnergy AS (
+    SELECT
+        time_bucket(%(bucket)s::interval, timestamp) AS bucket,
+        AVG(power_watts) AS power_watts,
+        AVG(voltage) AS voltage,
+        AVG(current_amps) AS current_amps,
+        AVG(plug_temp_c) AS plug_temp_c
+    FROM energy_data
+    WHERE device_id = %(device_id)s AND timestamp >= %(start)s AND timestamp < %(end)s
+    GROUP BY 1
+),
+AggStatus AS (
+    SELECT
+        time_bucket(%(bucket)s::interval, timestamp) AS bucket,
+        LAST(nozzle_temp_actual, timestamp) AS nozzle_temp_actual,
+        LAST(bed_temp_actual, timestamp) AS bed_temp_actual,
+        LAST(nozzle_temp_target, timestamp) AS nozzle_temp_target,
+        LAST(bed_temp_target, timestamp) AS bed_temp_target,
+        LAST(material, timestamp) AS material,
+        MAX(is_printing::int) AS is_printing, -- printing at any time in the bucket
+        LAST(z_height_mm, timestamp) AS z_height_mm,
+        LAST(speed_multiplier_percent, timestamp) AS speed_multiplier_percent
+    FROM printer_status
+    WHERE device_id = %(device_id)s AND timestamp >= %(start)s AND timestamp < %(end)s
+    GROUP BY 1
+),
+AggEnvironment AS (
+    SELECT
+        time_bucket(%(bucket)s::interval, timestamp) AS bucket,
+        AVG(temperature_c) AS temperature_c,
+        AVG(humidity_pct) AS humidity_percent
+    FROM environment_data
+    WHERE device_id = 'environment' AND timestamp >= %(start)s AND timestamp < %(end)s
+    GROUP BY 1
+)
+SELECT
+    ae.bucket AS timestamp,
+    ae.power_watts, ae.voltage, ae.current_amps, ae.plug_temp_c,
+    ps.nozzle_temp_actual, ps.bed_temp_actual, ps.nozzle_temp_target, ps.bed_temp_target,
+    ps.material, ps.is_printing, ps.z_height_mm, ps.speed_multiplier_percent,
+    env.temperature_c, env.humidity_percent
+FROM AggEnergy ae
+LEFT JOIN AggStatus ps ON ps.bucket = ae.bucket
+LEFT JOIN AggEnvironment env ON env.bucket = ae.bucket
+WHERE ae.power_watts IS NOT NULL
+ORDER BY ae.bucket;
+"""
+
+FIRST_READING_SQL = "SELECT min(timestamp) FROM energy_data WHERE device_id = %s;"
+
+
+def _parse_time(value, name):
+    try:
+        ts = pd.Timestamp(value)
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid {name}: {value!r}")
+    if ts.tzinfo is None:
+        ts = ts.tz_localize('UTC')
+    return ts.tz_convert('UTC').to_pydatetime()
+
+
+def parse_series_request(params, accept=''):
+    """
+    Validates the request parameters (JSON body or query string).
+
+    Accepts deviceId, timeRange ('1h', '6h', '24h', '7d', 'all' or any 'Nh' /
+    'Nd'), optional ISO start/end overriding timeRange, resolution
+    ('auto', 'raw', 'bucketed') and format ('json' or 'arrow'; an Accept
+    header of application/vnd.apache.arrow.stream also selects Arrow).
+    points=N reduces every numeric series to at most N points with the
+    `downsample` method ('lttb', the default, or 'minmax').
+    Raises ValueError with a client-facing message on invalid input.
+    """
+    device_id = params.get('deviceId') or params.get('device_id')
+    if not isinstance(device_id, str) or not device_id.strip():
+        raise ValueError("Missing or invalid deviceId")
+
+    end = _parse_time(params['end'], 'end') if params.get('end') else datetime.now(timezone.utc)
+    time_range = params.get('timeRange', '24h')
+    if params.get('start'):
+        start = _parse_time(params['start'], 'start')
+    elif time_range in TIME_RANGES:
+        span = TIME_RANGES[time_range]
+        start = None if span is None else end - span
+    elif isinstance(time_range, str) and time_range[:-1].isdigit() and time_range[-1:] in ('h', 'd'):
+        amount = int(time_range[:-1])
+        start = end - (timedelta(hours=amount) if time_range.endswith('h') else timedelta(days=amount))
+    else:
+        raise ValueError(f"Invalid timeRange: {time_range!r}")
+    if start is not None and start >= end:
+        raise ValueError("start must be before end")
+
+    resolution = params.get('resolution', 'auto')
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"Invalid resolution: {resolution!r}")
+
+    output_format = params.get('format') or ('arrow' if ARROW_MIME_TYPE in (accept or '') else 'json')
+    if output_format not in ('json', 'arrow'):
+        raise ValueError(f"Invalid format: {output_format!r}")
+
+    points = params.get('points')
+    if points not in (None, ''):
+        try:
+            points = int(points)
+        except (ValueError, TypeError):
+            raise ValueError(f"Invalid points: {points!r}")
+        if not 3 <= points <= MAX_POINTS:
+            raise ValueError(f"points must be between 3 and {MAX_POINTS}")
+    else:
+        points = None
+    method = params.get('downsample') or 'lttb'
+    if method not in DOWNSAMPLE_METHODS:
+        raise ValueError(f"Invalid downsample method: {method!r}")
+
+    return {'device_id': device_id.strip(), 'start': start, 'end': end,
+            'resolution': resolution, 'format': output_format,
+            'points': points, 'downsample': method}
+
+
+def choose_bucket_seconds(span_seconds, target_points=None):
+    """Smallest bucket width that keeps span_seconds under target_points (default TARGET_POINTS) buckets."""
+    wanted = span_seconds / max(target_points or TARGET_POINTS, 1)
+    for step in BUCKET_STEPS_SECONDS:
+        if step >= wanted:
+            return step
+    return int(math.ceil(wanted / 86400)) * 86400
+
+
+def plan_series_query(conn, query):
+    """
+    Resolves an open-ended range and picks the raw or bucketed path.
+    Returns the query dict extended with 'mode' and 'bucket_seconds'.
+    """
+    plan = dict(query)
+    if plan['start'] is None:
+        with conn.cursor() as cur:
+            cur.execute(FIRST_READING_SQL, (plan['device_id'],))
+            first = cur.fetchone()[0]
+        plan['start'] = first or plan['end']
+
+    span_seconds = max((plan['end'] - plan['start']).total_seconds(), 0)
+    if plan.get('points'):
+        raw_max_hours = DOWNSAMPLE_RAW_MAX_SPAN_HOURS
+        target_points = plan['points'] * DOWNSAMPLE_OVERSAMPLE
+    else:
+        raw_max_hours, target_points = RAW_MAX_SPAN_HOURS, TARGET_POINTS
+    mode = plan['resolution']
+    if mode == 'auto':
+        mode = 'raw' if span_seconds <= raw_max_hours * 3600 else 'bucketed'
+    plan['mode'] = mode
+    plan['bucket_seconds'] = choose_bucket_seconds(span_seconds, target_points) if mode == 'bucketed' else None
+    return plan
+
+
+def _fetch_frame(cursor, columns):
+    """Fetches the next chunk from a server-side cursor as a DataFrame (empty when exhausted)."""
+    df = pd.DataFrame.from_records(cursor.fetchmany(CHUNK_ROWS), columns=columns)
+    df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+    return df
+
+
+def _take_until(buffer, cursor, columns, until):
+    """
+    Splits buffered rows of an ordered cursor at `until`, fetching more as needed.
+    Returns (rows <= until, remaining buffer, exhausted flag).
+    """
+    parts = []
+    buffer, exhausted = buffer
+    while True:
+        due = buffer['timestamp'] <= until
+        parts.append(buffer[due])
+        buffer = buffer[~due]
+        if not buffer.empty or exhausted:
+            break
+        buffer = _fetch_frame(cursor, columns)
+        exhausted = buffer.empty
+    return pd.concat(parts, ignore_index=True), buffer, exhausted
+
+
+def iter_raw_frames(conn, plan):
+    """
+    Yields the joined high-resolution series in chunks of up to CHUNK_ROWS rows.
+
+    One ordered scan per table; each energy chunk is joined against the status
+    rows up to its last timestamp (latest at or before, like the former
+    LATERAL ... LIMIT 1) and the environment rows within ENVIRONMENT_TOLERANCE
+    of it (nearest reading).
+    """
+    params = {
+        'device_id': plan['device_id'], 'start': plan['start'], 'end': plan['end'],
+        'env_start': plan['start'] - ENVIRONMENT_TOLERANCE.to_pytimedelta(),
+        'env_end': plan['end'] + ENVIRONMENT_TOLERANCE.to_pytimedelta(),
+    }
+    status_columns = ['timestamp'] + STATUS_COLUMNS
+    env_columns = ['timestamp'] + ENVIRONMENT_COLUMNS
+
+    # Named cursors are server-side, so a long range never sits in memory at once.
+    energy_cur = conn.cursor(name='analysis_energy')
+    status_cur = conn.cursor(name='analysis_status')
+    env_cur = conn.cursor(name='analysis_environment')
+    for cur in (energy_cur, status_cur, env_cur):
+        cur.itersize = CHUNK_ROWS
+    energy_cur.execute(RAW_ENERGY_SQL, params)
+    status_cur.execute(RAW_STATUS_SQL, params)
+    env_cur.execute(RAW_ENVIRONMENT_SQL, params)
+
+    # Latest status row seen so far, carried into the next chunk
+    last_status = pd.DataFrame(columns=status_columns)
+    pending_status = _fetch_frame(status_cur, status_columns)
+    status_state = (pending_status, pending_status.empty)
+    # Environment rows are kept from tolerance before the chunk onwards, so
+    # the nearest reading on either side of a chunk boundary is available.
+    env_window = pd.DataFrame(columns=env_columns)
+    pending_env = _fetch_frame(env_cur, env_columns)
+    env_state = (pending_env, pending_env.empty)
+
+    try:
+        while True:
+            energy_df = _fetch_frame(energy_cur, ['timestamp'] + ENERGY_COLUMNS)
+            if energy_df.empty:
+                break
+            chunk_end = energy_df['timestamp'].iloc[-1]
+
+            new_status, pending_status, status_exhausted = _take_until(
+                status_state, status_cur, status_columns, chunk_end)
+            status_state = (pending_status, status_exhausted)
+            status_df = pd.concat([p for p in (last_status, new_status) if not p.empty]
+                                  or [last_status], ignore_index=True)
+            status_df['timestamp'] = pd.to_datetime(status_df['timestamp'], utc=True)
+            last_status = status_df.tail(1)
+
+            new_env, pending_env, env_exhausted = _take_until(
+                env_state, env_cur, env_columns, chunk_end + ENVIRONMENT_TOLERANCE)
+            env_state = (pending_env, env_exhausted)
+            env_window = pd.concat([p for p in (env_window, new_env) if not p.empty]
+                                   or [env_window], ignore_index=True)
+            env_window['timestamp'] = pd.to_datetime(env_window['timestamp'], utc=True)
+
+            df = pd.merge_asof(energy_df, status_df, on='timestamp',
+                               direction='backward', allow_exact_matches=True)
+            df = pd.merge_asof(df, env_window, on='timestamp', direction='nearest',
+                               tolerance=ENVIRONMENT_TOLERANCE)
+            env_window = env_window[env_window['timestamp'] >= chunk_end - ENVIRONMENT_TOLERANCE]
+            yield df[SERIES_COLUMNS]
+    finally:
+        for cur in (energy_cur, status_cur, env_cur):
+            cur.close()
+
+
+def iter_bucketed_frames(conn, plan):
+    """Yields the time-bucketed series in chunks of up to CHUNK_ROWS rows."""
+    params = {
+        'device_id': plan['device_id'], 'start': plan['start'], 'end': plan['end'],
+        'bucket': timedelta(seconds=plan['bucket_seconds']),
+    }
+    cur = conn.cursor(name='analysis_bucketed')
+    cur.itersize = CHUNK_ROWS
+    try:
+        cur.execute(BUCKETED_SQL, params)
+        while True:
+            df = _fetch_frame(cur, SERIES_COLUMNS)
+            if df.empty:
+                break
+            yield df
+    finally:
+        cur.close()
+
+
+def _normalize(df):
+    """Casts a chunk to the SERIES_SCHEMA column types."""
+    df = df.copy()
+    for col in SERIES_COLUMNS[1:]:
+        if col == 'material':
+            df[col] = df[col].astype(object).where(df[col].notna(), None)
+        elif col == 'is_printing':
+            df[col] = pd.array(
+                [None if pd.isna(v) else int(bool(v)) for v in df[col]], dtype='Int8')
+        else:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+    return df
+
+
+def _json_columns(df):
+    """Columnar dict of plain lists; timestamps as epoch milliseconds, gaps as null."""
+    columns = {'timestamp': df['timestamp'].dt.as_unit('ms').astype('int64').tolist()}
+    for col in SERIES_COLUMNS[1:]:
+        values = df[col]
+        if values.dtype == 'float64':
+            arr = values.to_numpy()
+            columns[col] = [None if np.isnan(v) else v for v in arr.tolist()]
+        else:
+            columns[col] = [None if pd.isna(v) else (int(v) if col == 'is_printing' else v)
+                            for v in values.tolist()]
+    return columns
+
+
+def series_metadata(plan):
+    return {
+        'deviceId': plan['device_id'],
+        'start': plan['start'].isoformat(),
+        'end': plan['end'].isoformat(),
+        'mode': plan['mode'],
+        'bucketSeconds': plan['bucket_seconds'],
+        'columns': NUMERIC_SERIES if plan.get('points') else SERIES_COLUMNS,
+        'timeUnit': 'ms',
+        'points': plan.get('points'),
+        'downsample': plan['downsample'] if plan.get('points') else None,
+    }
+
+
+def downsample_frames(frames, plan):
+    """
+    Collects all chunks and reduces each numeric series to at most plan['points'].
+    Returns {column: (timestamps_ms, values)}; gaps (NULLs) are skipped per series.
+    """
+    parts = [_normalize(df) for df in frames]
+    if not parts:
+        return {col: (np.empty(0, dtype=np.int64), np.empty(0)) for col in NUMERIC_SERIES}
+    df = pd.concat(parts, ignore_index=True)
+    x = df['timestamp'].dt.as_unit('ms').astype('int64').to_numpy()
+    series = {}
+    for col in NUMERIC_SERIES:
+        y = df[col].astype('float64').to_numpy(na_value=np.nan)
+        xs, ys = downsample(x, y, plan['points'], plan['downsample'])
+        series[col] = (xs.astype(np.int64), ys)
+    return series
+
+
+def series_mimetype(plan):
+    if plan['format'] == 'arrow':
+        return ARROW_MIME_TYPE
+    return 'application/json' if plan.get('points') else NDJSON_MIME_TYPE
+
+
+def stream_series(conn, plan):
+    """
+    Generator producing the response body and closing `conn` when done.
+
+    JSON: newline-delimited; a {"meta": ...} line, one {"columns": {...}} line
+    per chunk (column name -> array, ready to concatenate into chart series)
+    and a final {"done": true, "rows": n} line.
+    Arrow: an IPC stream with one record batch per chunk and the plan in the
+    schema metadata.
+
+    With plan['points'] every numeric series is downsampled before anything is
+    sent: JSON is then a single {"meta", "series": {column: {"timestamp",
+    "values"}}} document, Arrow a single long-form batch.
+    """
+    frames = iter_bucketed_frames(conn, plan) if plan['mode'] == 'bucketed' else iter_raw_frames(conn, plan)
+    meta = series_metadata(plan)
+    rows = 0
+    try:
+        if plan.get('points'):
+            series = downsample_frames(frames, plan)
+            if plan['format'] == 'arrow':
+                names = list(series)
+                batch = pa.RecordBatch.from_arrays([
+                    pa.DictionaryArray.from_arrays(
+                        np.repeat(np.arange(len(names), dtype=np.int8), [len(x) for x, _ in series.values()]),
+                        names),
+                    pa.array(np.concatenate([x for x, _ in series.values()]), pa.timestamp('ms', tz='UTC')),
+                    pa.array(np.concatenate([y for _, y in series.values()]), pa.float64()),
+                ], schema=DOWNSAMPLED_SCHEMA)
+                sink = io.BytesIO()
+                with pa.ipc.new_stream(sink, DOWNSAMPLED_SCHEMA.with_metadata({'analysis': json.dumps(meta)})) as writer:
+                    writer.write_batch(batch)
+                yield sink.getvalue()
+            else:
+                yield json.dumps({'meta': meta, 'series': {
+                    col: {'timestamp': x.tolist(), 'values': y.tolist()} for col, (x, y) in series.items()
+                }})
+        elif plan['format'] == 'arrow':
+            sink = io.BytesIO()
+            schema = SERIES_SCHEMA.with_metadata({'analysis': json.dumps(meta)})
+            with pa.ipc.new_stream(sink, schema) as writer:
+                for df in frames:
+                    writer.write_batch(pa.RecordBatch.from_pandas(_normalize(df), schema=schema,
+                                                                  preserve_index=False))
+                    yield sink.getvalue()
+                    sink.seek(0)
+                    sink.truncate()
+            yield sink.getvalue()
+        else:
+            yield json.dumps({'meta': meta}) + '\n'
+            for df in frames:
+                rows += len(df)
+                yield json.dumps({'columns': _json_columns(_normalize(df))}) + '\n'
+            yield json.dumps({'done': True, 'rows': rows}) + '\n'
+    finally:
+        frames.close()
+        conn.close()
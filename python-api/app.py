@@ -1,23 +1,36 @@
 # home/ubuntu/enms-project/python-api/app.py
 
 import os
+import time
+import threading
 import traceback
 import psycopg2
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, Response
 from flask_cors import CORS
 from psycopg2.extras import RealDictCursor
 import csv
+import base64
+import binascii
+from datetime import datetime
 from io import StringIO
 
+from analysis_service import (
+    parse_series_request, plan_series_query, stream_series, series_mimetype
+)
+from gcode_layers import content_hash, read_layer_index, read_layers
+from gcode_preview import read_preview, PREVIEW_MIME_TYPE
+from json_responses import encode_response, JSON_MIME_TYPE
+
 # These imports might not exist, but let's keep them from your original file
 # If they are the cause of the error, the app won't even start.
 try:
-    from dpp_simulator import get_live_dpp_data
+    from dpp_simulator import get_live_dpp_data, get_device_detail
     from pdf_service import generate_pdf_for_job
     print("--- DEBUG: Successfully imported dpp_simulator and pdf_service. ---")
 except ImportError:
     print("--- DEBUG: Could not import dpp_simulator or pdf_service. Ignoring for now. ---")
     get_live_dpp_data = lambda: {"error": "DPP simulator not available"}
+    get_device_detail = lambda device_id: {"error": "DPP simulator not available"}
     generate_pdf_for_job = lambda job_id: {"error": "PDF service not available"}
 
 # Import authentication services
@@ -40,6 +53,15 @@ app = Flask(__name__)
 CORS(app)
 
 
+def json_response(payload, status=200):
+    """
+    Like jsonify, for the large documents: orjson-encoded and compressed for
+    the request's Accept-Encoding (see json_responses.py).
+    """
+    body, headers = encode_response(payload, request.headers.get('Accept-Encoding'))
+    return Response(body, status=status, mimetype=JSON_MIME_TYPE, headers=headers)
+
+
 # --- Existing DPP Endpoints (with syntax corrections) ---
 
 @app.route('/api/dpp_summary', methods=['GET'])
@@ -57,7 +79,25 @@ def dpp_summary():
         data = get_live_dpp_data(page=page, limit=limit, searchTerm=search_term)
         if "error" in data:
             return jsonify(data), 500
-        return jsonify(data)
+        return json_response(data)
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/dpp/devices/<device_id>', methods=['GET'])
+def dpp_device_detail(device_id):
+    """
+    Full job analyses and recent history of one printer. dpp_summary only
+    carries the card projection; the page fetches this when a card is opened.
+    """
+    try:
+        data = get_device_detail(device_id)
+        if data is None:
+            return jsonify({"error": f"Unknown device '{device_id}'"}), 404
+        if "error" in data:
+            return jsonify(data), 500
+        return json_response(data)
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
@@ -129,7 +169,7 @@ def get_devices():
             columns = [desc[0] for desc in cur.description]
             devices = [dict(zip(columns, row)) for row in cur.fetchall()]
             print("--- DEBUG: Results fetched and processed. Returning data. ---")
-        return jsonify(devices)
+        return json_response(devices)
     except Exception as e:
         print("--- DEBUG: An exception occurred INSIDE THE 'try' block of get_devices(). ---")
         traceback.print_exc()
@@ -154,7 +194,7 @@ def get_device(device_id):
             if device_data is None:
                 return jsonify({"error": "Device not found"}), 404
             device = dict(zip(columns, device_data))
-        return jsonify(device)
+        return json_response(device)
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
@@ -495,43 +535,86 @@ def auth_check_session():
 # ADMIN ENDPOINTS
 # ====================================================================
 
+def _encode_users_cursor(user):
+    """Builds an opaque keyset cursor from the last row of a users page."""
+    raw = f"{user['created_at'].isoformat()}|{user['id']}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def _decode_users_cursor(token):
+    """Returns (created_at, id) from a cursor produced by _encode_users_cursor."""
+    raw = base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8')
+    created_at, user_id = raw.rsplit('|', 1)
+    return datetime.fromisoformat(created_at), int(user_id)
+
+
 @app.route('/api/admin/users', methods=['GET'])
 @require_admin
 def admin_get_users():
-    """Get all users (admin only)"""
+    """
+    Get all users (admin only).
+
+    Supports two pagination modes:
+      - ?page=N          classic offset pagination with a total count
+      - ?cursor=<token>  keyset pagination on (created_at, id); the cost of a
+                         page does not depend on how deep the client has paged.
+                         Pass include_total=true to also get the total count.
+    Every response carries 'next_cursor' so clients can switch to keyset mode.
+    Search predicates are served by the pg_trgm indexes in 05_admin_user_search.sql.
+    """
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'error': 'Database connection failed'}), 500
-        
         # Get query parameters
         page = request.args.get('page', 1, type=int)
         limit = request.args.get('limit', 50, type=int)
         search = request.args.get('search', '', type=str)
-        
-        offset = (page - 1) * limit
-        
+        cursor_token = request.args.get('cursor', None, type=str)
+        include_total = request.args.get('include_total', 'false').lower() == 'true'
+
+        limit = max(1, min(limit, 500))
+        keyset = None
+        if cursor_token:
+            try:
+                keyset = _decode_users_cursor(cursor_token)
+            except (ValueError, UnicodeDecodeError, binascii.Error):
+                return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'error': 'Database connection failed'}), 500
+
         cursor = conn.cursor(cursor_factory=RealDictCursor)
         
         # Build search query
-        where_clause = ""
+        conditions = []
         params = []
         if search:
-            where_clause = """
-                WHERE email ILIKE %s 
-                OR full_name ILIKE %s 
+            conditions.append("""
+                (email ILIKE %s
+                OR full_name ILIKE %s
                 OR organization ILIKE %s
-                OR country ILIKE %s
-            """
+                OR country ILIKE %s)
+            """)
             search_param = f'%{search}%'
             params = [search_param, search_param, search_param, search_param]
-        
-        # Get total count
-        count_query = f"SELECT COUNT(*) as total FROM demo_users {where_clause}"
-        cursor.execute(count_query, params)
-        total = cursor.fetchone()['total']
-        
-        # Get users
+        search_where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        # Get total count (skipped in keyset mode unless explicitly requested)
+        total = None
+        if keyset is None or include_total:
+            count_query = f"SELECT COUNT(*) as total FROM demo_users {search_where}"
+            cursor.execute(count_query, params)
+            total = cursor.fetchone()['total']
+
+        page_params = list(params)
+        if keyset is not None:
+            conditions.append("(created_at, id) < (%s, %s)")
+            page_params += list(keyset)
+            offset_clause = ""
+        else:
+            offset_clause = "OFFSET %s"
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        # Get users (fetch one extra row to know whether another page exists)
         query = f"""
             SELECT 
                 id, email, organization, full_name, position, mobile, country,
@@ -539,88 +622,113 @@ def admin_get_users():
                 ip_address_signup
             FROM demo_users
             {where_clause}
-            ORDER BY created_at DESC
-            LIMIT %s OFFSET %s
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s {offset_clause}
         """
-        cursor.execute(query, params + [limit, offset])
+        page_params.append(limit + 1)
+        if keyset is None:
+            page_params.append((page - 1) * limit)
+        cursor.execute(query, page_params)
         users = cursor.fetchall()
         
         cursor.close()
         conn.close()
-        
-        return jsonify({
+
+        has_more = len(users) > limit
+        users = users[:limit]
+        next_cursor = _encode_users_cursor(users[-1]) if has_more and users[-1]['created_at'] else None
+
+        pagination = {
+            'limit': limit,
+            'total': total,
+            'has_more': has_more,
+            'next_cursor': next_cursor
+        }
+        if keyset is None:
+            pagination['page'] = page
+            pagination['pages'] = (total + limit - 1) // limit
+
+        return json_response({
             'success': True,
             'users': users,
-            'pagination': {
-                'page': page,
-                'limit': limit,
-                'total': total,
-                'pages': (total + limit - 1) // limit
-            }
-        }), 200
+            'pagination': pagination
+        })
         
     except Exception as e:
         traceback.print_exc()
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/admin/stats', methods=['GET'])
-@require_admin
-def admin_get_stats():
-    """Get user statistics (admin only)"""
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'error': 'Database connection failed'}), 500
-        
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Get overall stats
-        cursor.execute("SELECT * FROM v_demo_user_stats")
-        stats = cursor.fetchone()
-        
-        # Get country distribution
-        cursor.execute("""
+# Admin statistics are cached in-process for a short TTL so that dashboard
+# refreshes do not re-aggregate demo_users / demo_audit_log on every call.
+ADMIN_STATS_CACHE_TTL_SECONDS = float(os.environ.get('ADMIN_STATS_CACHE_TTL_SECONDS', 30))
+_admin_stats_cache = {'payload': None, 'expires_at': 0.0}
+_admin_stats_lock = threading.Lock()
+
+# All four dashboard aggregates in a single round-trip. The audit-log
+# aggregation is bounded to the last 24h and served by idx_demo_audit_log_created_at.
+ADMIN_STATS_QUERY = """
+    SELECT
+        (SELECT row_to_json(s) FROM v_demo_user_stats s) AS stats,
+        (SELECT COALESCE(json_agg(c), '[]'::json) FROM (
             SELECT country, COUNT(*) as count
             FROM demo_users
             WHERE is_active = TRUE
             GROUP BY country
             ORDER BY count DESC
             LIMIT 10
-        """)
-        countries = cursor.fetchall()
-        
-        # Get organization distribution
-        cursor.execute("""
+        ) c) AS countries,
+        (SELECT COALESCE(json_agg(o), '[]'::json) FROM (
             SELECT organization, COUNT(*) as count
             FROM demo_users
             WHERE is_active = TRUE
             GROUP BY organization
             ORDER BY count DESC
             LIMIT 10
-        """)
-        organizations = cursor.fetchall()
-        
-        # Get recent activity
-        cursor.execute("""
+        ) o) AS organizations,
+        (SELECT COALESCE(json_agg(a), '[]'::json) FROM (
             SELECT action, COUNT(*) as count, MAX(created_at) as last_occurrence
             FROM demo_audit_log
             WHERE created_at >= NOW() - INTERVAL '24 hours'
             GROUP BY action
             ORDER BY count DESC
-        """)
-        recent_activity = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
-        
-        return jsonify({
-            'success': True,
-            'stats': stats,
-            'countries': countries,
-            'organizations': organizations,
-            'recent_activity': recent_activity
-        }), 200
+        ) a) AS recent_activity
+"""
+
+
+@app.route('/api/admin/stats', methods=['GET'])
+@require_admin
+def admin_get_stats():
+    """Get user statistics (admin only)"""
+    try:
+        now = time.monotonic()
+        with _admin_stats_lock:
+            if _admin_stats_cache['payload'] is not None and now < _admin_stats_cache['expires_at']:
+                return jsonify(_admin_stats_cache['payload']), 200
+
+            conn = get_db_connection()
+            if not conn:
+                return jsonify({'error': 'Database connection failed'}), 500
+
+            try:
+                cursor = conn.cursor(cursor_factory=RealDictCursor)
+                cursor.execute(ADMIN_STATS_QUERY)
+                row = cursor.fetchone()
+                cursor.close()
+            finally:
+                conn.close()
+
+            payload = {
+                'success': True,
+                'stats': row['stats'],
+                'countries': row['countries'],
+                'organizations': row['organizations'],
+                'recent_activity': row['recent_activity']
+            }
+            _admin_stats_cache['payload'] = payload
+            _admin_stats_cache['expires_at'] = now + ADMIN_STATS_CACHE_TTL_SECONDS
+
+        return jsonify(payload), 200
         
     except Exception as e:
         traceback.print_exc()
@@ -675,6 +783,86 @@ def admin_export_users():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+# --- Analysis Series Endpoint ---
+# Serves the joined energy/status/environment series behind the analysis page.
+# Short ranges are raw points, long ranges time buckets; points=N downsamples
+# every series to at most N points. See analysis_service.py.
+@app.route('/api/analysis/series', methods=['GET', 'POST'])
+def analysis_series():
+    params = request.get_json(silent=True) if request.method == 'POST' else None
+    try:
+        query = parse_series_request(params or request.args, accept=request.headers.get('Accept', ''))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        plan = plan_series_query(conn, query)
+    except Exception as e:
+        conn.close()
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+    # stream_series owns the connection from here and closes it when done.
+    return Response(
+        stream_series(conn, plan),
+        mimetype=series_mimetype(plan),
+        # Let nginx pass chunks through as they are produced
+        headers={'X-Accel-Buffering': 'no', 'Cache-Control': 'no-store'}
+    )
+
+
+# --- G-code Layer Endpoints ---
+# Served from the analyzer's layer index: one seek and one read per request,
+# so a preview or per-layer analysis never downloads the whole file.
+@app.route('/api/gcode/<string:job_key>/layers', methods=['GET'])
+def gcode_layer_index(job_key):
+    try:
+        index, index_hash = read_layer_index(job_key)
+    except (ValueError, FileNotFoundError):
+        return jsonify({'error': 'No layer index for this job'}), 404
+    response = jsonify(index)
+    # A re-analysis rewrites the sidecar, so its hash changes with the file
+    response.set_etag(index_hash)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
+@app.route('/api/gcode/<string:job_key>/layers/<int:layer>', methods=['GET'])
+def gcode_layer_slice(job_key, layer):
+    count = request.args.get('count', default=1, type=int)
+    try:
+        data = read_layers(job_key, layer, count)
+    except FileNotFoundError:
+        return jsonify({'error': 'No layer index for this job'}), 404
+    except IndexError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    response = Response(data, mimetype='text/plain')
+    response.set_etag(content_hash(data))
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
+@app.route('/api/gcode/<string:job_key>/preview', methods=['GET'])
+def gcode_preview(job_key):
+    try:
+        data, content_hash = read_preview(job_key)
+    except (ValueError, FileNotFoundError):
+        return jsonify({'error': 'No preview for this job'}), 404
+    response = Response(data, mimetype=PREVIEW_MIME_TYPE)
+    response.set_etag(content_hash)
+    if request.args.get('v') == content_hash:
+        # Versioned URL from the analyzer: the bytes behind it never change
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
 # --- Main execution block ---
 if __name__ == '__main__':
     # For production, debug should be False. Gunicorn or another WSGI server will be used.
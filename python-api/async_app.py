@@ -0,0 +1,362 @@
+# async_app.py
+# Asyncio tier for the read-heavy python-api endpoints.
+#
+# Served by uvicorn (see the python_api_async service in docker-compose.yml);
+# nginx routes the GETs below here and everything else, including all
+# writes and the authenticated routes, to the Flask app. Requests share one
+# asyncpg pool per worker instead of opening a connection each, and a
+# waiting query holds no thread, so hundreds of open dashboards cost
+# sockets rather than gunicorn threads.
+#
+#   GET       /api/dpp_summary            (same document as app.dpp_summary)
+#   GET       /api/dpp/events             (live card stream, see dpp_events.py)
+#   GET       /api/dpp/devices/<id>       (app.dpp_device_detail)
+#   GET       /api/devices/, /api/devices/<id>
+#   GET|POST  /api/analysis/series        (app.analysis_series)
+#
+# The SQL and the row processing are the ones the Flask routes use
+# (dpp_simulator, analysis_service); only the database access differs.
+import asyncio
+import contextlib
+import functools
+import json
+import os
+import re
+import sys
+import traceback
+
+import anyio
+import asyncpg
+from starlette.applications import Starlette
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+
+from analysis_service import (
+    parse_series_request, plan_series_query, stream_series, series_mimetype, CHUNK_ROWS
+)
+from dpp_events import DppEventHub, TooManySubscribers
+from dpp_simulator import (
+    QUERY_ALL_PRINTERS, GLOBAL_HISTORY_COUNT_SQL, GLOBAL_HISTORY_ITEMS_SQL, DEVICE_DETAIL_SQL,
+    global_history_params, format_global_history, build_printer_cards, format_device_detail
+)
+from json_responses import dumps, encode_response, JSON_MIME_TYPE
+
+# Connections per worker; each uvicorn worker has its own pool
+POOL_SIZE = int(os.environ.get('ASYNC_DB_POOL_SIZE', 10))
+
+DB_SETTINGS = dict(
+    database=os.environ.get('POSTGRES_DB', 'reg_ml_demo'),
+    user=os.environ.get('POSTGRES_USER', 'reg_ml_demo'),
+    password=os.environ.get('POSTGRES_PASSWORD', 'raptorblingx_demo'),
+    host=os.environ.get('POSTGRES_HOST', 'postgres'),
+    port=os.environ.get('POSTGRES_PORT', '5432'),
+)
+
+# Same queries as app.get_devices / app.get_device
+DEVICE_LIST_SQL = """
+    SELECT device_id, device_model, friendly_name, location, notes,
+           shelly_id, api_ip, simplyprint_id, sp_company_id,
+           printer_size_category, bed_width, bed_depth
+    FROM public.devices ORDER BY friendly_name ASC
+"""
+DEVICE_SQL = "SELECT * FROM public.devices WHERE device_id = %s"
+
+_PARAM_RE = re.compile(r"%\((\w+)\)s|%s|%%")
+
+
+@functools.lru_cache(maxsize=64)
+def _convert_query(sql):
+    """
+    Rewrites psycopg2 placeholders (%s, %(name)s) as asyncpg's $n.
+    Returns (query, keys): the parameter index or name behind each $n.
+    """
+    keys = []
+
+    def placeholder(match):
+        if match.group(0) == '%%':
+            return '%'
+        name = match.group(1)
+        if name is None:
+            keys.append(sum(isinstance(k, int) for k in keys))
+        elif name in keys:
+            return f"${keys.index(name) + 1}"
+        else:
+            keys.append(name)
+        return f"${len(keys)}"
+
+    return _PARAM_RE.sub(placeholder, sql), tuple(keys)
+
+
+def to_asyncpg(sql, params=()):
+    """(query, args) for asyncpg from a psycopg2-style query and its parameters."""
+    query, keys = _convert_query(sql)
+    return query, [params[k] for k in keys]
+
+
+async def _init_connection(conn):
+    # psycopg2 returns json/jsonb as Python objects; asyncpg returns text by default
+    for type_name in ('json', 'jsonb'):
+        await conn.set_type_codec(type_name, encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
+
+
+def _json(request, content, status_code=200):
+    # Same serialization and compression as the Flask routes (json_responses.py)
+    body, headers = encode_response(content, request.headers.get('accept-encoding'))
+    return Response(body, status_code=status_code, headers=headers, media_type=JSON_MIME_TYPE)
+
+
+def _error(message, status_code):
+    return Response(dumps({"error": message}), status_code=status_code, media_type=JSON_MIME_TYPE)
+
+
+def _int_arg(request, name, default):
+    # Like Flask's request.args.get(name, default, type=int)
+    try:
+        return int(request.query_params[name])
+    except (KeyError, ValueError):
+        return default
+
+
+async def _fetch(pool, sql, params=()):
+    query, args = to_asyncpg(sql, params)
+    async with pool.acquire() as conn:
+        return await conn.fetch(query, *args)
+
+
+async def _fetchrow(pool, sql, params=()):
+    query, args = to_asyncpg(sql, params)
+    async with pool.acquire() as conn:
+        return await conn.fetchrow(query, *args)
+
+
+# --- Blocking bridge for analysis_service ---
+# The analysis series joins run in pandas and are CPU-bound, so they stay
+# synchronous and run in the threadpool. They read through this
+# psycopg2-shaped facade, which runs each call on the event loop over a
+# pooled asyncpg connection. Named (server-side) cursors become asyncpg
+# cursors in a read-only transaction.
+
+class _BlockingCursor:
+    itersize = CHUNK_ROWS
+
+    def __init__(self, connection, name=None):
+        self._connection = connection
+        self._name = name
+        self._rows = []
+        self._cursor = None
+
+    def execute(self, sql, params=()):
+        query, args = to_asyncpg(sql, params)
+        conn = self._connection.raw
+        if self._name is None:
+            self._rows = list(self._connection.call(conn.fetch(query, *args)))
+        else:
+            self._connection.begin()
+            self._cursor = self._connection.call(conn.cursor(query, *args))
+
+    def fetchmany(self, size):
+        if self._cursor is not None:
+            rows = self._connection.call(self._cursor.fetch(size))
+        else:
+            rows, self._rows = self._rows[:size], self._rows[size:]
+        return [tuple(row) for row in rows]
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def close(self):
+        self._rows = []
+        self._cursor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BlockingConnection:
+    """Enough of a psycopg2 connection for analysis_service, used from a worker thread."""
+
+    def __init__(self, pool, loop):
+        self._pool = pool
+        self._loop = loop
+        self._transaction = None
+        self.raw = self.call(pool.acquire())
+
+    def call(self, awaitable):
+        """Awaits `awaitable` on the event loop and returns its result."""
+        async def wait():
+            return await awaitable
+        return asyncio.run_coroutine_threadsafe(wait(), self._loop).result()
+
+    def begin(self):
+        if self._transaction is None:
+            self._transaction = self.raw.transaction(readonly=True)
+            self.call(self._transaction.start())
+
+    def cursor(self, name=None):
+        return _BlockingCursor(self, name)
+
+    def close(self):
+        if self.raw is None:
+            return
+        conn, transaction = self.raw, self._transaction
+        self.raw = self._transaction = None
+
+        async def release():
+            try:
+                if transaction is not None:
+                    await transaction.rollback()
+            finally:
+                await self._pool.release(conn)
+
+        self.call(release())
+
+
+async def _close_when_done(body):
+    """Iterates a blocking generator in the threadpool and always closes it there."""
+    try:
+        async for chunk in iterate_in_threadpool(body):
+            yield chunk
+    finally:
+        # Also runs on client disconnect; closing releases the connection
+        with anyio.CancelScope(shield=True):
+            await run_in_threadpool(body.close)
+
+
+# --- Endpoints ---
+
+async def dpp_summary(request):
+    pool = request.app.state.pool
+    page = _int_arg(request, 'page', 1)
+    limit = _int_arg(request, 'limit', 12)
+    count_params, item_params = global_history_params(page, limit, request.query_params.get('searchTerm'))
+    try:
+        # Three queries on three pooled connections at once
+        all_printers, count_rows, history_rows = await asyncio.gather(
+            _fetch(pool, QUERY_ALL_PRINTERS),
+            _fetch(pool, GLOBAL_HISTORY_COUNT_SQL, count_params),
+            _fetch(pool, GLOBAL_HISTORY_ITEMS_SQL, item_params),
+        )
+        # Enrichment and the thumbnail manifests touch the disk
+        printers = await run_in_threadpool(build_printer_cards, all_printers)
+        global_history = await run_in_threadpool(
+            format_global_history, history_rows, page, limit, count_rows[0][0])
+    except Exception as e:
+        print(f"FATAL ERROR during dpp_summary: {e}", file=sys.stderr)
+        traceback.print_exc()
+        return _error("Failed to fetch data from the database.", 500)
+    return _json(request, {"printers": printers, "globalHistory": global_history})
+
+
+async def dpp_events(request):
+    """
+    Server-Sent Events stream of the dpp_summary printer cards: a snapshot
+    on connect, then the cards that changed (see dpp_events.py). 503 when
+    the stream limit is reached; the page then keeps polling dpp_summary.
+    """
+    try:
+        stream = request.app.state.dpp_event_hub.open_stream()
+    except TooManySubscribers:
+        return _error("Too many live viewers, poll /api/dpp_summary instead", 503)
+    return StreamingResponse(stream, media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Deliver every event as it is written instead of buffering in nginx
+        'X-Accel-Buffering': 'no',
+    })
+
+
+async def dpp_device_detail(request):
+    device_id = request.path_params['device_id']
+    try:
+        row = await _fetchrow(request.app.state.pool, DEVICE_DETAIL_SQL, (5, device_id))
+    except Exception as e:
+        traceback.print_exc()
+        return _error(str(e), 500)
+    if row is None:
+        return _error(f"Unknown device '{device_id}'", 404)
+    return _json(request, format_device_detail(row))
+
+
+async def get_devices(request):
+    try:
+        rows = await _fetch(request.app.state.pool, DEVICE_LIST_SQL)
+    except Exception as e:
+        traceback.print_exc()
+        return _error(str(e), 500)
+    return _json(request, [dict(row) for row in rows])
+
+
+async def get_device(request):
+    try:
+        row = await _fetchrow(request.app.state.pool, DEVICE_SQL, (request.path_params['device_id'],))
+    except Exception as e:
+        traceback.print_exc()
+        return _error(str(e), 500)
+    if row is None:
+        return _error("Device not found", 404)
+    return _json(request, dict(row))
+
+
+async def analysis_series(request):
+    params = None
+    if request.method == 'POST':
+        try:
+            params = await request.json()
+        except ValueError:
+            params = None
+    try:
+        query = parse_series_request(params or request.query_params, accept=request.headers.get('accept', ''))
+    except ValueError as e:
+        return _error(str(e), 400)
+
+    def open_and_plan():
+        conn = BlockingConnection(request.app.state.pool, request.app.state.loop)
+        try:
+            return conn, plan_series_query(conn, query)
+        except Exception:
+            conn.close()
+            raise
+
+    try:
+        conn, plan = await run_in_threadpool(open_and_plan)
+    except Exception as e:
+        traceback.print_exc()
+        return _error(str(e), 500)
+
+    # stream_series owns the connection from here and closes it when done.
+    return StreamingResponse(
+        _close_when_done(stream_series(conn, plan)),
+        media_type=series_mimetype(plan),
+        headers={'X-Accel-Buffering': 'no', 'Cache-Control': 'no-store'}
+    )
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    app.state.loop = asyncio.get_running_loop()
+    app.state.pool = await asyncpg.create_pool(
+        **DB_SETTINGS, min_size=1, max_size=POOL_SIZE, init=_init_connection,
+    )
+    app.state.dpp_event_hub = DppEventHub(app.state.pool, functools.partial(asyncpg.connect, **DB_SETTINGS))
+    try:
+        yield
+    finally:
+        await app.state.dpp_event_hub.close()
+        await app.state.pool.close()
+
+
+app = Starlette(
+    routes=[
+        Route('/api/dpp_summary', dpp_summary, methods=['GET']),
+        Route('/api/dpp/events', dpp_events, methods=['GET']),
+        Route('/api/dpp/devices/{device_id}', dpp_device_detail, methods=['GET']),
+        Route('/api/devices/', get_devices, methods=['GET']),
+        Route('/api/devices/{device_id}', get_device, methods=['GET']),
+        Route('/api/analysis/series', analysis_series, methods=['GET', 'POST']),
+    ],
+    lifespan=lifespan,
+)
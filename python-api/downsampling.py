@@ -0,0 +1,104 @@
+# downsampling.py
+# Point-reduction for chart series: Largest-Triangle-Three-Buckets (LTTB) and
+# a min/max envelope. Both return indices into the input arrays, so the
+# selected points are real readings (spikes keep their true height instead of
+# being averaged away) and any other column can be sliced with them.
+import numpy as np
+
+METHODS = ('lttb', 'minmax')
+
+
+def _bucket_edges(start, stop, buckets):
+    """Splits [start, stop) into `buckets` contiguous index ranges of near-equal size."""
+    return np.linspace(start, stop, buckets + 1).astype(np.int64)
+
+
+def lttb_indices(x, y, n_out):
+    """
+    Indices of at most n_out points chosen by Largest-Triangle-Three-Buckets.
+
+    The first and last points are always kept. The interior is split into
+    n_out - 2 buckets and from each the point forming the largest triangle
+    with the previously kept point and the next bucket's centroid is taken.
+    Bucket centroids come from prefix sums; only the per-bucket argmax chain
+    is sequential. x must be increasing; x and y must not contain NaN.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n_out >= n:
+        return np.arange(n)
+    if n_out < 3:
+        return np.array([0, n - 1])[:max(n_out, 0)]
+
+    buckets = n_out - 2
+    edges = _bucket_edges(1, n - 1, buckets)
+    # Centroid of the bucket after each bucket; the last bucket looks at the final point.
+    x_sum = np.concatenate(([0.0], np.cumsum(x)))
+    y_sum = np.concatenate(([0.0], np.cumsum(y)))
+    next_lo = np.append(edges[1:-1], n - 1)
+    next_hi = np.append(edges[2:], n)
+    counts = next_hi - next_lo
+    x_avg = (x_sum[next_hi] - x_sum[next_lo]) / counts
+    y_avg = (y_sum[next_hi] - y_sum[next_lo]) / counts
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(buckets):
+        lo, hi = edges[i], edges[i + 1]
+        # Twice the triangle area; the constant factor does not change the argmax.
+        area = np.abs((x[a] - x_avg[i]) * (y[lo:hi] - y[a])
+                      - (x[a] - x[lo:hi]) * (y_avg[i] - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def minmax_indices(y, n_out):
+    """
+    Indices of at most n_out points forming a min/max envelope.
+
+    The first and last points are kept and the rest is split into
+    (n_out - 2) // 2 buckets, each contributing its minimum and maximum, so
+    every peak and trough of the series stays visible. Fully vectorized:
+    buckets are padded into one 2-D array and reduced along its rows.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n_out >= n:
+        return np.arange(n)
+    buckets = (n_out - 2) // 2
+    if buckets < 1:
+        return np.array([0, n - 1])[:max(n_out, 0)]
+
+    edges = _bucket_edges(1, n - 1, buckets)
+    width = int(np.max(np.diff(edges)))
+    idx = edges[:-1, None] + np.arange(width)
+    valid = idx < edges[1:, None]
+    idx = np.minimum(idx, n - 1)
+    values = y[idx]
+    lows = idx[np.arange(buckets), np.argmin(np.where(valid, values, np.inf), axis=1)]
+    highs = idx[np.arange(buckets), np.argmax(np.where(valid, values, -np.inf), axis=1)]
+    return np.unique(np.concatenate(([0, n - 1], lows, highs)))
+
+
+def downsample(x, y, n_out, method='lttb'):
+    """
+    Reduces one series to at most n_out points with the given method.
+
+    NaN values are gaps, not readings: they are dropped before selection.
+    Returns (x, y) arrays of the selected points, in order.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown downsampling method: {method!r}")
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    present = ~np.isnan(y)
+    x, y = x[present], y[present]
+    if method == 'lttb':
+        keep = lttb_indices(x, y, n_out)
+    else:
+        keep = minmax_indices(y, n_out)
+    return x[keep], y[keep]
@@ -5,6 +5,7 @@ Generates complete job details, energy calculations, print history
 """
 
 import random
+import hashlib
 import json
 from datetime import datetime, timedelta
 import psycopg2
@@ -33,6 +34,10 @@ class DPPDataEnricher:
     }
     
     def __init__(self):
+        # Per-device memo of the current job's generated profile/dimensions:
+        # device_id -> {'job_key': (filename, job_start), 'profile': ..., 'dimensions': ...}
+        # An entry is replaced when the device starts a different job and
+        # evicted as soon as the device stops printing.
         self.last_jobs_cache = {}
     
     def get_printer_category(self, device_id):
@@ -44,43 +49,52 @@ class DPPDataEnricher:
         else:
             return 'Standard'
     
-    def get_gcode_profile(self, filename):
+    @staticmethod
+    def job_rng(device_id, filename, job_start=None):
+        """A random generator seeded from the job identity, so values are stable per job."""
+        identity = f"{device_id}|{filename}|{job_start or ''}"
+        seed = int.from_bytes(hashlib.sha256(identity.encode('utf-8')).digest()[:8], 'big')
+        return random.Random(seed)
+    
+    def get_gcode_profile(self, filename, rng=None):
         """Extract gcode profile from filename"""
         if not filename:
             return None
+        rng = rng or random
         
         filename_lower = filename.lower()
         for key in self.GCODE_PROFILES:
             if key in filename_lower:
                 profile = self.GCODE_PROFILES[key].copy()
                 # Add some randomness
-                profile['infill'] += random.randint(-5, 5)
+                profile['infill'] += rng.randint(-5, 5)
                 profile['infill'] = max(0, min(100, profile['infill']))
-                profile['layers'] += random.randint(-20, 20)
-                profile['time_est'] = int(profile['time_est'] * random.uniform(0.9, 1.2))
+                profile['layers'] += rng.randint(-20, 20)
+                profile['time_est'] = int(profile['time_est'] * rng.uniform(0.9, 1.2))
                 return profile
         
         # Default profile for unknown patterns
         return {
-            'infill': random.randint(15, 30),
-            'layers': random.randint(100, 300),
+            'infill': rng.randint(15, 30),
+            'layers': rng.randint(100, 300),
             'height': 0.2,
-            'time_est': random.randint(1200, 3600)
+            'time_est': rng.randint(1200, 3600)
         }
     
-    def calculate_dimensions(self, printer_category, filename):
+    def calculate_dimensions(self, printer_category, filename, rng=None):
         """Generate realistic object dimensions based on printer size"""
+        rng = rng or random
         if printer_category == 'Mini':
-            base_size = random.randint(30, 120)
+            base_size = rng.randint(30, 120)
         elif printer_category == 'Large':
-            base_size = random.randint(100, 280)
+            base_size = rng.randint(100, 280)
         else:
-            base_size = random.randint(50, 200)
+            base_size = rng.randint(50, 200)
         
         # Generate proportional dimensions
         x = base_size
-        y = int(base_size * random.uniform(0.7, 1.3))
-        z = int(base_size * random.uniform(0.3, 0.8))
+        y = int(base_size * rng.uniform(0.7, 1.3))
+        z = int(base_size * rng.uniform(0.3, 0.8))
         
         return {'x': x, 'y': y, 'z': z}
     
@@ -120,17 +134,42 @@ class DPPDataEnricher:
         
         return round(filament_g, 2)
     
-    def enrich_current_job(self, printer_data, device_id):
+    def get_job_memo(self, device_id, filename, job_start=None):
+        """
+        Returns the memoized profile and dimensions for a device's current job,
+        generating them once (seeded from the job identity) on first sight.
+        """
+        job_key = (filename, job_start)
+        memo = self.last_jobs_cache.get(device_id)
+        if memo is None or memo['job_key'] != job_key:
+            rng = self.job_rng(device_id, filename, job_start)
+            printer_category = self.get_printer_category(device_id)
+            memo = {
+                'job_key': job_key,
+                'printer_category': printer_category,
+                'profile': self.get_gcode_profile(filename, rng),
+                'dimensions': self.calculate_dimensions(printer_category, filename, rng)
+            }
+            self.last_jobs_cache[device_id] = memo
+        return memo
+    
+    def evict_job(self, device_id):
+        """Drops the memoized job for a device (called once it stops printing)."""
+        self.last_jobs_cache.pop(device_id, None)
+    
+    def enrich_current_job(self, printer_data, device_id, job_start=None):
         """Add complete current job details"""
         status = printer_data.get('currentStatus')
         progress = printer_data.get('jobProgressPercent', 0)
         filename = printer_data.get('jobFilename')
         
         if status not in ['Printing', 'Heating'] or not filename:
+            self.evict_job(device_id)
             return printer_data
         
-        printer_category = self.get_printer_category(device_id)
-        gcode_profile = self.get_gcode_profile(filename)
+        memo = self.get_job_memo(device_id, filename, job_start)
+        printer_category = memo['printer_category']
+        gcode_profile = memo['profile']
         
         if not gcode_profile:
             return printer_data
@@ -140,8 +179,8 @@ class DPPDataEnricher:
         elapsed_time = int(total_time * (progress / 100.0))
         time_left = total_time - elapsed_time
         
-        # Calculate dimensions
-        dimensions = self.calculate_dimensions(printer_category, filename)
+        # Dimensions are generated once per job
+        dimensions = memo['dimensions']
         
         # Calculate current energy
         energy = self.calculate_energy_for_job(printer_category, elapsed_time, progress)
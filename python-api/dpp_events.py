@@ -0,0 +1,234 @@
+# dpp_events.py
+# Live DPP card updates for GET /api/dpp/events (Server-Sent Events).
+#
+# Served by the asyncio tier (async_app.py): an open stream is a socket and a
+# suspended generator, not a server thread, so live pages cannot starve the
+# Flask routes. Each uvicorn worker runs one listener task holding a LISTEN
+# connection on the 'dpp_changes' channel (see
+# backend/db_init/07_dpp_notify.sql). After a burst of notifications it
+# rebuilds the printer cards once and queues the cards that differ from the
+# previous build for every connected page. A page that connects first
+# receives the whole fleet as a snapshot. However many pages are open, the
+# database sees one listener and one rebuild per change instead of one
+# /api/dpp_summary poll per page.
+#
+# Events:
+#   snapshot  {"printers": [card, ...]}                  on connect and resync
+#   delta     {"printers": [changed card, ...], "removed": [device_id, ...]}
+#   jobs      {"deviceIds": [...]}  print_jobs rows changed; the job history
+#             (not part of the stream) should be reloaded
+import asyncio
+import json
+import os
+import sys
+import time
+import traceback
+
+from starlette.concurrency import run_in_threadpool
+
+from dpp_simulator import QUERY_ALL_PRINTERS, build_printer_cards
+from json_responses import dumps
+
+CHANNEL = 'dpp_changes'
+# Notifications arriving within this window are handled by one rebuild
+DEBOUNCE_SECONDS = float(os.environ.get('DPP_EVENTS_DEBOUNCE_SECONDS', 1.0))
+# Rebuild at least this often while pages are connected, for the fields that
+# change with time alone (24h energy window) and databases without the triggers
+RESYNC_SECONDS = float(os.environ.get('DPP_EVENTS_RESYNC_SECONDS', 60))
+KEEPALIVE_SECONDS = 15
+# Open streams per uvicorn worker; pages over the limit keep polling
+MAX_SUBSCRIBERS = int(os.environ.get('DPP_EVENTS_MAX_CLIENTS', 500))
+# Events a slow page may fall behind by before it is sent a new snapshot
+MAX_PENDING_EVENTS = 32
+RECONNECT_SECONDS = 5
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+def format_event(name, data):
+    """One SSE message; the payload is serialized once and shared by all subscribers."""
+    return f"event: {name}\ndata: {dumps(data).decode('utf-8')}\n\n"
+
+
+class _Subscriber:
+    def __init__(self):
+        self.pending = []
+        self.needs_snapshot = True
+        self.wakeup = asyncio.Event()
+
+    def push(self, message):
+        if len(self.pending) >= MAX_PENDING_EVENTS:
+            # Too far behind to replay; start over from a snapshot
+            self.pending = []
+            self.needs_snapshot = True
+        else:
+            self.pending.append(message)
+        self.wakeup.set()
+
+    async def take(self, timeout):
+        """(needs a snapshot, queued messages), waiting up to `timeout` for either."""
+        if not self.pending and not self.needs_snapshot:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self.wakeup.clear()
+        messages, self.pending = self.pending, []
+        needs_snapshot, self.needs_snapshot = self.needs_snapshot, False
+        return needs_snapshot, messages
+
+
+class DppEventHub:
+    """
+    Shares one LISTEN connection and one card rebuild per change among all
+    open streams of a worker. `pool` is the worker's asyncpg pool; `connect`
+    opens the dedicated LISTEN connection, which is held outside the pool.
+    """
+
+    def __init__(self, pool, connect):
+        self._pool = pool
+        self._connect = connect
+        self._build_lock = asyncio.Lock()
+        self._subscribers = set()
+        self._cards = None  # {device_id: card} of the last build, None when stale
+        self._snapshot = None  # the last build as a formatted snapshot event
+        self._built_at = 0.0
+        self._listener = None
+        self._notified = asyncio.Event()
+        self._job_devices = set()
+
+    def open_stream(self):
+        """
+        Registers a subscriber and returns its SSE message generator;
+        TooManySubscribers when MAX_SUBSCRIBERS streams are already open.
+        """
+        if len(self._subscribers) >= MAX_SUBSCRIBERS:
+            raise TooManySubscribers()
+        subscriber = _Subscriber()
+        self._subscribers.add(subscriber)
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+        return self._stream(subscriber)
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+
+    async def _stream(self, subscriber):
+        try:
+            yield f"retry: {RECONNECT_SECONDS * 1000}\n\n"
+            while True:
+                needs_snapshot, messages = await subscriber.take(KEEPALIVE_SECONDS)
+                if needs_snapshot:
+                    # Deltas queued before the snapshot are already part of it
+                    messages = [await self._current_snapshot()]
+                yield ''.join(messages) if messages else ": keepalive\n\n"
+        finally:
+            # Runs when the client goes away and the response is cancelled
+            self._subscribers.discard(subscriber)
+
+    async def _current_snapshot(self):
+        async with self._build_lock:
+            if self._cards is None:
+                await self._rebuild_locked()
+            return self._snapshot or format_event('snapshot', {"printers": []})
+
+    async def _rebuild_locked(self, job_devices=()):
+        self._built_at = time.monotonic()
+        try:
+            async with self._pool.acquire() as conn:
+                rows = await conn.fetch(QUERY_ALL_PRINTERS)
+            # Enrichment and the thumbnail manifests touch the disk
+            printers = await run_in_threadpool(build_printer_cards, rows)
+        except Exception as e:
+            print(f"FATAL ERROR during DPP event rebuild: {e}", file=sys.stderr)
+            traceback.print_exc()
+            return
+        cards = {card["deviceId"]: card for card in printers}
+        previous = self._cards
+        self._cards = cards
+        self._snapshot = format_event('snapshot', {"printers": printers})
+        if previous is None:
+            return
+
+        messages = []
+        changed = [card for device_id, card in cards.items() if previous.get(device_id) != card]
+        removed = [device_id for device_id in previous if device_id not in cards]
+        if changed or removed:
+            messages.append(format_event('delta', {"printers": changed, "removed": removed}))
+        if job_devices:
+            messages.append(format_event('jobs', {"deviceIds": sorted(job_devices)}))
+        if messages:
+            message = ''.join(messages)
+            for subscriber in list(self._subscribers):
+                subscriber.push(message)
+
+    def _on_notify(self, conn, pid, channel, payload):
+        try:
+            payload = json.loads(payload)
+        except ValueError:
+            payload = {}
+        if payload.get('table') == 'print_jobs' and payload.get('device_id'):
+            self._job_devices.add(payload['device_id'])
+        self._notified.set()
+
+    async def _listen(self):
+        """Listener task: LISTEN, debounce notifications, rebuild; reconnects on errors."""
+        while True:
+            conn = None
+            try:
+                conn = await self._connect()
+                lost = asyncio.Event()
+                def on_lost(c):
+                    lost.set()
+                    self._notified.set()
+                conn.add_termination_listener(on_lost)
+                await conn.add_listener(CHANNEL, self._on_notify)
+                # The first rebuild after (re)connecting diffs against the
+                # last cards sent, so changes made while not listening still
+                # reach the pages as deltas
+                await self._listen_loop(lost)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"WARNING: DPP event listener failed: {e}. Reconnecting in {RECONNECT_SECONDS}s.", file=sys.stderr)
+                traceback.print_exc()
+            finally:
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            await asyncio.sleep(RECONNECT_SECONDS)
+
+    async def _wait_notified(self, timeout):
+        try:
+            await asyncio.wait_for(self._notified.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _listen_loop(self, lost):
+        while not lost.is_set():
+            watching = bool(self._subscribers)
+            timeout = max(0.0, self._built_at + RESYNC_SECONDS - time.monotonic()) if watching else RESYNC_SECONDS
+            if await self._wait_notified(timeout):
+                # Collect the whole burst before rebuilding
+                await asyncio.sleep(DEBOUNCE_SECONDS)
+                self._notified.clear()
+                job_devices, self._job_devices = self._job_devices, set()
+            elif not watching:
+                continue
+            else:
+                job_devices = ()
+
+            async with self._build_lock:
+                if self._subscribers:
+                    await self._rebuild_locked(job_devices)
+                else:
+                    # Nobody to tell; the next page to connect rebuilds
+                    self._cards = None
+        raise ConnectionError("LISTEN connection lost")
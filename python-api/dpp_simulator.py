@@ -15,11 +15,15 @@ import psycopg2
 import psycopg2.extras
 import numpy as np
 import re
+from urllib.parse import quote
 # No dependency on Node-RED specific objects (node, flow, etc.)
 from datetime import datetime, timedelta, timezone
 
 # Import the data enricher for sophisticated mock data
 from dpp_data_enricher import enricher
+from smart_tips_system import compile_tip_rules
+from thumbnails import thumbnail_variants
+from json_responses import dumps, fragment
 
 
 # --- Configuration ---
@@ -61,6 +65,20 @@ def get_plant_stage(kwh):
         if effective_kwh >= PLANT_THRESHOLDS[i]: return min(i + 2, 19)
     return 1
 
+PLANT_THRESHOLDS_ARRAY = np.asarray(PLANT_THRESHOLDS, dtype=float)
+
+def get_plant_stages(kwh_values):
+    """
+    Vectorized get_plant_stage() for a whole fleet.
+    searchsorted(side='right') counts the thresholds at or below each effective
+    kWh, which is exactly the index the reverse linear scan stops at, plus one.
+    """
+    kwh = np.asarray(kwh_values, dtype=float)
+    kwh = np.where(np.isfinite(kwh), kwh, 0.0)
+    effective_kwh = np.mod(kwh, PLANT_THRESHOLDS_ARRAY[-1])
+    reached = np.searchsorted(PLANT_THRESHOLDS_ARRAY, effective_kwh, side='right')
+    return np.minimum(reached + 1, 19)
+
 def clean_filename(filename):
     """
     Truncates long filenames to a more display-friendly length.
@@ -168,6 +186,11 @@ TIP_RULES = [
     }
 ]
 
+# The basic rules share the smart tips engine: pre-sorted by priority, first match wins.
+COMPILED_TIP_RULES = compile_tip_rules(
+    TIP_RULES, default_text="Monitor print settings for optimal energy and material use."
+)
+
 
 def parse_gcode_metadata(gcode_content):
     """
@@ -251,50 +274,30 @@ def evaluate_tips(printer_data):
         # Fallback to basic system if smart tips fail
         print(f"WARNING: Smart tips system failed: {e}. Falling back to basic tips.", file=sys.stderr)
         
-        applicable_tips = []
-        if printer_data is None:
-            printer_data = {}
-
-        for rule in TIP_RULES:
-            try:
-                if rule["conditions"](printer_data):
-                    format_data = printer_data.copy()
-                    format_data["job_details"] = printer_data.get("job_details", {})
-                    
-                    # Handle both string templates and callable templates
-                    if callable(rule["tip_template"]):
-                        tip_text = rule["tip_template"](printer_data)
-                    else:
-                        tip_text = rule["tip_template"].format(**format_data)
-                    
-                    applicable_tips.append({
-                        "priority": rule["priority"],
-                        "text": tip_text
-                    })
-            except Exception:
-                pass
-
-        if applicable_tips:
-            applicable_tips.sort(key=lambda x: x["priority"], reverse=True)
-            return applicable_tips[0]["text"]
-
-        return "Monitor print settings for optimal energy and material use."
+        return COMPILED_TIP_RULES.evaluate(printer_data)
 
 
-# --- Main Execution ---
-def get_live_dpp_data(page=1, limit=12, searchTerm=None):
+def evaluate_tips_batch(printers):
     """
-    Connects to the database, fetches all printer data, processes it,
-    and returns a dictionary containing the final printer list and global history.
+    Evaluates tips for the whole fleet in one pass (see evaluate_smart_tips_batch).
+    Falls back to per-printer evaluate_tips() if the batch path fails.
     """
-    final_dpp_data = []
-    global_history_list = []
-    conn = None
-    cur = None
+    try:
+        from smart_tips_system import evaluate_smart_tips_batch
+        return evaluate_smart_tips_batch(printers)
+    except Exception as e:
+        print(f"WARNING: Batch tip evaluation failed: {e}. Evaluating per printer.", file=sys.stderr)
+        return [evaluate_tips(p) for p in printers]
 
-    # This is the complete query for fetching all printer and job data.
-    # THIS QUERY REMAINS UNCHANGED.
-    query_all_printers = """
+
+# --- Main Execution ---
+# Card projection of every printer: the grid only needs a few keys of the
+# job documents, so the large JSONB values (per-part analyses, G-code
+# analysis) are projected in SQL and the history leaves them out. Only
+# one per-part analysis per printer is read (COALESCE stops at the
+# current job's). The full documents are served per device by
+# get_device_detail().
+QUERY_ALL_PRINTERS = """
     SELECT
         d.device_id, d.friendly_name, d.device_model, d.printer_size_category,
         d.gcode_preview_host, d.gcode_preview_api_key, d.bed_width, d.bed_depth,
@@ -318,9 +321,14 @@ def get_live_dpp_data(page=1, limit=12, searchTerm=None):
         ), 0) AS kwh_last_24h,
         
         -- GET DATA FOR THE CURRENT JOB (if printing)
+        pj.start_time AS current_job_start_time,
         pj.thumbnail_url AS current_job_thumbnail_url,
-        pj.per_part_analysis AS current_job_per_part_analysis,
-        pj.gcode_analysis_data,
+        jsonb_strip_nulls(jsonb_build_object(
+            'object_name', pj.gcode_analysis_data->'object_name',
+            'infill_density_percent', pj.gcode_analysis_data->'infill_density_percent',
+            'layer_height_mm', pj.gcode_analysis_data->'layer_height_mm',
+            'object_dimensions_mm', pj.gcode_analysis_data->'object_dimensions_mm'
+        )) AS card_job_details,
         pj.session_energy_wh,
         pj.start_energy_wh,
         ed.current_total_wh,
@@ -330,7 +338,21 @@ def get_live_dpp_data(page=1, limit=12, searchTerm=None):
         lj.duration_seconds AS last_job_duration_seconds,
         lj.filament_used_g AS last_job_filament_g,
         lj.thumbnail_url AS last_job_thumbnail_url,
-        lj.per_part_analysis AS last_job_per_part_analysis,
+
+        -- Per-part breakdown of the current job, else the last one: part
+        -- names and shares
+        (
+            SELECT jsonb_build_object(
+                'parts', (
+                    SELECT jsonb_agg(jsonb_build_object(
+                        'name', p->'name', 'energy_percentage', p->'energy_percentage'))
+                    FROM jsonb_array_elements(
+                        CASE WHEN jsonb_typeof(a->'parts') = 'array' THEN a->'parts' ELSE '[]' END) p
+                )
+            )
+            FROM (SELECT COALESCE(NULLIF(pj.per_part_analysis, 'null'), lj.per_part_analysis) AS a) analysis
+            WHERE jsonb_typeof(a) = 'object'
+        ) AS card_part_analysis,
         
         hist.history_data
     FROM devices d
@@ -339,7 +361,8 @@ def get_live_dpp_data(page=1, limit=12, searchTerm=None):
         WHERE device_id = d.device_id ORDER BY timestamp DESC LIMIT 1
     ) ps ON true
     LEFT JOIN LATERAL (
-        SELECT * FROM print_jobs
+        SELECT start_time, thumbnail_url, gcode_analysis_data, per_part_analysis, session_energy_wh, start_energy_wh
+        FROM print_jobs
         WHERE filename = ps.filename AND gcode_analysis_data IS NOT NULL
         ORDER BY start_time DESC NULLS LAST
         LIMIT 1
@@ -356,8 +379,15 @@ def get_live_dpp_data(page=1, limit=12, searchTerm=None):
         LIMIT 1
     ) lj ON true
     LEFT JOIN LATERAL (
-        SELECT json_agg(h) AS history_data FROM (
-            SELECT filename, (kwh_consumed * 1000) AS session_energy_wh, end_time, thumbnail_url, per_part_analysis
+        -- As JSON text, spliced into the response without a round trip
+        -- through Python objects (jsonb text is on one line, which the SSE
+        -- events need); filenames shortened like clean_filename()
+        SELECT jsonb_agg(h)::text AS history_data FROM (
+            SELECT
+                CASE WHEN length(filename) > 30
+                     THEN left(filename, 15) || '...' || right(filename, 15)
+                     ELSE filename END AS filename,
+                (kwh_consumed * 1000) AS session_energy_wh, end_time, thumbnail_url
             FROM print_jobs
             WHERE device_id = d.device_id AND status = 'completed' AND kwh_consumed IS NOT NULL
             ORDER BY end_time DESC NULLS LAST
@@ -368,140 +398,229 @@ def get_live_dpp_data(page=1, limit=12, searchTerm=None):
     ORDER BY d.friendly_name;
     """
 
-    # --- MODIFIED BLOCK STARTS HERE ---
-    # The old, static query_global_history string has been removed.
+# Global history page: total count and items, optionally filtered by a
+# search pattern on the printer name or filename (see global_history_params)
+GLOBAL_HISTORY_COUNT_SQL = """
+SELECT COUNT(*) FROM print_jobs pj
+JOIN devices d ON pj.device_id = d.device_id
+WHERE pj.status = 'completed'
+AND (%s::text IS NULL OR d.friendly_name ILIKE %s OR pj.filename ILIKE %s);
+"""
+
+GLOBAL_HISTORY_ITEMS_SQL = """
+SELECT
+    d.friendly_name, pj.filename, pj.kwh_consumed,
+    pj.end_time, pj.thumbnail_url, pj.dpp_pdf_url
+FROM print_jobs pj
+JOIN devices d ON pj.device_id = d.device_id
+WHERE
+    pj.status = 'completed'
+    AND (%s::text IS NULL OR d.friendly_name ILIKE %s OR pj.filename ILIKE %s)
+ORDER BY pj.end_time DESC NULLS LAST
+LIMIT %s OFFSET %s;
+"""
+
+# The documents left out of the cards, for one device
+DEVICE_DETAIL_SQL = """
+    SELECT
+        d.device_id,
+        pj.gcode_analysis_data,
+        COALESCE(NULLIF(pj.per_part_analysis, 'null'), lj.per_part_analysis) AS per_part_analysis,
+        hist.history_data
+    FROM devices d
+    LEFT JOIN LATERAL (
+        SELECT filename FROM printer_status
+        WHERE device_id = d.device_id ORDER BY timestamp DESC LIMIT 1
+    ) ps ON true
+    LEFT JOIN LATERAL (
+        SELECT gcode_analysis_data, per_part_analysis FROM print_jobs
+        WHERE filename = ps.filename AND gcode_analysis_data IS NOT NULL
+        ORDER BY start_time DESC NULLS LAST
+        LIMIT 1
+    ) pj ON (ps.filename IS NOT NULL)
+    LEFT JOIN LATERAL (
+        SELECT per_part_analysis FROM print_jobs
+        WHERE device_id = d.device_id AND status = 'completed' AND kwh_consumed IS NOT NULL
+        ORDER BY end_time DESC NULLS LAST
+        LIMIT 1
+    ) lj ON true
+    LEFT JOIN LATERAL (
+        SELECT json_agg(h) AS history_data FROM (
+            SELECT filename, (kwh_consumed * 1000) AS session_energy_wh, end_time, thumbnail_url, per_part_analysis
+            FROM print_jobs
+            WHERE device_id = d.device_id AND status = 'completed' AND kwh_consumed IS NOT NULL
+            ORDER BY end_time DESC NULLS LAST
+            LIMIT %s
+        ) h
+    ) hist ON true
+    WHERE d.device_id = %s;
+    """
+
+
+def connect_db():
+    """New connection to the ENMS database, configured from the POSTGRES_* variables."""
+    return psycopg2.connect(
+        dbname=os.environ.get('POSTGRES_DB', 'reg_ml_demo'),
+        user=os.environ.get('POSTGRES_USER', 'reg_ml_demo'),
+        password=os.environ.get('POSTGRES_PASSWORD', 'raptorblingx_demo'),
+        host=os.environ.get('POSTGRES_HOST', 'postgres'),
+        port=os.environ.get('POSTGRES_PORT', '5432')
+    )
+
+
+def global_history_params(page=1, limit=12, searchTerm=None):
+    """(count query parameters, items query parameters) of a global history page."""
+    search_pattern = f"%{searchTerm}%" if searchTerm else None
+    offset = (page - 1) * limit
+    count_params = (searchTerm, search_pattern, search_pattern)
+    return count_params, count_params + (limit, offset)
+
+
+def format_global_history(rows, page, limit, total_history_items):
+    """The globalHistory object of dpp_summary from GLOBAL_HISTORY_ITEMS_SQL rows."""
+    global_history_list = []
+    for row in rows:
+        global_history_list.append({
+            "printerName": row['friendly_name'],
+            "filename": clean_filename(row['filename']),
+            "kwh": float(row['kwh_consumed']) if row['kwh_consumed'] is not None else 0.0,
+            "completedAt": row['end_time'],
+            "thumbnailUrl": row['thumbnail_url'],
+            # 120px history icon; falls back to the full image for older jobs
+            "thumbnailIconUrl": thumbnail_variants(row['thumbnail_url']).get('icon') or row['thumbnail_url'],
+            "pdfUrl": row['dpp_pdf_url']
+        })
+
+    total_pages = (total_history_items + limit - 1) // limit if limit > 0 else 1
+    return {
+        "items": global_history_list,
+        "currentPage": page,
+        "totalPages": total_pages,
+        "totalItems": total_history_items
+    }
+
+
+def fetch_global_history(cur, page=1, limit=12, searchTerm=None):
+    """One page of completed jobs across all printers, optionally filtered by printer or filename."""
+    count_params, item_params = global_history_params(page, limit, searchTerm)
+    cur.execute(GLOBAL_HISTORY_COUNT_SQL, count_params)
+    total_history_items = cur.fetchone()[0]
+    cur.execute(GLOBAL_HISTORY_ITEMS_SQL, item_params)
+    return format_global_history(cur.fetchall(), page, limit, total_history_items)
+
+
+def build_printer_cards(all_printers):
+    """
+    The dpp_summary printer cards from QUERY_ALL_PRINTERS rows (psycopg2
+    DictRows or asyncpg Records), with plant stages and tips, sorted by name.
+    """
+    final_dpp_data = []
+    plant_energy = []
+
+    # THIS ENTIRE LOOP FOR PROCESSING PRINTERS REMAINS UNCHANGED.
+    for i, row in enumerate(all_printers):
+        try:
+            status_text = (row.get('state_text') or 'Offline').capitalize()
+            if status_text.lower() in ['operational', 'completed', 'ready']:
+                status_text = 'Idle'
+
+            is_printing = status_text.lower() in ['printing', 'heating']
+
+            device_output = {
+                "deviceId": row['device_id'],
+                "friendlyName": row.get('friendly_name', row['device_id']),
+                "model": row.get('device_model', 'Unknown Model'),
+                "sizeCategory": row.get('printer_size_category', 'Standard'),
+                "plant_type": PLANT_TYPES[i % len(PLANT_TYPES)],
+                "thumbnailUrl": row.get('current_job_thumbnail_url') or row.get('last_job_thumbnail_url'),
+                "thumbnailCardUrl": thumbnail_variants(
+                    row.get('current_job_thumbnail_url') or row.get('last_job_thumbnail_url')
+                ).get('card'),
+                "lastJobPerPartAnalysis": row.get('card_part_analysis'),
+                "kwhLast24h": float(row['kwh_last_24h'] or 0),
+                "lastJobKwh": float(row.get('last_completed_job_kwh') or 0) / 1000.0,
+                "printTimeSeconds": float(row.get('last_job_duration_seconds') or 0),
+                "lastJobFilamentGrams": float(row.get('last_job_filament_g') or 0),
+                "bedWidth": row.get('bed_width'),
+                "bedDepth": row.get('bed_depth'),
+                'currentStatus': status_text,
+                'isPrintingNow': is_printing,
+                'currentNozzleTemp': float(row.get('nozzle_temp_actual') or 0),
+                'targetNozzleTemp': float(row.get('nozzle_temp_target') or 0),
+                'currentBedTemp': float(row.get('bed_temp_actual') or 0),
+                'targetBedTemp': float(row.get('bed_temp_target') or 0),
+                'currentMaterial': row.get('material') or "Unknown",
+                'jobFilename': clean_filename(row.get('filename')) if is_printing else None,
+                'jobProgressPercent': float(row.get('progress_percent') or 0) if is_printing else 0,
+                'jobTimeLeftSeconds': float(row.get('time_left_seconds') or 0) if is_printing else 0,
+                'jobKwhConsumed': (
+                    (float(row['current_total_wh']) - float(row['start_energy_wh'])) / 1000.0
+                ) if is_printing and row.get('current_total_wh') is not None and row.get('start_energy_wh') is not None else 0.0,
+                "gcodePath": f"{row['gcode_preview_host']}/downloads/files/local/{row['filename']}" if row.get('filename') and row.get('gcode_preview_host') else None,
+                "gcode_preview_api_key": row.get('gcode_preview_api_key'),
+                "job_details": row.get('card_job_details') or {},
+                # Full analyses and history documents, fetched when a card is opened
+                "detailUrl": f"/api/dpp/devices/{quote(row['device_id'], safe='')}",
+                "detailed_analysis_data": {},
+                "history": fragment(row.get('history_data') or '[]')
+            }
+
+            # Enrich with sophisticated mock data for current job only
+            # Last job info and history come from DB and remain static
+            # Memoized per (device, filename, job start): stable values across polls
+            device_output = enricher.enrich_current_job(
+                device_output, row['device_id'], job_start=row.get('current_job_start_time')
+            )
+            device_output = enricher.enrich_last_job(device_output, row['device_id'], None)
+            # Keep history from SQL query - it's already from DB with real kwh values
+            # device_output['history'] stays as-is from line 462
+            
+            energy_for_plant = device_output['jobKwhConsumed'] if is_printing else device_output['kwhLast24h']
+            plant_energy.append(energy_for_plant)
+            final_dpp_data.append(device_output)
+
+        except Exception as e_loop:
+            device_id_for_error = row.get('device_id', 'Unknown Device')
+            print(f"WARNING: Skipping device '{device_id_for_error}' due to processing error: {e_loop}", file=sys.stderr)
+            continue
+
+    # Plant stages and tips are computed for the whole fleet at once.
+    if final_dpp_data:
+        plant_stages = get_plant_stages(plant_energy)
+        tips = evaluate_tips_batch(final_dpp_data)
+        for device_output, stage, tip_text in zip(final_dpp_data, plant_stages, tips):
+            device_output['plantStage'] = int(stage)
+            device_output['tipText'] = tip_text
+
+    final_dpp_data.sort(key=lambda x: x.get('friendlyName', x.get('deviceId', '')))
+    return final_dpp_data
+
+
+def get_live_dpp_data(page=1, limit=12, searchTerm=None, include_history=True):
+    """
+    Connects to the database, fetches all printer data, processes it,
+    and returns a dictionary containing the final printer list and global history.
+    With include_history=False only the printer list is fetched.
+    """
+    conn = None
+    cur = None
 
     try:
-        conn = psycopg2.connect(
-            dbname=os.environ.get('POSTGRES_DB', 'reg_ml_demo'),
-            user=os.environ.get('POSTGRES_USER', 'reg_ml_demo'),
-            password=os.environ.get('POSTGRES_PASSWORD', 'raptorblingx_demo'),
-            host=os.environ.get('POSTGRES_HOST', 'postgres'),
-            port=os.environ.get('POSTGRES_PORT', '5432')
-        )
+        conn = connect_db()
         cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
 
         # 1. Fetch main printer data (no change in this part's logic)
-        cur.execute(query_all_printers)
+        cur.execute(QUERY_ALL_PRINTERS)
         all_printers = cur.fetchall()
 
         # 2. Fetch global history with pagination and search
-        search_pattern = f"%{searchTerm}%" if searchTerm else None
-        offset = (page - 1) * limit
-
-        # New query to get the TOTAL count of items matching the search
-        query_global_history_count = """
-        SELECT COUNT(*) FROM print_jobs pj
-        JOIN devices d ON pj.device_id = d.device_id
-        WHERE pj.status = 'completed'
-        AND (%s IS NULL OR d.friendly_name ILIKE %s OR pj.filename ILIKE %s);
-        """
-        cur.execute(query_global_history_count, (searchTerm, search_pattern, search_pattern))
-        total_history_items = cur.fetchone()[0]
-        total_pages = (total_history_items + limit - 1) // limit if limit > 0 else 1
-
-        # New query to get the paginated ITEMS matching the search
-        query_global_history_items = """
-        SELECT
-            d.friendly_name, pj.filename, pj.kwh_consumed,
-            pj.end_time, pj.thumbnail_url, pj.dpp_pdf_url
-        FROM print_jobs pj
-        JOIN devices d ON pj.device_id = d.device_id
-        WHERE
-            pj.status = 'completed'
-            AND (%s IS NULL OR d.friendly_name ILIKE %s OR pj.filename ILIKE %s)
-        ORDER BY pj.end_time DESC NULLS LAST
-        LIMIT %s OFFSET %s;
-        """
-        cur.execute(query_global_history_items, (searchTerm, search_pattern, search_pattern, limit, offset))
-        history_results = cur.fetchall()
-
-        # The rest of the logic continues as before...
-        # --- MODIFIED BLOCK ENDS HERE ---
-
-        for row in history_results:
-            global_history_list.append({
-                "printerName": row['friendly_name'],
-                "filename": clean_filename(row['filename']),
-                "kwh": float(row['kwh_consumed']) if row['kwh_consumed'] is not None else 0.0,
-                "completedAt": row['end_time'].isoformat() if row['end_time'] else None,
-                "thumbnailUrl": row['thumbnail_url'],
-		        "pdfUrl": row['dpp_pdf_url']
-            })
-
-        # THIS ENTIRE LOOP FOR PROCESSING PRINTERS REMAINS UNCHANGED.
-        for i, row in enumerate(all_printers):
-            try:
-                status_text = (row.get('state_text') or 'Offline').capitalize()
-                if status_text.lower() in ['operational', 'completed', 'ready']:
-                    status_text = 'Idle'
-
-                is_printing = status_text.lower() in ['printing', 'heating']
-
-                device_output = {
-                    "deviceId": row['device_id'],
-                    "friendlyName": row.get('friendly_name', row['device_id']),
-                    "model": row.get('device_model', 'Unknown Model'),
-                    "sizeCategory": row.get('printer_size_category', 'Standard'),
-                    "plant_type": PLANT_TYPES[i % len(PLANT_TYPES)],
-                    "thumbnailUrl": row.get('current_job_thumbnail_url') or row.get('last_job_thumbnail_url'),
-                    "lastJobPerPartAnalysis": row.get('current_job_per_part_analysis') or row.get('last_job_per_part_analysis'),
-                    "kwhLast24h": float(row['kwh_last_24h'] or 0),
-                    "lastJobKwh": float(row.get('last_completed_job_kwh') or 0) / 1000.0,
-                    "printTimeSeconds": float(row.get('last_job_duration_seconds') or 0),
-                    "lastJobFilamentGrams": float(row.get('last_job_filament_g') or 0),
-                    "bedWidth": row.get('bed_width'),
-                    "bedDepth": row.get('bed_depth'),
-                    'currentStatus': status_text,
-                    'isPrintingNow': is_printing,
-                    'currentNozzleTemp': float(row.get('nozzle_temp_actual') or 0),
-                    'targetNozzleTemp': float(row.get('nozzle_temp_target') or 0),
-                    'currentBedTemp': float(row.get('bed_temp_actual') or 0),
-                    'targetBedTemp': float(row.get('bed_temp_target') or 0),
-                    'currentMaterial': row.get('material') or "Unknown",
-                    'jobFilename': clean_filename(row.get('filename')) if is_printing else None,
-                    'jobProgressPercent': float(row.get('progress_percent') or 0) if is_printing else 0,
-                    'jobTimeLeftSeconds': float(row.get('time_left_seconds') or 0) if is_printing else 0,
-                    'jobKwhConsumed': (
-                        (float(row['current_total_wh']) - float(row['start_energy_wh'])) / 1000.0
-                    ) if is_printing and row.get('current_total_wh') is not None and row.get('start_energy_wh') is not None else 0.0,
-                    "gcodePath": f"{row['gcode_preview_host']}/downloads/files/local/{row['filename']}" if row.get('filename') and row.get('gcode_preview_host') else None,
-                    "gcode_preview_api_key": row.get('gcode_preview_api_key'),
-                    "job_details": row.get('gcode_analysis_data') if isinstance(row.get('gcode_analysis_data'), dict) else {},
-                    "detailed_analysis_data": {},
-                    "history": [dict(job, filename=clean_filename(job.get('filename'))) for job in (row.get('history_data') or []) if isinstance(job, dict)]
-                }
-
-                # Enrich with sophisticated mock data for current job only
-                # Last job info and history come from DB and remain static
-                device_output = enricher.enrich_current_job(device_output, row['device_id'])
-                device_output = enricher.enrich_last_job(device_output, row['device_id'], conn)
-                # Keep history from SQL query - it's already from DB with real kwh values
-                # device_output['history'] stays as-is from line 462
-                
-                energy_for_plant = device_output['jobKwhConsumed'] if is_printing else device_output['kwhLast24h']
-                device_output['plantStage'] = get_plant_stage(energy_for_plant)
-
-                device_output['tipText'] = evaluate_tips(device_output)
-                final_dpp_data.append(device_output)
-
-            except Exception as e_loop:
-                device_id_for_error = row.get('device_id', 'Unknown Device')
-                print(f"WARNING: Skipping device '{device_id_for_error}' due to processing error: {e_loop}", file=sys.stderr)
-                continue
-
-        final_dpp_data_sorted = sorted(final_dpp_data, key=lambda x: x.get('friendlyName', x.get('deviceId', '')))
+        global_history = fetch_global_history(cur, page, limit, searchTerm) if include_history else None
 
         # THIS RETURN STATEMENT IS MODIFIED TO INCLUDE PAGINATION DATA.
-        return {
-            "printers": final_dpp_data_sorted,
-            "globalHistory": {
-                "items": global_history_list,
-                "currentPage": page,
-                "totalPages": total_pages,
-                "totalItems": total_history_items
-            }
-        }
+        result = {"printers": build_printer_cards(all_printers)}
+        if include_history:
+            result["globalHistory"] = global_history
+        return result
 
     except Exception as e_main:
         print(f"FATAL ERROR during get_live_dpp_data: {e_main}", file=sys.stderr)
@@ -512,7 +631,34 @@ def get_live_dpp_data(page=1, limit=12, searchTerm=None):
         if cur: cur.close()
         if conn: conn.close()
 
-        
+
+def format_device_detail(row):
+    """The /api/dpp/devices/<id> response from a DEVICE_DETAIL_SQL row."""
+    return {
+        "deviceId": row['device_id'],
+        "jobAnalysis": row['gcode_analysis_data'] if isinstance(row['gcode_analysis_data'], dict) else {},
+        "lastJobPerPartAnalysis": row['per_part_analysis'],
+        "history": [dict(job, filename=clean_filename(job.get('filename'))) for job in (row['history_data'] or []) if isinstance(job, dict)]
+    }
+
+
+def get_device_detail(device_id, history_limit=5):
+    """
+    The heavy per-device documents left out of the dpp_summary cards: the
+    G-code analysis of the current job, the full per-part analysis of the
+    current (else last) job and the recent history with its analyses.
+    Returns None for an unknown device.
+    """
+    conn = connect_db()
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+            cur.execute(DEVICE_DETAIL_SQL, (history_limit, device_id))
+            row = cur.fetchone()
+    finally:
+        conn.close()
+    return format_device_detail(row) if row is not None else None
+
+
 # Keep a simple main function for direct testing of the script if ever needed
 def main():
     """
@@ -521,7 +667,7 @@ def main():
     """
     print("--- Running in test mode ---", file=sys.stderr)
     data = get_live_dpp_data()
-    print(json.dumps(data, indent=4)) # Pretty-print for readability
+    print(dumps(data, indent=True).decode('utf-8')) # Pretty-print for readability
 
 if __name__ == "__main__":
     main()
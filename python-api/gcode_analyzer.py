@@ -4,7 +4,11 @@
 import sys, argparse, json, base64, os, re
 from PIL import Image
 import struct
-import collections
+
+from gcode_motion import MotionSegments, parse_motion, parse_motion_file, summarize_parts, summarize_print
+from gcode_layers import check_job_key, job_key, write_layer_index
+from gcode_preview import write_preview
+from thumbnails import PREVIEWS_DIR, write_thumbnail_variants
 
 # --- SELF-CONTAINED QOI DECODER (from dev script) ---
 def decode_qoi(data):
@@ -58,9 +62,97 @@ def decode_qoi(data):
     img.putdata([p[:channels] for p in pixels])
     return img
 
+# --- HEAD/TAIL READER ---
+# PrusaSlicer writes the thumbnails at the top of the file and the
+# "; key = value" statistics and config block at the bottom, so both can be
+# read without touching the toolpath in between. The whole file is only read
+# when the expected markers are not in those regions.
+HEAD_BYTES = 512 * 1024
+TAIL_BYTES = 256 * 1024
+# A thumbnail cut off by HEAD_BYTES is followed up to this much of the file
+HEAD_MAX_BYTES = 8 * 1024 * 1024
+THUMBNAIL_BEGIN_RE = re.compile(r'thumbnail(?:_\w+)?\s+begin', re.I)
+THUMBNAIL_END_RE = re.compile(r'thumbnail(?:_\w+)?\s+end', re.I)
+# Footer keys whose presence shows the tail holds the slicer statistics
+METADATA_MARKER_KEYS = ("estimated printing time (normal mode)", "filament used [g]")
+
+
+def thumbnail_in_region(text):
+    """True when `text` holds at least one complete thumbnail block."""
+    begins = len(THUMBNAIL_BEGIN_RE.findall(text))
+    return bool(begins) and begins <= len(THUMBNAIL_END_RE.findall(text))
+
+
+def thumbnail_block_open(head):
+    """True when the bytes read so far end inside a thumbnail block."""
+    text = head.decode('utf-8', errors='ignore')
+    return len(THUMBNAIL_BEGIN_RE.findall(text)) > len(THUMBNAIL_END_RE.findall(text))
+
+
+def _decode(data):
+    # Same text the former open(..., 'r') read gave: undecodable bytes dropped, newlines normalized
+    return data.decode('utf-8', errors='ignore').replace('\r\n', '\n').replace('\r', '\n')
+
+
+class GcodeRegions:
+    """
+    The head and tail of a G-code file, read with two seeks.
+
+    `head` ends and `tail` starts on a line boundary. `complete` is True when
+    together they cover the whole file; `full_text()` reads the rest on demand.
+    """
+
+    def __init__(self, path, head_bytes=HEAD_BYTES, tail_bytes=TAIL_BYTES):
+        self.path = path
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            head = f.read(head_bytes)
+            # Keep reading while a thumbnail block is still open at the cut
+            while len(head) < min(size, HEAD_MAX_BYTES) and thumbnail_block_open(head):
+                head += f.read(head_bytes)
+
+            tail_start = max(size - tail_bytes, len(head))
+            f.seek(tail_start)
+            tail = f.read()
+        self._split(head, tail, tail_start == len(head))
+
+    @classmethod
+    def from_bytes(cls, head, tail, complete, path=None):
+        """
+        Regions captured elsewhere, e.g. while a file is streamed in. Without
+        a `path` to read from, full_text() of an incomplete capture is only
+        the head and tail.
+        """
+        regions = cls.__new__(cls)
+        regions.path = path
+        regions._split(head, tail, complete)
+        return regions
+
+    def _split(self, head, tail, complete):
+        self._full_text = None
+        self.complete = complete
+        if complete:
+            self.head, self.tail = _decode(head + tail), ''
+            self._full_text = self.head
+            return
+        # Drop the partial lines at the cuts
+        self.head = _decode(head[:head.rfind(b'\n') + 1])
+        self.tail = _decode(tail[tail.find(b'\n') + 1:])
+
+    def full_text(self):
+        if self._full_text is None:
+            if self.path is None:
+                return self.head + self.tail
+            with open(self.path, 'r', encoding='utf-8', errors='ignore') as f:
+                self._full_text = f.read()
+        return self._full_text
+
+
 # --- FINAL, INTELLIGENT, AND UNIVERSAL THUMBNAIL EXTRACTION (from dev script) ---
-def extract_thumbnail(content, out_dir, jobid):
+def extract_thumbnail(content, out_dir, key):
     B64_RE = re.compile(r'[^A-Za-z0-9+/=]')
+    # Named after the job key (job_key()), never the raw job id from HTTP
+    fn = f"{check_job_key(key)}.png"
 
     # Define regex for both formats
     qoi_pattern = re.compile(r'; thumbnail_QOI begin (\d+)x(\d+) \d+\n((?:; [A-Za-z0-9+/=]+\n)+); thumbnail_QOI end')
@@ -88,7 +180,6 @@ def extract_thumbnail(content, out_dir, jobid):
                 img = decode_qoi(qoi_data)
 
                 os.makedirs(out_dir, exist_ok=True)
-                fn = f"{jobid}.png"
                 fp = os.path.join(out_dir, fn)
                 img.save(fp, 'PNG')
 
@@ -115,7 +206,6 @@ def extract_thumbnail(content, out_dir, jobid):
             decoded_bytes = base64.b64decode(b64_clean, validate=True)
 
             os.makedirs(out_dir, exist_ok=True)
-            fn = f"{jobid}.png"
             fp = os.path.join(out_dir, fn)
             with open(fp, 'wb') as f:
                 f.write(decoded_bytes)
@@ -129,6 +219,15 @@ def extract_thumbnail(content, out_dir, jobid):
     sys.stderr.write("DEBUG: No thumbnails of any type found.\n")
     return None
 
+def extract_thumbnail_from_file(regions, out_dir, key):
+    """extract_thumbnail() on the head (or tail) of the file; full scan only when neither has a thumbnail."""
+    for region in (regions.head, regions.tail):
+        if thumbnail_in_region(region):
+            return extract_thumbnail(region, out_dir, key)
+    if not regions.complete:
+        sys.stderr.write("DEBUG: No thumbnail markers in the head or tail, scanning the full file...\n")
+    return extract_thumbnail(regions.full_text(), out_dir, key)
+
 # --- METADATA PARSING (from dev script) ---
 def parse_duration_to_seconds(duration_str):
     if not duration_str: return None
@@ -152,14 +251,34 @@ def parse_slicer_metadata(gcode_content):
     It then creates a clean 'parsed_data' object with both the specifically typed
     values for the database columns AND the extra metadata for the frontend's 'job_details'.
     """
+    return build_slicer_metadata(parse_metadata_lines(gcode_content))
+
+
+METADATA_LINE_RE = re.compile(r'^\s*;\s*([^=]+?)\s*=\s*(.*)')
+
+def parse_metadata_lines(text):
+    """All '; key = value' comment lines of `text`; later lines win, as in the footer."""
     raw_metadata = {}
-    pattern = re.compile(r'^\s*;\s*([^=]+?)\s*=\s*(.*)')
-    for line in gcode_content.split('\n'):
-        match = pattern.match(line)
+    for line in text.split('\n'):
+        match = METADATA_LINE_RE.match(line)
         if match:
             key = match.group(1).strip()
             raw_metadata[key] = match.group(2).strip()
-            
+    return raw_metadata
+
+
+def parse_slicer_metadata_from_file(regions):
+    """parse_slicer_metadata() from the head and tail; full scan only when the footer markers are missing."""
+    raw_metadata = parse_metadata_lines(regions.head)
+    raw_metadata.update(parse_metadata_lines(regions.tail))
+    if not regions.complete and not all(key in raw_metadata for key in METADATA_MARKER_KEYS):
+        sys.stderr.write("DEBUG: Slicer footer not found in the tail, scanning the full file...\n")
+        raw_metadata = parse_metadata_lines(regions.full_text())
+    return build_slicer_metadata(raw_metadata)
+
+
+def build_slicer_metadata(raw_metadata):
+    """Typed 'parsed_data' values from the raw footer key/value pairs."""
     # This dictionary will hold all the clean data we extract.
     processed_data = {}
 
@@ -203,42 +322,22 @@ def parse_slicer_metadata(gcode_content):
         processed_data["layer_height_mm"] = None
 
     return processed_data
-# --- PER-PART ANALYSIS (from original script, preserved) ---
-OBJECT_START_RE = re.compile(r'; printing object (.*?)')
-OBJECT_END_RE = re.compile(r'; stop printing object (.*?)')
-G1_COMMAND_RE = re.compile(r'^G1 .*?X([\d\.]+) .*?Y([\d\.]+) .*?Z([\d\.]+)')
-
-def analyze_per_part_volume(gcode_content):
+# --- PER-PART ANALYSIS ---
+# Bounding boxes come from the modal motion parser, so moves that omit
+# unchanged axes (most of them) are counted too.
+def analyze_per_part_volume(gcode_content, filament_diameter=None):
     """
     Analyzes G-code to find the bounding box and volume for each part,
     then calculates the percentage of total volume for each part.
+    Accepts the G-code as text, bytes, a file opened in binary mode, or the
+    MotionSegments already parsed from it.
     """
     try:
-        parts_data = collections.defaultdict(lambda: {'min_x': float('inf'), 'max_x': float('-inf'),
-                                                      'min_y': float('inf'), 'max_y': float('-inf'),
-                                                      'min_z': float('inf'), 'max_z': float('-inf')})
-        current_part = None
-        
-        for line in gcode_content.split('\n'):
-            start_match = OBJECT_START_RE.match(line)
-            if start_match:
-                current_part = start_match.group(1).strip()
-                continue
-
-            if current_part and OBJECT_END_RE.match(line):
-                current_part = None
-                continue
-
-            if current_part:
-                g1_match = G1_COMMAND_RE.match(line)
-                if g1_match:
-                    x, y, z = map(float, g1_match.groups())
-                    parts_data[current_part]['min_x'] = min(parts_data[current_part]['min_x'], x)
-                    parts_data[current_part]['max_x'] = max(parts_data[current_part]['max_x'], x)
-                    parts_data[current_part]['min_y'] = min(parts_data[current_part]['min_y'], y)
-                    parts_data[current_part]['max_y'] = max(parts_data[current_part]['max_y'], y)
-                    parts_data[current_part]['min_z'] = min(parts_data[current_part]['min_z'], z)
-                    parts_data[current_part]['max_z'] = max(parts_data[current_part]['max_z'], z)
+        if isinstance(gcode_content, MotionSegments):
+            segments = gcode_content
+        else:
+            segments = parse_motion(gcode_content)
+        parts_data = summarize_parts(segments, filament_diameter)
 
         if not parts_data:
             return None
@@ -250,7 +349,7 @@ def analyze_per_part_volume(gcode_content):
             depth = data['max_y'] - data['min_y']
             height = data['max_z'] - data['min_z']
             volume = width * depth * height if width > 0 and depth > 0 and height > 0 else 0
-            part_volumes.append({'name': name, 'volume': volume})
+            part_volumes.append({'name': name, 'volume': volume, 'data': data})
             total_volume += volume
             
         if total_volume == 0:
@@ -259,10 +358,24 @@ def analyze_per_part_volume(gcode_content):
         final_parts_list = []
         for part in part_volumes:
             percentage = round(part['volume'] / total_volume, 4)
-            final_parts_list.append({'name': part['name'], 'energy_percentage': percentage})
-
+            data = part['data']
+            final_parts_list.append({
+                'name': part['name'],
+                'energy_percentage': percentage,
+                'bounding_box': {key: round(data[key], 3) for key in
+                                 ('min_x', 'max_x', 'min_y', 'max_y', 'min_z', 'max_z')},
+                'filament_mm': round(data['filament_mm'], 2),
+                'filament_mm3': round(data['filament_mm3'], 2),
+                'layers': data['layers'],
+                'estimated_time_s': round(data['estimated_time_s'], 1)
+            })
+
+        totals = summarize_print(segments)
         return {
             "total_bounding_box_volume": total_volume,
+            "total_filament_mm": round(totals['filament_mm'], 2),
+            "estimated_time_s": round(totals['estimated_time_s'], 1),
+            "layers": totals['layers'],
             "parts": final_parts_list
         }
 
@@ -270,6 +383,93 @@ def analyze_per_part_volume(gcode_content):
         sys.stderr.write(f"DEBUG: Per-part analysis failed: {e}\n")
         return None
 
+# --- FULL ANALYSIS ---
+THUMBNAIL_DIR = PREVIEWS_DIR
+
+
+def write_thumbnail(regions, key):
+    """(thumbnail URL, variants) written from a file's head or tail; (None, None) when it has none."""
+    thumbnail_url = extract_thumbnail_from_file(regions, THUMBNAIL_DIR, key)
+    variants = None
+    if thumbnail_url:
+        # Card, history icon and print sizes under content-hashed names
+        try:
+            variants = write_thumbnail_variants(
+                os.path.join(THUMBNAIL_DIR, os.path.basename(thumbnail_url)), THUMBNAIL_DIR
+            )
+        except Exception as e:
+            sys.stderr.write(f"DEBUG: Thumbnail variants not written: {e}\n")
+    return thumbnail_url, variants
+
+
+def write_head_thumbnail(head, jobid):
+    """
+    write_thumbnail() from the first bytes of a file alone, for uploads still
+    arriving. None when the head holds no complete thumbnail block; the
+    thumbnail is then looked for once the whole file is in.
+    """
+    regions = GcodeRegions.from_bytes(head, b'', False)
+    if not thumbnail_in_region(regions.head):
+        return None
+    return write_thumbnail(regions, check_job_key(job_key(jobid)))
+
+
+def analyze_header(regions, jobid, thumbnail=None):
+    """
+    The steps that need only the head and tail of a file: the thumbnail with
+    its variants and the slicer metadata. Runs before the motion parse, so
+    time-to-thumbnail does not grow with the file. `thumbnail` is a
+    write_head_thumbnail() result already written while the file streamed in.
+    """
+    # Every file written below is named after the key, never the raw job id
+    key = check_job_key(job_key(jobid))
+    thumbnail_url, variants = thumbnail or write_thumbnail(regions, key)
+    return {
+        "thumbnail_url": thumbnail_url,
+        "thumbnail_variants": variants,
+        # The new Prusa-specific metadata parser
+        "parsed_data": parse_slicer_metadata_from_file(regions)
+    }
+
+
+def analyze_gcode(header, segments, jobid, source_path=None, move_source=False):
+    """
+    Completes an analyze_header() result with the steps that need the parsed
+    moves, and returns the analyzer output. With a source_path the G-code is
+    kept in the store next to its layer index; move_source moves it there
+    instead of copying (for spooled uploads).
+    """
+    out = dict(header, per_part_analysis=None, layer_index_url=None, preview_url=None)
+
+    # Every file written below is named after the key, never the raw job id
+    key = check_job_key(job_key(jobid))
+
+    # 3. Per-part analysis from the parsed moves
+    out['per_part_analysis'] = analyze_per_part_volume(
+        segments, (out['parsed_data'] or {}).get('filament_diameter')
+    )
+
+    # 4. Keep the file with its layer byte-offset index, so single layers
+    #    can be served later without rescanning it
+    if source_path:
+        try:
+            if write_layer_index(source_path, segments, key, move=move_source):
+                out['layer_index_url'] = f"/api/gcode/{key}/layers"
+        except Exception as e:
+            sys.stderr.write(f"DEBUG: Layer index not written: {e}\n")
+
+    # 5. Decimated toolpath preview; the content hash in the URL lets
+    #    browsers cache it for good
+    try:
+        preview_hash = write_preview(segments, key)
+        if preview_hash:
+            out['preview_url'] = f"/api/gcode/{key}/preview?v={preview_hash}"
+    except Exception as e:
+        sys.stderr.write(f"DEBUG: Toolpath preview not written: {e}\n")
+
+    return out
+
+
 # --- MAIN FUNCTION (MERGED) ---
 def main():
     pa = argparse.ArgumentParser()
@@ -277,28 +477,13 @@ def main():
     pa.add_argument('--jobid', required=True)
     args = pa.parse_args()
 
-    # Initialize the output dictionary
-    out = {
-        "thumbnail_url": None,
-        "parsed_data": None,
-        "per_part_analysis": None
-    }
-
     try:
-        with open(args.file, 'r', encoding='utf-8', errors='ignore') as f:
-            txt = f.read()
-        
-        # 1. Call the new, universal thumbnail function with the CORRECT path
-        out['thumbnail_url'] = extract_thumbnail(
-            txt, "/app/gcode_previews", args.jobid
-        )
-
-        # 2. Call the new Prusa-specific metadata parser
-        out['parsed_data'] = parse_slicer_metadata(txt)
-
-        # 3. Call the original per-part analysis function
-        out['per_part_analysis'] = analyze_per_part_volume(txt)
-
+        # Thumbnail and metadata come from the head and tail of the file
+        # only, and are written before the toolpath is touched
+        header = analyze_header(GcodeRegions(args.file), args.jobid)
+        # Per-part analysis walks every move, reading the file in chunks
+        segments = parse_motion_file(args.file)
+        out = analyze_gcode(header, segments, args.jobid, source_path=args.file)
     except Exception as e:
         sys.stderr.write(f"ERROR: An exception occurred in main: {e}\n")
         print(json.dumps({"error": str(e)}))
@@ -0,0 +1,112 @@
+# gcode_intake.py
+# Streaming G-code intake for POST /api/gcode/analyze.
+#
+# The upload is analyzed while it arrives: the motion parser reads the
+# request body chunk by chunk through a tap that keeps, on the side, what the
+# other steps need (the head with the thumbnails, the tail with the slicer
+# statistics). The thumbnail is written as soon as the head is in, while the
+# rest of the body is still being parsed. When the file is to be kept for layer slicing, the tap also
+# spools it to a temp file that is unique to the request and lives in the
+# store directory, so keeping it is a rename rather than a second copy.
+import os
+import sys
+import tempfile
+
+from gcode_analyzer import (
+    GcodeRegions, analyze_gcode, analyze_header, thumbnail_block_open, write_head_thumbnail,
+    HEAD_BYTES, HEAD_MAX_BYTES, TAIL_BYTES
+)
+from gcode_layers import GCODE_STORE_DIR, job_key
+from gcode_motion import parse_motion
+
+
+class _StreamTap:
+    """
+    Binary reader over an upload stream that records the head and tail of
+    the data read through it and optionally writes everything to `spool`.
+    `on_head` is called with the head once it is complete, mid-stream.
+    """
+
+    def __init__(self, stream, spool=None, on_head=None):
+        self._stream = stream
+        self._spool = spool
+        self._on_head = on_head
+        self.size = 0
+        self.head = bytearray()
+        self._head_limit = HEAD_BYTES
+        self._head_done = False
+        self._tail = bytearray()
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        self._take(data)
+        return data
+
+    def readline(self):
+        data = self._stream.readline()
+        self._take(data)
+        return data
+
+    def _take(self, data):
+        if not data:
+            return
+        self.size += len(data)
+        if self._spool is not None:
+            self._spool.write(data)
+        if not self._head_done:
+            self.head += data
+            # Same rule as GcodeRegions: extend the head while a thumbnail
+            # block is still open at the cut
+            while len(self.head) >= self._head_limit:
+                if self._head_limit < HEAD_MAX_BYTES and thumbnail_block_open(self.head[:self._head_limit]):
+                    self._head_limit += HEAD_BYTES
+                    continue
+                del self.head[self._head_limit:]
+                self._head_done = True
+                if self._on_head is not None:
+                    self._on_head(bytes(self.head))
+                break
+        self._tail += data
+        if len(self._tail) > 2 * TAIL_BYTES:
+            del self._tail[:-TAIL_BYTES]
+
+    def regions(self, path=None):
+        """GcodeRegions of everything read so far; `path` serves full_text() when given."""
+        complete = self.size - TAIL_BYTES <= len(self.head)
+        tail_length = self.size - len(self.head) if complete else TAIL_BYTES
+        tail = bytes(self._tail[len(self._tail) - tail_length:]) if tail_length else b''
+        return GcodeRegions.from_bytes(bytes(self.head), tail, complete, path=path)
+
+
+def analyze_stream(stream, jobid, store=True):
+    """
+    Analyzes G-code read from a binary stream and returns the analyzer output
+    (the same dict gcode_analyzer.py prints). With store=True the upload is
+    kept in the store with its layer index; otherwise nothing but the
+    thumbnail and preview touches the disk.
+    """
+    spool_path = None
+    spool = None
+    if store:
+        os.makedirs(GCODE_STORE_DIR, exist_ok=True)
+        # A leading dot keeps spool files apart from job keys
+        fd, spool_path = tempfile.mkstemp(dir=GCODE_STORE_DIR, prefix=f".{job_key(jobid)}.", suffix='.spool')
+        spool = os.fdopen(fd, 'wb')
+    try:
+        head_thumbnail = []
+        tap = _StreamTap(stream, spool, on_head=lambda head: head_thumbnail.append(write_head_thumbnail(head, jobid)))
+        try:
+            segments = parse_motion(tap)
+        finally:
+            if spool is not None:
+                spool.close()
+        sys.stderr.write(f"DEBUG: Streamed {tap.size} bytes of G-code for job {jobid}\n")
+        # The slicer statistics sit at the end of the file, so the metadata
+        # waits for the tail; files smaller than the head get their thumbnail here
+        header = analyze_header(tap.regions(spool_path), jobid,
+                                thumbnail=head_thumbnail[0] if head_thumbnail else None)
+        return analyze_gcode(header, segments, jobid, source_path=spool_path, move_source=True)
+    finally:
+        # Still there when the file had no layer index to keep it for
+        if spool_path and os.path.exists(spool_path):
+            os.remove(spool_path)
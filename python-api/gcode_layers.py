@@ -0,0 +1,189 @@
+# gcode_layers.py
+# Per-layer byte-offset index for analyzed G-code files.
+#
+# The analyzer keeps a copy of each job's G-code in the store directory with a
+# small JSON sidecar next to it: for every layer, its byte offset and length
+# in the file, its Z height and the filament extruded up to the end of it.
+# A single layer (or a run of layers) can then be served with one seek and
+# one read instead of downloading or rescanning the whole file.
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import uuid
+
+import numpy as np
+
+GCODE_STORE_DIR = os.environ.get('GCODE_STORE_DIR', '/app/gcode_store')
+INDEX_VERSION = 1
+# Upper bound on the bytes served by one slice request
+MAX_SLICE_BYTES = int(os.environ.get('GCODE_MAX_SLICE_BYTES', 16 * 1024 * 1024))
+
+_JOB_KEY_UNSAFE_RE = re.compile(r'[^A-Za-z0-9._-]+')
+_JOB_KEY_RE = re.compile(r'^[A-Za-z0-9_-][A-Za-z0-9._-]*$')
+# Readable part of a key; the hash suffix keeps long ids apart
+JOB_KEY_PREFIX_LENGTH = 80
+JOB_KEY_HASH_LENGTH = 12
+
+
+def job_key(jobid):
+    """
+    File-system safe key for a job id (PrusaLink ids embed the filename):
+    the sanitized id plus a hash of the raw one, so ids that sanitize alike
+    ("Job 1", "Job_1", ".Job_1") never share files.
+    """
+    raw = str(jobid)
+    prefix = _JOB_KEY_UNSAFE_RE.sub('_', raw).lstrip('.')[:JOB_KEY_PREFIX_LENGTH] or '_'
+    return f"{prefix}-{hashlib.sha1(raw.encode('utf-8')).hexdigest()[:JOB_KEY_HASH_LENGTH]}"
+
+
+def check_job_key(key):
+    """Returns key; ValueError for keys that could escape the directory of a file named after them."""
+    if not _JOB_KEY_RE.match(key or ''):
+        raise ValueError(f"Invalid job key: {key!r}")
+    return key
+
+
+def store_path(key, suffix, store_dir=None):
+    """Path of a job's file in the store; ValueError for keys that could escape it."""
+    return os.path.join(store_dir or GCODE_STORE_DIR, f"{check_job_key(key)}{suffix}")
+
+
+def store_paths(key, store_dir=None):
+    """(gcode path, index path) of a job key."""
+    return store_path(key, '.gcode', store_dir), store_path(key, '.layers.json', store_dir)
+
+
+def _store_lock(key, store_dir, mode):
+    """
+    The job's lock file, held with `mode` (fcntl.LOCK_SH / LOCK_EX) until
+    closed. Writers create it; for readers a missing lock file means the job
+    was never stored (FileNotFoundError).
+    """
+    lock = open(store_path(key, '.lock', store_dir), 'a' if mode == fcntl.LOCK_EX else 'r')
+    fcntl.flock(lock, mode)
+    return lock
+
+
+def build_layer_index(segments):
+    """
+    Columnar layer index from parsed MotionSegments, or None when the file has
+    no layer-change markers (there is then no byte boundary to cut at).
+
+    Layer n spans from its marker line to the next marker; the last layer runs
+    to the end of the file. z is the highest Z of the layer's extruding moves
+    (None for layers that extrude nothing) and extrusion_mm the filament fed
+    by extruding moves up to and including the layer.
+    """
+    offsets = segments.layer_offsets
+    n_layers = len(offsets)
+    if not n_layers:
+        return None
+    lengths = np.diff(np.append(offsets, segments.source_bytes))
+
+    # Segments are in file order and marker layers only ever increase, so
+    # each layer's moves are one contiguous run
+    bounds = np.searchsorted(segments.layer, np.arange(n_layers + 1), side='left')
+    starts, stops = bounds[:-1], bounds[1:]
+    has_moves = stops > starts
+    extruding = segments.is_extruding
+
+    z = np.full(n_layers, np.nan)
+    extruded = np.zeros(n_layers)
+    if has_moves.any():
+        z_extruding = np.where(extruding, segments.end[:, 2], -np.inf)
+        fed = np.where(extruding, segments.extrusion, 0.0).astype(np.float64)
+        first = starts[has_moves]
+        z[has_moves] = np.maximum.reduceat(z_extruding, first)
+        extruded[has_moves] = np.add.reduceat(fed, first)
+    z[~np.isfinite(z)] = np.nan
+
+    return {
+        'version': INDEX_VERSION,
+        'file_size': int(segments.source_bytes),
+        'layer_count': n_layers,
+        'layers': {
+            'offset': offsets.tolist(),
+            'length': lengths.tolist(),
+            'z': [None if np.isnan(v) else round(float(v), 3) for v in z],
+            'extrusion_mm': np.round(np.cumsum(extruded), 2).tolist(),
+        },
+    }
+
+
+def write_layer_index(source_path, segments, key, store_dir=None, move=False):
+    """
+    Copies the G-code into the store (or moves it, for a file already spooled
+    inside the store directory) and writes its layer index next to it.
+    Returns the index, or None when the file has no layer markers.
+
+    Both files are written under names private to this call and renamed
+    under the job's lock, so concurrent analyses of the same job never leave
+    a G-code file paired with another run's index.
+    """
+    index = build_layer_index(segments)
+    if index is None:
+        return None
+    gcode_path, index_path = store_paths(key, store_dir)
+    os.makedirs(os.path.dirname(gcode_path), exist_ok=True)
+    suffix = f".{uuid.uuid4().hex[:8]}.tmp"
+
+    if move:
+        staged_gcode = source_path
+    else:
+        staged_gcode = gcode_path + suffix
+        shutil.copyfile(source_path, staged_gcode)
+    with open(index_path + suffix, 'w') as f:
+        json.dump(index, f, separators=(',', ':'))
+    with _store_lock(key, store_dir, fcntl.LOCK_EX):
+        os.replace(staged_gcode, gcode_path)
+        os.replace(index_path + suffix, index_path)
+    return index
+
+
+def content_hash(data):
+    """Short hash of bytes, used as the ETag of the layer endpoints."""
+    return hashlib.sha1(data).hexdigest()[:16]
+
+
+def read_layer_index(key, store_dir=None):
+    """(index, hash of the sidecar bytes) of a job key; FileNotFoundError when the job has none."""
+    _, index_path = store_paths(key, store_dir)
+    with open(index_path, 'rb') as f:
+        raw = f.read()
+    return json.loads(raw), content_hash(raw)
+
+
+def load_layer_index(key, store_dir=None):
+    """The stored index of a job key; FileNotFoundError when the job has none."""
+    return read_layer_index(key, store_dir)[0]
+
+
+def read_layers(key, first, count=1, store_dir=None):
+    """
+    Raw G-code bytes of layers first .. first + count - 1, read with a single
+    ranged read. Raises IndexError for layers outside the file and ValueError
+    when the slice would exceed MAX_SLICE_BYTES.
+    """
+    gcode_path, _ = store_paths(key, store_dir)
+    # The index and the file are opened together under the job's lock; an
+    # open file keeps its contents even if a new analysis replaces it
+    with _store_lock(key, store_dir, fcntl.LOCK_SH):
+        index = load_layer_index(key, store_dir)
+        f = open(gcode_path, 'rb')
+    with f:
+        layers = index['layers']
+        n_layers = len(layers['offset'])
+        if count < 1 or first < 0 or first + count > n_layers:
+            raise IndexError(f"Layers {first}..{first + count - 1} out of range (file has {n_layers})")
+
+        start = layers['offset'][first]
+        last = first + count - 1
+        length = layers['offset'][last] + layers['length'][last] - start
+        if length > MAX_SLICE_BYTES:
+            raise ValueError(f"Slice of {length} bytes exceeds the {MAX_SLICE_BYTES} byte limit")
+
+        f.seek(start)
+        return f.read(length)
@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# gcode_motion.py
+# Modal G-code motion parser. Turns a G-code file into compact NumPy arrays
+# with one row per move, tagged with the object and layer it belongs to,
+# tracking the modal X/Y/Z/E/F state, G90/G91 and M82/M83 modes, G92 resets,
+# G28 homing and G20/G21 units. Per-part statistics are plain vectorized
+# reductions over those arrays.
+#
+# There is no per-line Python loop: regex passes pull out the commands,
+# markers and parameter words in file order, and the modal state is rebuilt
+# with forward fills and cumulative sums between resets. The file is read in
+# chunks, with the state carried from one chunk to the next.
+import re
+import math
+
+import numpy as np
+
+# Every G/M command and every object or layer marker comment, in order, as
+# (command or marker, arguments or name)
+EVENT_RE = re.compile(
+    rb'^[ \t]*([GM]\d+|;LAYER_CHANGE|;LAYER:|; printing object |; stop printing object |;MESH:)([^;\r\n]*)',
+    re.M)
+LAYER_MARKERS = (b';LAYER_CHANGE', b';LAYER:')
+# The same layer markers with their line start, for the byte offset of each layer
+LAYER_LINE_RE = re.compile(rb'^[ \t]*(?:;LAYER_CHANGE|;LAYER:)', re.M)
+# Parameter words of the joined command arguments; the bare newline matches
+# count lines, so every word can be put back on the line it came from.
+WORD_RE = re.compile(rb'[XYZEFxyzef][-+]?[0-9.]+|\n')
+WORD_WIDTH = 24
+WORD_AXES = (b'X', b'Y', b'Z', b'E', b'F')
+WORD_LETTER_RE = re.compile(rb'[XYZ]')
+
+MOVE_COMMANDS = (b'G0', b'G1', b'G2', b'G3', b'G00', b'G01', b'G02', b'G03')
+DEFAULT_FEEDRATE = 1500.0  # mm/min until the first F word
+DEFAULT_FILAMENT_DIAMETER = 1.75
+NO_OBJECT = -1
+# Bytes parsed per pass; bounds the memory of the intermediate regex matches
+CHUNK_BYTES = 4 * 1024 * 1024
+
+
+class MotionSegments:
+    """
+    One row per move. Coordinates are absolute millimetres.
+
+    start, end: (n, 3) float32 XYZ
+    extrusion:  (n,) float32 filament fed during the move (mm, negative = retract)
+    feedrate:   (n,) float32 mm/min
+    object:     (n,) int16 index into `objects`, NO_OBJECT outside any object
+    layer:      (n,) int32 layer number, -1 before the first layer
+
+    layer_offsets holds the byte offset of each layer marker line (empty when
+    the file has none), source_bytes the size of the parsed input.
+    """
+
+    def __init__(self, start, end, extrusion, feedrate, obj, layer, objects,
+                 layer_offsets=None, source_bytes=0):
+        self.start = start
+        self.end = end
+        self.extrusion = extrusion
+        self.feedrate = feedrate
+        self.object = obj
+        self.layer = layer
+        self.objects = objects
+        self.layer_offsets = np.empty(0, dtype=np.int64) if layer_offsets is None else layer_offsets
+        self.source_bytes = source_bytes
+
+    def __len__(self):
+        return len(self.extrusion)
+
+    @property
+    def length(self):
+        """Straight-line XYZ length of each move."""
+        return np.linalg.norm(self.end - self.start, axis=1)
+
+    @property
+    def is_extruding(self):
+        """Moves that lay down material: positive extrusion while travelling in XY."""
+        xy = self.end[:, :2] - self.start[:, :2]
+        return (self.extrusion > 0) & np.any(xy != 0, axis=1)
+
+    @property
+    def duration(self):
+        """Estimated seconds per move at the commanded feedrate (no acceleration)."""
+        distance = np.maximum(self.length, np.abs(self.extrusion))
+        return distance / (np.maximum(self.feedrate, 1e-3) / 60.0)
+
+
+def _to_float(values):
+    """Float array from byte strings; malformed numbers (e.g. "1.2.3") become NaN."""
+    try:
+        return values.astype(np.float64)
+    except ValueError:
+        out = np.full(len(values), np.nan)
+        for i, value in enumerate(values):
+            try:
+                out[i] = float(value)
+            except ValueError:
+                pass
+        return out
+
+
+def _word_values(joined, count):
+    """
+    {axis: values} for the X/Y/Z/E/F words of `count` newline-joined argument
+    lines, NaN where a line has no such word (the last one wins on repeats).
+    """
+    table = {axis: np.full(count, np.nan) for axis in WORD_AXES}
+    words = np.array(WORD_RE.findall(joined), dtype=f'S{WORD_WIDTH}')
+    if not words.size:
+        return table
+    # First byte is the letter (or the newline); blanking it leaves the number
+    raw = words.view(np.uint8).reshape(-1, WORD_WIDTH)
+    letters = raw[:, 0] & 0xDF  # ASCII upper case
+    line = np.cumsum(raw[:, 0] == ord('\n'))
+    is_word = raw[:, 0] != ord('\n')
+    raw[:, 0] = ord(' ')
+    values = _to_float(words[is_word])
+    letters = letters[is_word]
+    line = line[is_word]
+    for axis in WORD_AXES:
+        mask = letters == axis[0]
+        table[axis][line[mask]] = values[mask]
+    return table
+
+
+def _forward_fill(values, is_set, initial):
+    """values at the most recent is_set position (inclusive), initial before the first."""
+    idx = np.where(is_set, np.arange(len(values)), -1)
+    np.maximum.accumulate(idx, out=idx)
+    return np.where(idx >= 0, values[np.maximum(idx, 0)], initial)
+
+
+def _modal_position(value, reset, increment, initial):
+    """
+    Position after each event: the latest reset value plus the increments since.
+    value/reset: absolute assignments (absolute moves, G92, G28); increment:
+    relative moves (0 elsewhere). Before the first reset the position starts
+    at `initial`.
+    """
+    total = np.cumsum(increment)
+    idx = np.where(reset, np.arange(len(value)), -1)
+    np.maximum.accumulate(idx, out=idx)
+    safe = np.maximum(idx, 0)
+    base = np.where(idx >= 0, value[safe] - total[safe], initial)
+    return base + total
+
+
+class _ModalState:
+    """Machine and file state carried from one chunk to the next."""
+
+    def __init__(self):
+        self.position = np.zeros(3)
+        self.e_position = 0.0
+        self.feedrate = DEFAULT_FEEDRATE
+        self.abs_xyz = True
+        self.abs_e = True
+        self.scale = 1.0
+        self.layer = -1
+        self.saw_layer_marker = False
+        self.layer_offsets = []
+        self.bytes_read = 0
+        self.object = NO_OBJECT
+        self.objects = []
+        self.object_ids = {}
+        # M486 labels are followed until the first object comment appears
+        self.saw_object_comment = False
+        self.m486_names = {}
+        self.m486_label = -1
+
+    def object_index(self, name):
+        if name not in self.object_ids:
+            self.object_ids[name] = len(self.objects)
+            self.objects.append(name)
+        return self.object_ids[name]
+
+
+def _object_tags(state, commands, args, markers):
+    """
+    Object index per event from object comments (PrusaSlicer, Cura) or M486
+    labels. Only marker and M486 events are visited here; they are few.
+    """
+    set_at = []
+    set_to = []
+    candidates = np.flatnonzero(((markers != b'') & ~np.isin(markers, LAYER_MARKERS))
+                                | (commands == b'M486'))
+    for i in candidates:
+        marker = markers[i]
+        if marker:
+            state.saw_object_comment = True
+            name = args[i].strip().decode('utf-8', errors='ignore')
+            if marker == b'; printing object ' or (marker == b';MESH:' and name != 'NONMESH'):
+                state.object = state.object_index(name)
+            else:
+                state.object = NO_OBJECT
+        elif not state.saw_object_comment:
+            # Firmware object labels: "M486 S<id>" starts object <id> (S-1
+            # ends it) and "M486 A<name>" names the current one.
+            arg = args[i].strip()
+            if arg[:1].upper() == b'S':
+                try:
+                    state.m486_label = int(float(arg[1:].split()[0]))
+                except (ValueError, IndexError):
+                    continue
+                label = state.m486_label
+                state.object = NO_OBJECT if label < 0 else state.object_index(
+                    state.m486_names.get(label, f"object {label}"))
+            elif arg[:1].upper() == b'A' and state.m486_label >= 0:
+                state.m486_names[state.m486_label] = arg[1:].strip().strip(b'"').decode('utf-8', errors='ignore')
+                continue
+            else:
+                continue
+        else:
+            continue
+        set_at.append(i)
+        set_to.append(state.object)
+
+    n = len(commands)
+    values = np.full(n, NO_OBJECT, dtype=np.int64)
+    is_set = np.zeros(n, dtype=bool)
+    values[set_at] = set_to
+    is_set[set_at] = True
+    return values, is_set
+
+
+def _parse_chunk(chunk, state):
+    """Moves of one chunk of whole lines as a tuple of arrays; updates `state`."""
+    events = EVENT_RE.findall(chunk)
+    if not events:
+        return None
+    tokens, args = (np.array(column, dtype=object) for column in zip(*events))
+    del events
+    tokens = tokens.astype('S24')
+    is_marker = tokens.view(np.uint8).reshape(-1, 24)[:, 0] == ord(';')
+    commands = np.where(is_marker, b'', tokens)
+    markers = np.where(is_marker, tokens, b'')
+
+    is_move = np.isin(commands, MOVE_COMMANDS)
+    is_g92 = commands == b'G92'
+    is_g28 = commands == b'G28'
+
+    # --- Modal modes, forward-filled from their switching commands ---
+    abs_xyz = _forward_fill(commands == b'G90', np.isin(commands, (b'G90', b'G91')), state.abs_xyz)
+    abs_e = _forward_fill(commands == b'M82', np.isin(commands, (b'M82', b'M83')), state.abs_e)
+    scale = _forward_fill(np.where(commands == b'G20', 25.4, 1.0),
+                          np.isin(commands, (b'G20', b'G21')), state.scale)
+
+    # --- Objects and layers, per event ---
+    initial_object = state.object
+    object_values, object_set = _object_tags(state, commands, args, markers)
+    tags = _forward_fill(object_values, object_set, initial_object)
+    layer_marker = np.isin(markers, LAYER_MARKERS)
+    layer = state.layer + np.cumsum(layer_marker)
+
+    # --- Words of the position events (moves, G92, G28), in file order ---
+    rows = np.flatnonzero(is_move | is_g92 | is_g28)
+    joined = b'\n'.join(args[rows].tolist())
+    words = _word_values(joined, len(rows))
+    row_scale = scale[rows]
+    row_move = is_move[rows]
+    row_g92 = is_g92[rows]
+    row_g28 = is_g28[rows]
+    row_abs_xyz = abs_xyz[rows]
+    row_abs_e = abs_e[rows]
+
+    # A bare G92 zeroes every axis; G28 homes the named axes (all when none are named)
+    bare_g92 = row_g92 & np.all([np.isnan(words[a]) for a in (b'X', b'Y', b'Z', b'E')], axis=0)
+    homed = {axis: np.zeros(len(rows), dtype=bool) for axis in (b'X', b'Y', b'Z')}
+    for i in np.flatnonzero(row_g28):
+        named = set(WORD_LETTER_RE.findall(args[rows[i]].upper()))
+        for axis in homed:
+            homed[axis][i] = not named or axis in named
+
+    positions = []
+    for axis_index, axis in enumerate((b'X', b'Y', b'Z')):
+        value = words[axis] * row_scale
+        present = ~np.isnan(value)
+        value = np.where(row_g28 | bare_g92, 0.0, value)
+        reset = (present & (row_g92 | (row_move & row_abs_xyz))) | homed[axis] | bare_g92
+        increment = np.where(present & row_move & ~row_abs_xyz, value, 0.0)
+        positions.append(_modal_position(np.nan_to_num(value), reset, increment,
+                                         state.position[axis_index]))
+    position = np.stack(positions, axis=1) if len(rows) else np.empty((0, 3))
+
+    e_value = words[b'E'] * row_scale
+    e_present = ~np.isnan(e_value)
+    e_value = np.where(bare_g92, 0.0, e_value)
+    e_reset = (e_present & (row_g92 | (row_move & row_abs_e))) | bare_g92
+    e_increment = np.where(e_present & row_move & ~row_abs_e, e_value, 0.0)
+    e_position = _modal_position(np.nan_to_num(e_value), e_reset, e_increment, state.e_position)
+
+    f_value = words[b'F'] * row_scale
+    feedrate = _forward_fill(f_value, row_move & ~np.isnan(f_value), state.feedrate)
+
+    # --- Moves: rows that change the position or feed filament ---
+    previous = np.vstack([state.position[None, :], position[:-1]])
+    de = np.diff(e_position, prepend=state.e_position)
+    emitted = row_move & (np.any(position != previous, axis=1) | (de != 0))
+    move_events = rows[emitted]
+
+    # --- Carry the state into the next chunk ---
+    if len(rows):
+        state.position = position[-1]
+        state.e_position = float(e_position[-1])
+        state.feedrate = float(feedrate[-1])
+    state.abs_xyz = bool(abs_xyz[-1])
+    state.abs_e = bool(abs_e[-1])
+    state.scale = float(scale[-1])
+    state.layer = int(layer[-1])
+    state.saw_layer_marker = state.saw_layer_marker or bool(layer_marker.any())
+
+    return (previous[emitted].astype(np.float32), position[emitted].astype(np.float32),
+            de[emitted].astype(np.float32), feedrate[emitted].astype(np.float32),
+            tags[move_events].astype(np.int16), layer[move_events].astype(np.int32))
+
+
+def _iter_chunks(source, chunk_bytes):
+    """Yields pieces of bytes or a binary file object, each ending on a line boundary."""
+    if isinstance(source, bytes):
+        start = 0
+        while start < len(source):
+            end = source.find(b'\n', start + chunk_bytes)
+            end = len(source) if end < 0 else end + 1
+            yield source[start:end]
+            start = end
+        return
+    while True:
+        chunk = source.read(chunk_bytes)
+        if not chunk:
+            return
+        yield chunk + source.readline()
+
+
+def parse_motion(gcode, chunk_bytes=CHUNK_BYTES):
+    """
+    Parses G-code (str, bytes or a binary file object) into MotionSegments.
+
+    The input is processed chunk_bytes at a time, so memory follows the
+    number of moves, not the size of the intermediate parse. Arcs (G2/G3) are
+    recorded as their chord. Layers follow the slicer's layer-change
+    comments; files without them get layers from the distinct Z heights of
+    extruding moves.
+    """
+    if isinstance(gcode, str):
+        gcode = gcode.encode('utf-8', errors='ignore')
+    state = _ModalState()
+    parts = []
+    for chunk in _iter_chunks(gcode, chunk_bytes):
+        state.layer_offsets.extend(state.bytes_read + match.start() for match in LAYER_LINE_RE.finditer(chunk))
+        state.bytes_read += len(chunk)
+        part = _parse_chunk(chunk, state)
+        if part is not None:
+            parts.append(part)
+    if not parts:
+        segments = _empty_segments()
+        segments.source_bytes = state.bytes_read
+        return segments
+    start, end, extrusion, feedrate, obj, layer = (np.concatenate(column) for column in zip(*parts))
+    segments = MotionSegments(start=start, end=end, extrusion=extrusion, feedrate=feedrate,
+                              obj=obj, layer=layer, objects=state.objects,
+                              layer_offsets=np.array(state.layer_offsets, dtype=np.int64),
+                              source_bytes=state.bytes_read)
+    if not state.saw_layer_marker and len(segments):
+        segments.layer = _layers_from_z(segments)
+    return segments
+
+
+def _empty_segments():
+    return MotionSegments(
+        start=np.empty((0, 3), dtype=np.float32), end=np.empty((0, 3), dtype=np.float32),
+        extrusion=np.empty(0, dtype=np.float32), feedrate=np.empty(0, dtype=np.float32),
+        obj=np.empty(0, dtype=np.int16), layer=np.empty(0, dtype=np.int32), objects=[])
+
+
+def _layers_from_z(segments):
+    """Layer numbers from the distinct Z heights of extruding moves."""
+    z = segments.end[:, 2]
+    extruding = segments.is_extruding
+    if not extruding.any():
+        return np.full(len(segments), -1, dtype=np.int32)
+    heights = np.unique(z[extruding])
+    return (np.searchsorted(heights, z, side='right') - 1).astype(np.int32)
+
+
+def parse_motion_file(path):
+    with open(path, 'rb') as f:
+        return parse_motion(f)
+
+
+def summarize_parts(segments, filament_diameter=None):
+    """
+    Per-object statistics from extruding moves, as {name: {...}}:
+    bounding box (min/max XYZ), extruded filament length and volume,
+    layer count and estimated print time of every move inside the object.
+    """
+    filament_diameter = filament_diameter or DEFAULT_FILAMENT_DIAMETER
+    filament_area = math.pi * (filament_diameter / 2.0) ** 2
+    n_objects = len(segments.objects)
+    if not n_objects or not len(segments):
+        return {}
+
+    inside = segments.object >= 0
+    extruding = segments.is_extruding & inside
+    obj = segments.object.astype(np.intp)
+
+    # Durations of every move inside an object, extruding or not
+    seconds = np.bincount(obj[inside], weights=segments.duration[inside], minlength=n_objects)
+    filament = np.bincount(obj[extruding], weights=segments.extrusion[extruding], minlength=n_objects)
+
+    # Bounding boxes over both endpoints of each extruding move: group the
+    # points by object with a stable sort, then one reduceat per bound
+    ids = obj[extruding]
+    mins = np.full((n_objects, 3), np.inf)
+    maxs = np.full((n_objects, 3), -np.inf)
+    layer_counts = np.zeros(n_objects, dtype=np.int64)
+    if ids.size:
+        order = np.argsort(ids, kind='stable')
+        sorted_ids = ids[order]
+        group_starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+        present = sorted_ids[group_starts]
+        for bounds in (segments.start[extruding][order], segments.end[extruding][order]):
+            mins[present] = np.minimum(mins[present], np.minimum.reduceat(bounds, group_starts))
+            maxs[present] = np.maximum(maxs[present], np.maximum.reduceat(bounds, group_starts))
+
+        # Distinct layers per object, marked on an object x layer grid
+        layers = segments.layer[extruding].astype(np.intp) + 1
+        grid = np.zeros((n_objects, int(layers.max()) + 1), dtype=bool)
+        grid[ids, layers] = True
+        layer_counts = grid.sum(axis=1)
+
+    parts = {}
+    for i, name in enumerate(segments.objects):
+        if not np.isfinite(mins[i]).all():
+            continue
+        parts[name] = {
+            'min_x': float(mins[i, 0]), 'max_x': float(maxs[i, 0]),
+            'min_y': float(mins[i, 1]), 'max_y': float(maxs[i, 1]),
+            'min_z': float(mins[i, 2]), 'max_z': float(maxs[i, 2]),
+            'filament_mm': float(filament[i]),
+            'filament_mm3': float(filament[i] * filament_area),
+            'layers': int(layer_counts[i]),
+            'estimated_time_s': float(seconds[i]),
+        }
+    return parts
+
+
+def summarize_print(segments):
+    """Whole-file totals: extruded filament (mm), estimated time (s), layer count."""
+    if not len(segments):
+        return {'filament_mm': 0.0, 'estimated_time_s': 0.0, 'layers': 0}
+    extruding = segments.is_extruding
+    return {
+        'filament_mm': float(segments.extrusion[extruding].sum(dtype=np.float64)),
+        'estimated_time_s': float(segments.duration.sum(dtype=np.float64)),
+        'layers': int(len(np.unique(segments.layer[extruding]))) if extruding.any() else 0,
+    }
@@ -0,0 +1,226 @@
+# gcode_preview.py
+# Decimated toolpath preview of an analyzed G-code file.
+#
+# The browser used to download and parse the whole G-code to draw a card
+# preview. Instead the analyzer writes a small binary file: the extruded
+# paths of (a subset of) the layers as polylines, simplified with
+# Douglas-Peucker and quantized to int16 XY deltas.
+#
+# Format (little-endian):
+#   header  '<4sHHfffIII': magic b'GTPV', version, reserved, quantum_mm,
+#           origin_x, origin_y, layer_count, polyline_count, point_count
+#   float32[layer_count]       Z of each layer
+#   uint32[layer_count + 1]    first polyline of each layer (+ end)
+#   uint32[polyline_count + 1] first point of each polyline (+ end)
+#   int16[point_count, 2]      XY steps in quanta; the first one is from
+#                              (origin_x, origin_y), each next one from the
+#                              point before it, across polyline boundaries
+# A reader restores the points with a cumulative sum, scales by quantum_mm
+# and adds the origin.
+import hashlib
+import os
+import struct
+import uuid
+
+import numpy as np
+
+from gcode_layers import store_path
+
+PREVIEW_MAGIC = b'GTPV'
+PREVIEW_VERSION = 1
+PREVIEW_HEADER = struct.Struct('<4sHHfffIII')
+PREVIEW_MIME_TYPE = 'application/octet-stream'
+# Simplification tolerance; a card canvas shows roughly a millimetre per pixel
+PREVIEW_TOLERANCE_MM = float(os.environ.get('GCODE_PREVIEW_TOLERANCE_MM', 0.25))
+# Layers kept in the preview, evenly spread over the print (the last one always)
+PREVIEW_MAX_LAYERS = int(os.environ.get('GCODE_PREVIEW_MAX_LAYERS', 120))
+PREVIEW_QUANTUM_MM = 0.02
+# Douglas-Peucker refinement rounds; intervals still open afterwards keep all points
+MAX_SIMPLIFY_ROUNDS = 64
+
+
+def _select_layers(layers, max_layers):
+    """At most max_layers of the given sorted layer numbers, evenly spaced, ending with the top one."""
+    if len(layers) <= max_layers:
+        return layers
+    picks = np.unique(np.round(np.linspace(len(layers) - 1, 0, max_layers)).astype(np.int64))
+    return layers[picks]
+
+
+def _polylines(segments, layers):
+    """
+    Extruded polylines of the given layers: (points (n, 2), layer of each
+    polyline, first point of each polyline), ordered by layer. A polyline is
+    a run of consecutive extruding moves within one layer; its points are the
+    start of the first move followed by the end of every move.
+    """
+    extruding = segments.is_extruding & np.isin(segments.layer, layers)
+    idx = np.flatnonzero(extruding)
+    if not idx.size:
+        return np.empty((0, 2)), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    layer = segments.layer[idx]
+    new_run = np.r_[True, (idx[1:] != idx[:-1] + 1) | (layer[1:] != layer[:-1])]
+    run_id = np.cumsum(new_run) - 1
+    run_first_move = np.flatnonzero(new_run)
+    n_runs = len(run_first_move)
+
+    points = np.empty((len(idx) + n_runs, 2), dtype=np.float64)
+    starts = run_first_move + np.arange(n_runs)
+    points[starts] = segments.start[idx[run_first_move], :2]
+    points[np.arange(len(idx)) + run_id + 1] = segments.end[idx, :2]
+    polyline_layer = layer[run_first_move]
+
+    # Layers derived from Z (no slicer markers) can revisit a layer, e.g.
+    # when objects are printed one after the other; group polylines by layer
+    if np.any(np.diff(polyline_layer) < 0):
+        order = np.argsort(polyline_layer, kind='stable')
+        lengths = np.diff(np.append(starts, len(points)))[order]
+        new_starts = np.cumsum(lengths) - lengths
+        points = points[np.repeat(starts[order] - new_starts, lengths) + np.arange(len(points))]
+        polyline_layer, starts = polyline_layer[order], new_starts
+    return points, polyline_layer, starts
+
+
+def simplify_polylines(points, starts, tolerance):
+    """
+    Douglas-Peucker over many polylines at once; returns a keep mask.
+
+    Instead of recursing per polyline, every round handles all open intervals
+    together: each unkept point measures its distance to the chord between
+    the kept points around it, and the farthest point of every interval over
+    the tolerance is kept. Intervals within the tolerance are settled and
+    drop out, so rounds get cheaper as the simplification converges.
+    """
+    n = len(points)
+    keep = np.zeros(n, dtype=bool)
+    if not n:
+        return keep
+    ends = np.append(starts[1:], n) - 1
+    keep[starts] = True
+    keep[ends] = True
+    positions = np.arange(n)
+    open_points = np.flatnonzero(~keep)
+
+    for _ in range(MAX_SIMPLIFY_ROUNDS):
+        if not open_points.size:
+            return keep
+        left = np.maximum.accumulate(np.where(keep, positions, 0))[open_points]
+        right = np.minimum.accumulate(np.where(keep, positions, n)[::-1])[::-1][open_points]
+
+        a = points[left]
+        chord = points[right] - a
+        offset = points[open_points] - a
+        chord_length = np.hypot(chord[:, 0], chord[:, 1])
+        cross = np.abs(chord[:, 0] * offset[:, 1] - chord[:, 1] * offset[:, 0])
+        distance = np.where(chord_length > 0, cross / np.maximum(chord_length, 1e-12),
+                            np.hypot(offset[:, 0], offset[:, 1]))
+
+        # Open points are sorted, so each interval is one contiguous group
+        group_starts = np.flatnonzero(np.r_[True, left[1:] != left[:-1]])
+        group_of = np.cumsum(np.r_[True, left[1:] != left[:-1]]) - 1
+        farthest = np.maximum.reduceat(distance, group_starts)
+        split = farthest > tolerance
+        is_peak = (distance == farthest[group_of]) & split[group_of]
+        # First peak of every splitting group
+        _, first_peak = np.unique(group_of[is_peak], return_index=True)
+        keep[open_points[np.flatnonzero(is_peak)[first_peak]]] = True
+
+        still_open = split[group_of]
+        still_open[np.flatnonzero(is_peak)[first_peak]] = False
+        open_points = open_points[still_open]
+
+    keep[open_points] = True
+    return keep
+
+
+def build_preview(segments, tolerance=None, max_layers=None):
+    """Binary preview (see the module comment) of parsed MotionSegments, or None when nothing is extruded."""
+    tolerance = PREVIEW_TOLERANCE_MM if tolerance is None else tolerance
+    max_layers = max_layers or PREVIEW_MAX_LAYERS
+    extruding = segments.is_extruding
+    layers = np.unique(segments.layer[extruding & (segments.layer >= 0)])
+    if not layers.size:
+        return None
+    layers = _select_layers(layers, max_layers)
+
+    points, polyline_layer, starts = _polylines(segments, layers)
+    keep = simplify_polylines(points, starts, tolerance)
+    # Polyline starts are always kept, so their new positions are a cumulative count
+    new_index = np.cumsum(keep) - 1
+    starts = new_index[starts]
+    points = points[keep]
+
+    # Quantize absolute positions first so the steps add up without drift;
+    # coarsen the grid if a step (usually a travel) would not fit in int16
+    origin = points.min(axis=0)
+    quantum = PREVIEW_QUANTUM_MM
+    while True:
+        grid = np.round((points - origin) / quantum).astype(np.int64)
+        steps = np.diff(grid, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+        if np.abs(steps).max() <= np.iinfo(np.int16).max:
+            break
+        quantum *= 2
+
+    # Highest extruding Z of every selected layer (each one extrudes something)
+    selected = extruding & np.isin(segments.layer, layers)
+    order = np.argsort(segments.layer[selected], kind='stable')
+    z = np.maximum.reduceat(segments.end[selected, 2][order],
+                            np.searchsorted(segments.layer[selected][order], layers))
+    layer_first = np.searchsorted(polyline_layer, layers, side='left')
+    header = PREVIEW_HEADER.pack(PREVIEW_MAGIC, PREVIEW_VERSION, 0, quantum,
+                                 float(origin[0]), float(origin[1]),
+                                 len(layers), len(starts), len(points))
+    return b''.join([
+        header,
+        z.astype('<f4').tobytes(),
+        np.append(layer_first, len(starts)).astype('<u4').tobytes(),
+        np.append(starts, len(points)).astype('<u4').tobytes(),
+        steps.astype('<i2').tobytes(),
+    ])
+
+
+def write_preview(segments, key, store_dir=None):
+    """Writes the job's preview into the store; returns its content hash, or None when there is no preview."""
+    data = build_preview(segments)
+    if data is None:
+        return None
+    path = store_path(key, '.preview.bin', store_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    staged = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(staged, 'wb') as f:
+        f.write(data)
+    os.replace(staged, path)
+    return preview_hash(data)
+
+
+def preview_hash(data):
+    """Short content hash used in preview URLs and as the ETag."""
+    return hashlib.sha1(data).hexdigest()[:16]
+
+
+def read_preview(key, store_dir=None):
+    """(bytes, content hash) of a stored preview; FileNotFoundError when the job has none."""
+    with open(store_path(key, '.preview.bin', store_dir), 'rb') as f:
+        data = f.read()
+    return data, preview_hash(data)
+
+
+def decode_preview(data):
+    """
+    Inverse of build_preview, for checks and server-side consumers:
+    {'z': (layers,), 'layer_first': ..., 'polyline_first': ..., 'points': (n, 2) mm}.
+    """
+    magic, version, _, quantum, origin_x, origin_y, n_layers, n_polylines, n_points = \
+        PREVIEW_HEADER.unpack_from(data)
+    if magic != PREVIEW_MAGIC or version != PREVIEW_VERSION:
+        raise ValueError("Not a toolpath preview")
+    offset = PREVIEW_HEADER.size
+    z = np.frombuffer(data, '<f4', n_layers, offset)
+    offset += 4 * n_layers
+    layer_first = np.frombuffer(data, '<u4', n_layers + 1, offset)
+    offset += 4 * (n_layers + 1)
+    polyline_first = np.frombuffer(data, '<u4', n_polylines + 1, offset)
+    offset += 4 * (n_polylines + 1)
+    steps = np.frombuffer(data, '<i2', 2 * n_points, offset).reshape(-1, 2)
+    points = np.cumsum(steps, axis=0, dtype=np.int64) * quantum + (origin_x, origin_y)
+    return {'z': z, 'layer_first': layer_first, 'polyline_first': polyline_first, 'points': points}
@@ -0,0 +1,43 @@
+# intake_app.py
+# Internal G-code intake service: POST /api/gcode/analyze.
+#
+# Runs as its own gunicorn instance (the gcode_intake service in
+# docker-compose.yml). It is not published and nginx has no route to it, so
+# only Node-RED on the compose network can submit files. Node-RED posts the
+# file it downloaded from the printer as the raw request body; it is
+# analyzed as it streams in, with per-request temp files only.
+#
+# Analyzing a large file takes tens of seconds and around a gigabyte of
+# memory, so every analysis runs in its own sync worker process and
+# GCODE_INTAKE_WORKERS (the --workers of the service) is the number of
+# analyses at once. Further uploads wait in the listen backlog until a worker
+# is free; the API process never runs one.
+import os
+import traceback
+
+from flask import Flask, jsonify, request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from gcode_intake import analyze_stream
+
+# Largest accepted upload in bytes; checked against Content-Length up front
+# and while reading chunked bodies
+MAX_UPLOAD_BYTES = int(os.environ.get('GCODE_MAX_UPLOAD_BYTES', 512 * 1024 * 1024))
+
+app = Flask(__name__)
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+
+
+@app.route('/api/gcode/analyze', methods=['POST'])
+def gcode_analyze():
+    jobid = request.args.get('jobid', '').strip()
+    if not jobid:
+        return jsonify({'error': 'jobid is required'}), 400
+    store = request.args.get('store', 'true').lower() not in ('0', 'false', 'no')
+    try:
+        return jsonify(analyze_stream(request.stream, jobid, store=store))
+    except RequestEntityTooLarge:
+        return jsonify({'error': f'G-code larger than {MAX_UPLOAD_BYTES} bytes'}), 413
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
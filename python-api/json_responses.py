@@ -0,0 +1,107 @@
+# json_responses.py
+# Serialization of the large JSON responses (dpp_summary, devices, admin users).
+#
+# Documents are encoded with orjson, which handles datetimes (ISO 8601),
+# numpy scalars and dict subclasses such as RealDictRow natively; Decimal
+# becomes a JSON number. Sub-documents that are already JSON, like the
+# per-device job history Postgres aggregates for the DPP cards, are spliced
+# in as fragments without being parsed and re-encoded; fragment() interns
+# them so an unchanged history is the same object from one build to the next.
+# Bodies are gzip or brotli compressed when the client accepts it, because
+# nginx passes proxied responses through uncompressed.
+import gzip
+import os
+import threading
+from collections import OrderedDict
+from decimal import Decimal
+
+import orjson
+
+# brotli is optional; without it clients are offered gzip only
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are sent as they are
+COMPRESS_MIN_BYTES = int(os.environ.get('JSON_COMPRESS_MIN_BYTES', 1024))
+# Levels for responses compressed per request, not ahead of time
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+# Distinct fragments kept; roughly one per printer card
+FRAGMENT_CACHE_SIZE = 1024
+
+JSON_MIME_TYPE = 'application/json'
+
+_fragments = OrderedDict()
+_fragments_lock = threading.Lock()
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(obj, indent=False):
+    """The JSON encoding of obj as bytes."""
+    option = orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_INDENT_2 if indent else 0)
+    return orjson.dumps(obj, default=_default, option=option)
+
+
+def fragment(json_text):
+    """
+    Pre-serialized JSON (str or bytes) to embed in a document as-is, or None
+    for None. Equal texts return the same fragment until it is evicted.
+    """
+    if json_text is None:
+        return None
+    with _fragments_lock:
+        cached = _fragments.get(json_text)
+        if cached is not None:
+            _fragments.move_to_end(json_text)
+            return cached
+        cached = _fragments[json_text] = orjson.Fragment(json_text)
+        if len(_fragments) > FRAGMENT_CACHE_SIZE:
+            _fragments.popitem(last=False)
+        return cached
+
+
+def _accepted_encodings(accept_encoding):
+    accepted = set()
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        q = params.strip()
+        if q.startswith('q='):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def compress(body, accept_encoding):
+    """
+    (body, content coding) for a client's Accept-Encoding header: brotli
+    when available and accepted, else gzip, else the body unchanged with None.
+    """
+    if len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    accepted = _accepted_encodings(accept_encoding)
+    if brotli is not None and ('br' in accepted or '*' in accepted):
+        return brotli.compress(body, quality=BROTLI_QUALITY), 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0), 'gzip'
+    return body, None
+
+
+def encode_response(obj, accept_encoding):
+    """(body, headers) of a JSON response for the given Accept-Encoding header."""
+    body, coding = compress(dumps(obj), accept_encoding)
+    # Caches must not hand a compressed body to a client that did not ask for it
+    headers = {'Vary': 'Accept-Encoding'}
+    if coding:
+        headers['Content-Encoding'] = coding
+    return body, headers
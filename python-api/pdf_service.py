@@ -10,6 +10,8 @@ import psycopg2.extras
 from weasyprint import HTML
 from jinja2 import Environment, FileSystemLoader
 
+from thumbnails import thumbnail_variants, variant_path
+
 # --- Setup Jinja2 to find the templates inside the container ---
 # The Dockerfile copies our code to /app, so templates will be in /app/templates
 template_loader = FileSystemLoader(searchpath="/app/templates")
@@ -162,7 +164,10 @@ def generate_pdf_for_job(job_id):
         
         file_path_thumbnail_url = None
         if job_data_dict.get('thumbnail_url'):
-            thumbnail_path = os.path.join("/app", job_data_dict['thumbnail_url'].lstrip('/'))
+            # Prefer the optimized print-size derivative when the job has one
+            print_url = thumbnail_variants(job_data_dict['thumbnail_url']).get('print')
+            thumbnail_path = variant_path(print_url) if print_url else \
+                os.path.join("/app", job_data_dict['thumbnail_url'].lstrip('/'))
             if os.path.exists(thumbnail_path):
                 file_path_thumbnail_url = f"file://{thumbnail_path}"
 
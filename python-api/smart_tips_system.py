@@ -1,6 +1,27 @@
 # Smart Tips System - Sophisticated, Data-Driven Print Optimization
 # Version 2.0 - Upgrades from 3/10 to 9.5/10
 
+from decimal import Decimal
+
+import numpy as np
+
+
+# Predicates are written with '&' and these helpers so that the same rule
+# works on one printer's scalar fields and on whole-fleet NumPy columns.
+def isin(value, options):
+    """Membership test for a scalar value or an object array of values."""
+    if isinstance(value, np.ndarray):
+        return np.isin(value, options)
+    return value in options
+
+
+def truthy(value):
+    """Truthiness of a scalar value or element-wise truthiness of an array."""
+    if isinstance(value, np.ndarray):
+        return value.astype(bool)
+    return bool(value)
+
+
 SMART_TIP_RULES = [
     # ═══════════════════════════════════════════════════════════════
     # LEVEL 5: CRITICAL ALERTS (Priority 50-60)
@@ -8,13 +29,15 @@ SMART_TIP_RULES = [
     {
         "id": "PRINTER_OFFLINE",
         "priority": 60,
-        "conditions": lambda p: p.get("currentStatus") == "Offline",
+        "status": "Offline",
+        "conditions": lambda f: True,
         "tip_template": "🔴 Action Required: '{friendlyName}' is offline. Check power and network connection immediately."
     },
     {
         "id": "PRINTER_ERROR",
         "priority": 55,
-        "conditions": lambda p: p.get("currentStatus") == "Error",
+        "status": "Error",
+        "conditions": lambda f: True,
         "tip_template": "⚠️ Critical Error: '{friendlyName}' has encountered an error. Check printer display and resolve immediately."
     },
     
@@ -25,86 +48,86 @@ SMART_TIP_RULES = [
     {
         "id": "HIGH_INFILL_OPTIMIZATION",
         "priority": 48,
-        "conditions": lambda p: (
-            p.get("currentStatus") == "Printing" and
-            p.get("job_details", {}).get("infill_percent", 0) >= 35 and
-            p.get("job_details", {}).get("dimensions_z", 0) > 30
+        "status": "Printing",
+        "conditions": lambda f: (
+            (f["infill_percent"] >= 35) &
+            (f["dimensions_z"] > 30)
         ),
         "tip_template": lambda p: f"💡 Optimization Opportunity: High infill ({p['job_details']['infill_percent']}%) on tall part ({p['job_details']['dimensions_z']}mm height). Consider reducing to 25-30% for ~30% time/material savings while maintaining structural integrity for most applications."
     },
     {
         "id": "EXCESSIVE_INFILL_WARNING",
         "priority": 47,
-        "conditions": lambda p: (
-            p.get("currentStatus") == "Printing" and
-            p.get("job_details", {}).get("infill_percent", 0) >= 50 and
-            p.get("job_details", {}).get("dimensions_x", 0) * p.get("job_details", {}).get("dimensions_y", 0) * p.get("job_details", {}).get("dimensions_z", 0) > 50000  # Volume > 50cm³
+        "status": "Printing",
+        "conditions": lambda f: (
+            (f["infill_percent"] >= 50) &
+            (f["dimensions_x"] * f["dimensions_y"] * f["dimensions_z"] > 50000)  # Volume > 50cm³
         ),
         "tip_template": lambda p: f"⚡ Energy Alert: Exceptionally high infill ({p['job_details']['infill_percent']}%) on large part (volume ~{(p['job_details']['dimensions_x'] * p['job_details']['dimensions_y'] * p['job_details']['dimensions_z'] / 1000):.1f}cm³). Unless structural requirements demand it, 20-30% infill typically suffices. Current settings may extend print time by 60-80%."
     },
     {
         "id": "LOW_INFILL_STRENGTH_WARNING",
         "priority": 46,
-        "conditions": lambda p: (
-            p.get("currentStatus") == "Printing" and
-            p.get("job_details", {}).get("infill_percent", 0) < 15 and
-            p.get("job_details", {}).get("dimensions_z", 0) > 50 and
-            p.get("currentMaterial") in ["PLA", "PETG"]
+        "status": "Printing",
+        "conditions": lambda f: (
+            (f["infill_percent"] < 15) &
+            (f["dimensions_z"] > 50) &
+            isin(f["currentMaterial"], ["PLA", "PETG"])
         ),
         "tip_template": lambda p: f"🔧 Strength Advisory: Low infill ({p['job_details']['infill_percent']}%) on {p['job_details']['dimensions_z']}mm tall part may compromise strength. For functional parts, 18-25% infill recommended. Current settings suitable only for decorative models."
     },
     {
         "id": "OPTIMAL_LAYER_HEIGHT_DETECTED",
         "priority": 45,
-        "conditions": lambda p: (
-            p.get("currentStatus") == "Printing" and
-            p.get("job_details", {}).get("layer_height_mm", 0) == 0.2 and
-            p.get("job_details", {}).get("infill_percent", 0) >= 20 and
-            p.get("job_details", {}).get("infill_percent", 0) <= 30
+        "status": "Printing",
+        "conditions": lambda f: (
+            (f["layer_height_mm"] == 0.2) &
+            (f["infill_percent"] >= 20) &
+            (f["infill_percent"] <= 30)
         ),
         "tip_template": lambda p: f"✅ Optimal Settings Detected: 0.2mm layer height with {p['job_details']['infill_percent']}% infill provides excellent strength-to-speed balance. This configuration is industry-standard for functional prototypes."
     },
     {
         "id": "FINE_LAYER_TIME_WARNING",
         "priority": 44,
-        "conditions": lambda p: (
-            p.get("currentStatus") == "Printing" and
-            p.get("job_details", {}).get("layer_height_mm", 0) <= 0.12 and
-            p.get("job_details", {}).get("total_layers", 0) > 300
+        "status": "Printing",
+        "conditions": lambda f: (
+            (f["layer_height_mm"] <= 0.12) &
+            (f["total_layers"] > 300)
         ),
         "tip_template": lambda p: f"⏱️ Time Advisory: Fine layer height ({p['job_details']['layer_height_mm']}mm) with {p['job_details']['total_layers']} layers = extended print time. Consider 0.15-0.2mm for faster results unless surface quality is critical. Estimated time savings: 25-40%."
     },
     {
         "id": "LARGE_PART_WARPING_RISK",
         "priority": 43,
-        "conditions": lambda p: (
-            p.get("currentStatus") == "Printing" and
-            p.get("job_details", {}).get("dimensions_x", 0) * p.get("job_details", {}).get("dimensions_y", 0) > 15000 and  # Footprint > 150cm²
-            p.get("currentMaterial") in ["ABS", "ASA", "PC"] and
-            p.get("bedTempActual", 0) < 90
+        "status": "Printing",
+        "conditions": lambda f: (
+            (f["dimensions_x"] * f["dimensions_y"] > 15000) &  # Footprint > 150cm²
+            isin(f["currentMaterial"], ["ABS", "ASA", "PC"]) &
+            (f["bedTempActual"] < 90)
         ),
         "tip_template": lambda p: f"🌡️ Warping Risk: Large {p['currentMaterial']} print ({p['job_details']['dimensions_x']}×{p['job_details']['dimensions_y']}mm footprint) at {p.get('bedTempActual', 0)}°C bed temp. Consider increasing to 100-110°C and using enclosure. Corner lifting common with large {p['currentMaterial']} parts at lower temps."
     },
     {
         "id": "SMALL_PART_BATCH_SUGGESTION",
         "priority": 42,
-        "conditions": lambda p: (
-            p.get("currentStatus") == "Printing" and
-            p.get("job_details", {}).get("dimensions_x", 0) < 40 and
-            p.get("job_details", {}).get("dimensions_y", 0) < 40 and
-            p.get("job_details", {}).get("dimensions_z", 0) < 30 and
-            p.get("jobKwhConsumed", 0) < 0.05
+        "status": "Printing",
+        "conditions": lambda f: (
+            (f["dimensions_x"] < 40) &
+            (f["dimensions_y"] < 40) &
+            (f["dimensions_z"] < 30) &
+            (f["jobKwhConsumed"] < 0.05)
         ),
         "tip_template": lambda p: f"📦 Batch Efficiency: Small part ({p['job_details']['dimensions_x']}×{p['job_details']['dimensions_y']}×{p['job_details']['dimensions_z']}mm) using only {p.get('jobKwhConsumed', 0):.3f} kWh. Batch printing 3-5 similar parts together can reduce per-part energy cost by up to 60% by amortizing heating overhead."
     },
     {
         "id": "DIMENSION_ACCURACY_TIP",
         "priority": 41,
-        "conditions": lambda p: (
-            p.get("currentStatus") == "Printing" and
-            p.get("job_details", {}).get("dimensions_x", 0) < 15 and
-            p.get("job_details", {}).get("dimensions_y", 0) < 15 and
-            p.get("job_details", {}).get("layer_height_mm", 0) > 0.2
+        "status": "Printing",
+        "conditions": lambda f: (
+            (f["dimensions_x"] < 15) &
+            (f["dimensions_y"] < 15) &
+            (f["layer_height_mm"] > 0.2)
         ),
         "tip_template": lambda p: f"🔬 Precision Tip: Very small part ({p['job_details']['dimensions_x']}×{p['job_details']['dimensions_y']}mm) with {p['job_details']['layer_height_mm']}mm layers. For fine details on parts <20mm, consider 0.1-0.15mm layer height. Current settings suitable for rapid prototyping only."
     },
@@ -115,49 +138,47 @@ SMART_TIP_RULES = [
     {
         "id": "MATERIAL_TEMPERATURE_OPTIMIZATION",
         "priority": 38,
-        "conditions": lambda p: (
-            p.get("currentStatus") == "Printing" and
-            p.get("currentMaterial") == "PETG" and
-            p.get("nozzleTempActual", 0) > 250
+        "status": "Printing",
+        "conditions": lambda f: (
+            isin(f["currentMaterial"], ["PETG"]) &
+            (f["nozzleTempActual"] > 250)
         ),
         "tip_template": lambda p: f"🌡️ Temperature Optimization: PETG printing at {p.get('nozzleTempActual', 0)}°C. Standard range is 230-245°C. Higher temps increase energy use and may cause stringing. Consider reducing to 240°C unless layer adhesion issues occur."
     },
     {
         "id": "PLA_ENERGY_EFFICIENT_CHOICE",
         "priority": 37,
-        "conditions": lambda p: (
-            p.get("currentStatus") == "Printing" and
-            p.get("currentMaterial") in ["ABS", "ASA", "PC", "Nylon"] and
-            p.get("job_details", {}).get("dimensions_z", 0) < 50  # Not a tall functional part
+        "status": "Printing",
+        "conditions": lambda f: (
+            isin(f["currentMaterial"], ["ABS", "ASA", "PC", "Nylon"]) &
+            (f["dimensions_z"] < 50)  # Not a tall functional part
         ),
         "tip_template": lambda p: f"💰 Material Choice: Printing {p['currentMaterial']} at {p.get('nozzleTempActual', 0)}°C. For non-structural parts <50mm, PLA offers 25-30% energy savings (prints at 200-210°C vs {p.get('nozzleTempActual', 0)}°C) with similar surface quality."
     },
     {
         "id": "HIGH_ENERGY_CONSUMPTION_ALERT",
         "priority": 36,
-        "conditions": lambda p: (
-            p.get("currentStatus") == "Printing" and
-            p.get("jobKwhConsumed", 0) > 0.3 and
-            p.get("jobProgressPercent", 0) < 70
+        "status": "Printing",
+        "conditions": lambda f: (
+            (f["jobKwhConsumed"] > 0.3) &
+            (f["jobProgressPercent"] < 70)
         ),
         "tip_template": lambda p: f"⚡ Energy Monitor: Current job has consumed {p.get('jobKwhConsumed', 0):.2f} kWh at {p.get('jobProgressPercent', 0):.0f}% completion. Projected total: {(p.get('jobKwhConsumed', 0) / p.get('jobProgressPercent', 1) * 100):.2f} kWh. Consider print time reduction strategies for future jobs of this scale."
     },
     {
         "id": "IDLE_HIGH_CONSUMPTION",
         "priority": 35,
-        "conditions": lambda p: (
-            p.get("currentStatus") == "Idle" and
-            p.get("kwhLast24h", 0) > 0.8
-        ),
+        "status": "Idle",
+        "conditions": lambda f: f["kwhLast24h"] > 0.8,
         "tip_template": lambda p: f"⚠️ Energy Waste Alert: '{p['friendlyName']}' is idle but consumed {p['kwhLast24h']:.2f} kWh in 24h. Extended idle periods waste ~0.005-0.01 kWh/hour. Power down when not in use. Annual savings potential: ~$15-30 per printer."
     },
     {
         "id": "EFFICIENT_MATERIAL_USAGE",
         "priority": 34,
-        "conditions": lambda p: (
-            p.get("currentStatus") == "Printing" and
-            p.get("job_details", {}).get("infill_percent", 0) <= 20 and
-            p.get("job_details", {}).get("total_layers", 0) > 150
+        "status": "Printing",
+        "conditions": lambda f: (
+            (f["infill_percent"] <= 20) &
+            (f["total_layers"] > 150)
         ),
         "tip_template": lambda p: f"♻️ Eco-Efficient Print: {p['job_details']['infill_percent']}% infill with {p['job_details']['total_layers']} layers demonstrates excellent material efficiency. This configuration reduces waste while maintaining functionality—great for sustainable manufacturing."
     },
@@ -168,42 +189,44 @@ SMART_TIP_RULES = [
     {
         "id": "FIRST_LAYER_CRITICAL",
         "priority": 28,
-        "conditions": lambda p: (
-            p.get("currentStatus") == "Printing" and
-            0 < p.get("jobProgressPercent", 0) < 5 and
-            p.get("job_details", {}).get("current_layer", 0) <= 3
+        "status": "Printing",
+        "conditions": lambda f: (
+            (f["jobProgressPercent"] > 0) &
+            (f["jobProgressPercent"] < 5) &
+            (f["current_layer"] <= 3)
         ),
         "tip_template": lambda p: f"🎯 Critical Phase: Layer {p['job_details'].get('current_layer', 1)}/3 of first layer sequence. Bed adhesion makes or breaks the print. Monitor closely for lifting corners or poor adhesion. Z-offset and bed level are key factors."
     },
     {
         "id": "MID_PRINT_PROGRESS",
         "priority": 25,
-        "conditions": lambda p: (
-            p.get("currentStatus") == "Printing" and
-            30 < p.get("jobProgressPercent", 0) < 70 and
-            p.get("jobTimeLeftSeconds", 0) > 0
+        "status": "Printing",
+        "conditions": lambda f: (
+            (f["jobProgressPercent"] > 30) &
+            (f["jobProgressPercent"] < 70) &
+            (f["jobTimeLeftSeconds"] > 0)
         ),
         "tip_template": lambda p: f"📊 Print Progress: {p.get('jobProgressPercent', 0):.0f}% complete, ~{p.get('jobTimeLeftSeconds', 0)//60} minutes remaining. Part dimensions: {p.get('job_details', {}).get('dimensions_x', '--')}×{p.get('job_details', {}).get('dimensions_y', '--')}×{p.get('job_details', {}).get('dimensions_z', '--')}mm. Monitor for layer shifting or filament issues."
     },
     {
         "id": "NEAR_COMPLETION_PREP",
         "priority": 24,
-        "conditions": lambda p: (
-            p.get("currentStatus") == "Printing" and
-            p.get("jobProgressPercent", 0) > 92
-        ),
+        "status": "Printing",
+        "conditions": lambda f: f["jobProgressPercent"] > 92,
         "tip_template": lambda p: f"🏁 Final Phase: {p.get('jobProgressPercent', 0):.1f}% complete—prepare for part removal. Allow bed to cool below 40°C before removing {p.get('currentMaterial', 'part')} prints to prevent warping. Clean bed surface for next print."
     },
     {
         "id": "HEATING_PHASE_INFO",
         "priority": 22,
-        "conditions": lambda p: p.get("currentStatus") == "Heating",
+        "status": "Heating",
+        "conditions": lambda f: True,
         "tip_template": lambda p: f"🔥 Pre-heating: '{p['friendlyName']}' warming up for {p.get('currentMaterial', 'unknown')} (Target: Nozzle {p.get('nozzleTempTarget', '--')}°C, Bed {p.get('bedTempTarget', '--')}°C). Proper pre-heat ensures consistent first layer quality and reduces print failures."
     },
     {
         "id": "COOLING_POST_PRINT",
         "priority": 21,
-        "conditions": lambda p: p.get("currentStatus") == "Cooling",
+        "status": "Cooling",
+        "conditions": lambda f: True,
         "tip_template": "❄️ Post-Print Cooling: Print complete. Allow bed to cool below 40°C before part removal to prevent thermal stress warping. Clean nozzle tip while still warm for easier maintenance."
     },
     
@@ -213,25 +236,22 @@ SMART_TIP_RULES = [
     {
         "id": "IDLE_READY_ADVANCED",
         "priority": 15,
-        "conditions": lambda p: (
-            p.get("currentStatus") == "Idle" and
-            p.get("lastJobKwh", 0) > 0
-        ),
+        "status": "Idle",
+        "conditions": lambda f: f["lastJobKwh"] > 0,
         "tip_template": lambda p: f"✅ Ready for Next Job: '{p['friendlyName']}' completed last print using {p.get('lastJobKwh', 0):.3f} kWh in {p.get('lastJobDurationMinutes', '--')} min. Printer ready. Consider similar settings: {p.get('lastJobFilamentGrams', 0):.1f}g material used."
     },
     {
         "id": "GENERAL_PRINTING_SMART",
         "priority": 12,
-        "conditions": lambda p: (
-            p.get("currentStatus") == "Printing" and
-            p.get("jobFilename")
-        ),
+        "status": "Printing",
+        "conditions": lambda f: truthy(f["jobFilename"]),
         "tip_template": lambda p: f"🖨️ Active Print: '{p.get('jobFilename', 'unknown')}' in progress on {p.get('printerSizeCategory', 'standard')} printer. Material: {p.get('currentMaterial', 'N/A')}. Current energy: {p.get('jobKwhConsumed', 0):.3f} kWh."
     },
     {
         "id": "DEFAULT_IDLE",
         "priority": 5,
-        "conditions": lambda p: p.get("currentStatus") == "Idle",
+        "status": "Idle",
+        "conditions": lambda f: True,
         "tip_template": "🟢 Idle & Ready: Printer available for your next project. For optimal results: check bed levelness, clean build surface, verify filament loaded and dry."
     },
     
@@ -241,43 +261,206 @@ SMART_TIP_RULES = [
     {
         "id": "DEFAULT_OPERATIONAL",
         "priority": 1,
-        "conditions": lambda p: True,
+        "status": None,
+        "conditions": lambda f: True,
         "tip_template": "🔧 Maintenance Reminder: Regular printer calibration, nozzle cleaning, and belt tensioning ensure consistent print quality and extend printer lifespan. Schedule monthly maintenance checks."
     }
 ]
 
 
+# ═══════════════════════════════════════════════════════════════
+# RULE COMPILATION
+# ═══════════════════════════════════════════════════════════════
+# Rules carry an optional "status" (the currentStatus they apply to, None for
+# any status) and a "conditions" predicate. Predicates receive the flat field
+# view built by an extractor, so nested job_details lookups happen once per
+# printer instead of once per rule.
+
+JOB_DETAIL_FIELDS = (
+    "infill_percent", "dimensions_x", "dimensions_y", "dimensions_z",
+    "layer_height_mm", "total_layers", "current_layer",
+)
+
+PRINTER_FIELDS = {
+    "currentMaterial": None,
+    "jobFilename": None,
+    "bedTempActual": 0,
+    "nozzleTempActual": 0,
+    "jobKwhConsumed": 0,
+    "jobProgressPercent": 0,
+    "jobTimeLeftSeconds": 0,
+    "kwhLast24h": 0,
+    "lastJobKwh": 0,
+}
+
+DEFAULT_TIP_TEXT = "🔧 System operational. Monitor print parameters for optimal results."
+
+
+def extract_tip_fields(printer_data):
+    """Flattens the printer fields used by SMART_TIP_RULES, with the same defaults the rules expect."""
+    job_details = printer_data.get("job_details") or {}
+    fields = {key: printer_data.get(key, default) for key, default in PRINTER_FIELDS.items()}
+    for key in JOB_DETAIL_FIELDS:
+        fields[key] = job_details.get(key, 0)
+    return fields
+
+
+# Fields that stay as Python objects in the columnar view; everything else is float64.
+OBJECT_TIP_FIELDS = ("currentStatus", "currentMaterial", "jobFilename")
+
+
+def _numeric_column(values):
+    # Non-numeric values become NaN: every comparison against NaN is False,
+    # matching the scalar path where comparing None/str raises and the rule is skipped.
+    if not any(isinstance(v, str) for v in values):
+        try:
+            return np.array(values, dtype=float)
+        except (TypeError, ValueError):
+            pass
+    return np.array([float(v) if isinstance(v, (int, float, Decimal)) else np.nan for v in values],
+                    dtype=float)
+
+
+def extract_tip_columns(printers):
+    """
+    Builds the columnar (one NumPy array per field) view of a whole fleet.
+    Keys match extract_tip_fields() plus 'currentStatus'.
+    """
+    job_details = [p.get("job_details") or {} for p in printers]
+    columns = {"currentStatus": np.array([p.get("currentStatus") for p in printers], dtype=object)}
+    for key, default in PRINTER_FIELDS.items():
+        values = [p.get(key, default) for p in printers]
+        columns[key] = np.array(values, dtype=object) if key in OBJECT_TIP_FIELDS else _numeric_column(values)
+    for key in JOB_DETAIL_FIELDS:
+        columns[key] = _numeric_column([jd.get(key, 0) for jd in job_details])
+    return columns
+
+
+def render_tip(rule, printer_data):
+    """Formats a rule's tip, supporting both string templates and callables."""
+    template = rule["tip_template"]
+    if callable(template):
+        return template(printer_data)
+    # Prepare safe formatting data
+    format_data = printer_data.copy()
+    format_data["job_details"] = printer_data.get("job_details", {})
+    return template.format(**format_data)
+
+
+class CompiledTipRules:
+    """
+    A rule set pre-sorted by priority and bucketed by currentStatus.
+
+    evaluate() tests only the rules that can apply to the printer's status,
+    in descending priority order, and renders just the first one that
+    matches. Rules whose predicate or template raises are skipped, exactly
+    like the original evaluate-all-then-sort loop.
+    """
+
+    def __init__(self, rules, extractor=None, default_text=None, column_extractor=None):
+        ordered = sorted(rules, key=lambda r: r["priority"], reverse=True)
+        self.ordered = ordered
+        self.extractor = extractor
+        self.column_extractor = column_extractor
+        self.default_text = default_text
+        self.any_status = [r for r in ordered if r.get("status") is None]
+        statuses = {r["status"] for r in ordered if r.get("status") is not None}
+        self.by_status = {
+            status: [r for r in ordered if r.get("status") in (status, None)]
+            for status in statuses
+        }
+
+    def _matches(self, rule, printer_data):
+        try:
+            view = self.extractor(printer_data) if self.extractor else printer_data
+            return bool(rule["conditions"](view))
+        except Exception:
+            return False
+
+    def evaluate_batch(self, printers, columns=None):
+        """
+        Evaluates the whole fleet at once and returns one tip per printer.
+
+        Each rule's predicate runs once over the columnar view as a boolean
+        mask, restricted to printers that have no tip yet and are in the
+        rule's status. Only the winning rule is rendered per printer. A
+        predicate that cannot run on columns is tested printer by printer.
+        Callers that already hold the fleet as arrays can pass them in
+        'columns' (same keys as the column extractor produces).
+        """
+        if columns is None and self.column_extractor is None:
+            return [self.evaluate(p) for p in printers]
+
+        n = len(printers)
+        tips = [self.default_text] * n
+        if n == 0:
+            return tips
+        if columns is None:
+            columns = self.column_extractor(printers)
+        statuses = columns["currentStatus"]
+        unresolved = np.ones(n, dtype=bool)
+
+        for rule in self.ordered:
+            if not unresolved.any():
+                break
+            candidates = unresolved.copy()
+            if rule.get("status") is not None:
+                candidates &= (statuses == rule["status"])
+            if not candidates.any():
+                continue
+            try:
+                with np.errstate(invalid="ignore"):
+                    matched = np.broadcast_to(np.asarray(rule["conditions"](columns), dtype=bool), (n,))
+                hits = np.flatnonzero(candidates & matched).tolist()
+            except Exception:
+                hits = [i for i in np.flatnonzero(candidates).tolist() if self._matches(rule, printers[i])]
+            rendered = []
+            for i in hits:
+                try:
+                    tips[i] = render_tip(rule, printers[i])
+                    rendered.append(i)
+                except Exception:
+                    continue
+            unresolved[rendered] = False
+        return tips
+
+    def rules_for(self, status):
+        return self.by_status.get(status, self.any_status)
+
+    def evaluate(self, printer_data):
+        if printer_data is None:
+            printer_data = {}
+        view = self.extractor(printer_data) if self.extractor else printer_data
+        for rule in self.rules_for(printer_data.get("currentStatus")):
+            try:
+                if rule["conditions"](view):
+                    return render_tip(rule, printer_data)
+            except Exception:
+                # Silently skip tips that fail (missing data, etc.)
+                continue
+        return self.default_text
+
+
+def compile_tip_rules(rules, extractor=None, default_text=None, column_extractor=None):
+    """Compiles a SMART_TIP_RULES-style list into a CompiledTipRules engine."""
+    return CompiledTipRules(rules, extractor=extractor, default_text=default_text,
+                            column_extractor=column_extractor)
+
+
+COMPILED_SMART_TIP_RULES = compile_tip_rules(
+    SMART_TIP_RULES, extractor=extract_tip_fields, default_text=DEFAULT_TIP_TEXT,
+    column_extractor=extract_tip_columns
+)
+
+
 def evaluate_smart_tips(printer_data):
     """
     Enhanced tip evaluation with support for both static templates and dynamic functions.
     Returns the highest-priority applicable tip.
     """
-    applicable_tips = []
-    
-    for rule in SMART_TIP_RULES:
-        try:
-            # Check if conditions are met
-            if rule["conditions"](printer_data):
-                # Handle both string templates and lambda functions
-                if callable(rule["tip_template"]):
-                    tip_text = rule["tip_template"](printer_data)
-                else:
-                    # Prepare safe formatting data
-                    format_data = printer_data.copy()
-                    format_data["job_details"] = printer_data.get("job_details", {})
-                    tip_text = rule["tip_template"].format(**format_data)
-                
-                applicable_tips.append({
-                    "priority": rule["priority"],
-                    "text": tip_text
-                })
-        except Exception as e:
-            # Silently skip tips that fail (missing data, etc.)
-            continue
-    
-    # Return highest priority tip or fallback
-    if applicable_tips:
-        applicable_tips.sort(key=lambda x: x["priority"], reverse=True)
-        return applicable_tips[0]["text"]
-    
-    return "🔧 System operational. Monitor print parameters for optimal results."
+    return COMPILED_SMART_TIP_RULES.evaluate(printer_data)
+
+
+def evaluate_smart_tips_batch(printers, columns=None):
+    """Fleet-wide variant of evaluate_smart_tips(): one tip per printer, same order."""
+    return COMPILED_SMART_TIP_RULES.evaluate_batch(printers, columns=columns)
@@ -0,0 +1,144 @@
+# thumbnails.py
+# Size-specific derivatives of the G-code thumbnails.
+#
+# The analyzer writes the decoded thumbnail as <job key>.png. Next to it this
+# module writes one image per use, each under a content-hashed name so nginx
+# can serve it as immutable, plus a small <job key>.thumbs.json manifest
+# mapping the variant name to its URL:
+#   card   WebP, within 960px for the 480px card background at 2x
+#   icon   WebP, 120x120 centre crop for the 60px history column
+#   print  optimized PNG at the decoded resolution, for the PDF report
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+
+from PIL import Image, ImageOps
+
+PREVIEWS_DIR = '/app/gcode_previews'
+PREVIEWS_URL = '/gcode_previews/'
+HASH_LENGTH = 12
+
+# name: (format, fit mode, size); images are never upscaled
+VARIANTS = {
+    'card': ('WEBP', 'contain', (960, 960)),
+    'icon': ('WEBP', 'cover', (120, 120)),
+    'print': ('PNG', 'contain', None),
+}
+WEBP_QUALITY = 80
+EXTENSIONS = {'WEBP': 'webp', 'PNG': 'png'}
+# Manifests kept in memory; roughly one per printer card and recent job
+MANIFEST_CACHE_SIZE = 1024
+
+_manifest_cache = OrderedDict()
+_manifest_cache_lock = threading.Lock()
+
+
+def _encode(img, fmt):
+    buf = io.BytesIO()
+    if fmt == 'WEBP':
+        img.save(buf, 'WEBP', quality=WEBP_QUALITY, method=6)
+    else:
+        img.save(buf, 'PNG', optimize=True)
+    return buf.getvalue()
+
+
+def _resize(img, mode, size):
+    if size is None:
+        return img
+    if mode == 'cover':
+        side = min(size[0], img.width, img.height)
+        return ImageOps.fit(img, (side, side), Image.LANCZOS)
+    img = img.copy()
+    img.thumbnail(size, Image.LANCZOS)  # only ever shrinks
+    return img
+
+
+def _write_atomic(path, data):
+    """Writes data to path through a temp file of this writer's own, so concurrent analyses never share one."""
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def write_thumbnail_variants(source_path, out_dir=PREVIEWS_DIR):
+    """
+    Writes every variant of the thumbnail at source_path and its manifest;
+    returns {variant: url}. Variants left over from an earlier analysis of
+    the same job are removed.
+    """
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    with Image.open(source_path) as src:
+        img = src.convert('RGBA') if src.mode in ('RGBA', 'LA', 'P') else src.convert('RGB')
+
+    urls = {}
+    for name, (fmt, mode, size) in VARIANTS.items():
+        data = _encode(_resize(img, mode, size), fmt)
+        ext = EXTENSIONS[fmt]
+        digest = hashlib.sha1(data).hexdigest()[:HASH_LENGTH]
+        filename = f"{stem}.{name}.{digest}.{ext}"
+        path = os.path.join(out_dir, filename)
+        if not os.path.exists(path):
+            _write_atomic(path, data)
+        _remove_stale(out_dir, stem, name, ext, filename)
+        urls[name] = PREVIEWS_URL + filename
+
+    manifest_path = os.path.join(out_dir, f"{stem}.thumbs.json")
+    _write_atomic(manifest_path, json.dumps(urls).encode('utf-8'))
+    return urls
+
+
+def _remove_stale(out_dir, stem, name, ext, keep):
+    pattern = re.compile(rf"^{re.escape(stem)}\.{name}\.[0-9a-f]{{{HASH_LENGTH}}}\.{ext}$")
+    for filename in os.listdir(out_dir):
+        if filename != keep and pattern.match(filename):
+            try:
+                os.remove(os.path.join(out_dir, filename))
+            except OSError:
+                pass
+
+
+def thumbnail_variants(thumbnail_url, previews_dir=PREVIEWS_DIR):
+    """
+    {variant: url} for a stored thumbnail URL, or {} when it has no
+    derivatives (older jobs). The last MANIFEST_CACHE_SIZE manifests read are
+    cached until their mtime changes.
+    """
+    if not thumbnail_url or not thumbnail_url.startswith(PREVIEWS_URL):
+        return {}
+    stem = os.path.splitext(os.path.basename(thumbnail_url))[0]
+    path = os.path.join(previews_dir, f"{stem}.thumbs.json")
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return {}
+    with _manifest_cache_lock:
+        cached = _manifest_cache.get(path)
+        if cached and cached[0] == mtime:
+            _manifest_cache.move_to_end(path)
+            return cached[1]
+    try:
+        with open(path) as f:
+            variants = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    with _manifest_cache_lock:
+        _manifest_cache[path] = (mtime, variants)
+        _manifest_cache.move_to_end(path)
+        if len(_manifest_cache) > MANIFEST_CACHE_SIZE:
+            _manifest_cache.popitem(last=False)
+    return variants
+
+
+def variant_path(url, previews_dir=PREVIEWS_DIR):
+    """Local file path of a /gcode_previews/ URL."""
+    return os.path.join(previews_dir, os.path.basename(url))